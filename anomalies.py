@@ -0,0 +1,98 @@
+"""Structured, buffered record of the anomalies the loaders find in the CUNYfirst queries.
+
+Each anomaly is a typed record: the step that found it, a category, the rule_key and/or course_id it
+is about, a message, and whether the rule or course was kept or ignored. Records are buffered in
+memory and flushed to the anomalies table in COPY batches, on a connection of their own so they are
+kept even if the step that found them fails. Each step’s anomalies from its previous run are deleted
+when it starts.
+
+A step can also keep its traditional log file: the buffered records are written to it, one line
+each, when they are flushed.
+
+Example: which destination courses cause the most rules to be ignored?
+  select course_id, count(*)
+  from anomalies
+  where step = 'transfer_rules' and category like 'destination%' and not kept
+  group by course_id order by count desc;
+"""
+
+import sys
+
+from collections import Counter
+
+import psycopg
+
+BATCH_SIZE = 10_000
+
+_columns = 'step, category, rule_key, course_id, message, kept'
+
+
+class Anomalies:
+  """Buffered anomaly recorder for one step of the update."""
+
+  def __init__(self, step: str, log_file: str = None, batch_size: int = BATCH_SIZE):
+    self.step = step
+    self.batch_size = batch_size
+    self.buffer = []
+    self.counts = Counter()
+    self.log = open(log_file, 'w') if log_file else None
+    self.conn = psycopg.connect('dbname=cuny_curriculum', autocommit=True)
+    self.conn.execute("""
+                      create table if not exists anomalies (
+                        step text not null,
+                        category text not null,
+                        rule_key text,
+                        course_id integer,
+                        message text not null,
+                        kept boolean,
+                        recorded_at timestamptz default now());
+                      create index if not exists anomalies_step_category
+                        on anomalies (step, category)
+                      """)
+    self.conn.execute('delete from anomalies where step = %s', (step, ))
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  def add(self, category: str, message: str, rule_key=None, course_id: int = None,
+          kept: bool = None):
+    """Record an anomaly. Kept is None if the anomaly is not about keeping or ignoring anything."""
+    self.buffer.append((self.step, category, None if rule_key is None else str(rule_key),
+                        course_id, message, kept))
+    self.counts[category] += 1
+    if len(self.buffer) >= self.batch_size:
+      self.flush()
+
+  def flush(self):
+    """Copy the buffered anomalies to the db and the log file."""
+    if not self.buffer:
+      return
+    with self.conn.cursor() as cursor:
+      with cursor.copy(f'copy anomalies ({_columns}) from stdin') as copy:
+        for anomaly in self.buffer:
+          copy.write_row(anomaly)
+    if self.log:
+      self.log.writelines(_log_line(anomaly) for anomaly in self.buffer)
+    self.buffer.clear()
+
+  def close(self, file=sys.stderr):
+    """Flush any remaining anomalies, and print the number found in each category."""
+    self.flush()
+    if self.log:
+      self.log.close()
+    self.conn.close()
+    if self.counts:
+      print(f'{self.step} anomalies:', file=file)
+      for category, count in sorted(self.counts.items()):
+        print(f'  {count:>9,} {category}', file=file)
+
+
+def _log_line(anomaly: tuple) -> str:
+  """Format an anomaly for the log file."""
+  step, category, rule_key, course_id, message, kept = anomaly
+  subject = rule_key if rule_key is not None else f'{course_id:06}' if course_id else ''
+  outcome = '' if kept is None else ' Kept.' if kept else ' Ignored.'
+  return f'{subject} {message}{outcome}\n'.lstrip()
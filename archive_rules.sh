@@ -8,31 +8,37 @@ echo Archiving $update_date
 
 echo -n "source_courses ... "
 psql -Xqd cuny_curriculum <<EOD >rules_archive/${update_date}_source_courses.csv
-copy (select rule_key(rule_id) as rule_key,
-             course_id,
-             offer_nbr,
-             min_credits,
-             max_credits,
-             credit_source,
-             min_gpa,
-             max_gpa
-        from source_courses) to stdout csv
+copy (select r.rule_key,
+             s.course_id,
+             s.offer_nbr,
+             s.min_credits,
+             s.max_credits,
+             s.credit_source,
+             s.min_gpa,
+             s.max_gpa
+        from source_courses s
+             join transfer_rules r
+               on (r.destination_institution, r.id) = (s.destination_institution, s.rule_id))
+     to stdout csv
 EOD
 echo done
 
 echo -n "destination_courses ... "
 psql -Xqd cuny_curriculum <<EOD >rules_archive/${update_date}_destination_courses.csv
-copy (select rule_key(rule_id) as rule_key,
-             course_id,
-             offer_nbr,
-             transfer_credits
-        from destination_courses) to stdout csv
+copy (select r.rule_key,
+             d.course_id,
+             d.offer_nbr,
+             d.transfer_credits
+        from destination_courses d
+             join transfer_rules r
+               on (r.destination_institution, r.id) = (d.destination_institution, d.rule_id))
+     to stdout csv
 EOD
 echo done
 
 echo -n "effective_dates ... "
 psql -Xqd cuny_curriculum <<EOD >rules_archive/${update_date}_effective_dates.csv
-copy (select rule_key(id) as rule_key,
+copy (select rule_key,
              effective_date
         from transfer_rules) to stdout csv
 EOD
@@ -0,0 +1,96 @@
+"""Load CUNYfirst query files into db tables with COPY instead of one INSERT per row.
+
+A table is described by a dict that maps each of its columns either to the name of a query column or
+to a function that computes the value from a query row. Rows are namedtuples whose field names are
+the query’s column headings, normalized by column_name() unless the caller supplies its own
+normalization. A where function can be given to skip rows (ignored institutions, non-UGRD careers,
+and so on).
+
+Values are passed to COPY as they are, so there is no need to quote, escape, or smarten apostrophes
+to keep the SQL valid; None is loaded as null. Everything runs in the caller’s transaction.
+
+Example:
+  with psycopg.connect('dbname=cuny_curriculum') as conn:
+    with conn.cursor() as cursor:
+      load(cursor, 'cuny_careers', './latest_queries/ACAD_CAREER_TBL.csv',
+           {'institution': 'institution',
+            'career': 'career',
+            'description': 'descr',
+            'is_graduate': lambda row: row.graduate == 'Y'},
+           where=lambda row: row.institution not in ['UAPC1', 'MHC01'])
+"""
+
+import csv
+
+from collections import namedtuple
+
+
+def column_name(heading: str) -> str:
+  """The usual normalization of a query column heading."""
+  return heading.lower().replace(' ', '_').replace('/', '_')
+
+
+def query_rows(query_file, normalize=column_name, is_heading=None):
+  """Generate the data rows of a query file as namedtuples.
+
+  The first value generated is the list of (normalized) column names. The headings are on the first
+  line, or, if is_heading is given, on the first line it accepts; any lines before that (report
+  titles) are skipped.
+  """
+  with open(query_file, newline='', errors='replace') as csv_file:
+    reader = csv.reader(csv_file)
+    for headings in reader:
+      headings[0] = headings[0].replace('\ufeff', '')
+      if is_heading is None or is_heading(headings):
+        break
+    else:
+      raise ValueError(f'{query_file}: no column headings')
+    cols = [normalize(heading) for heading in headings]
+    yield cols
+    Row = namedtuple('Row', cols)
+    for line in reader:
+      yield Row._make(line)
+
+
+def copy_rows(cursor, table_name: str, column_names, rows) -> int:
+  """COPY an iterable of value sequences into the named columns of a table; return the row count."""
+  num_rows = 0
+  with cursor.copy(f'copy {table_name} ({", ".join(column_names)}) from stdin') as copy:
+    for row in rows:
+      copy.write_row(row)
+      num_rows += 1
+  return num_rows
+
+
+def load(cursor, table_name: str, query_file, columns: dict, where=None,
+         normalize=column_name, is_heading=None) -> int:
+  """Load a query file into a table, using the columns mapping. Returns the number of rows loaded.
+
+  If columns is a function, it is called with the query’s column names and must return the mapping;
+  that’s for tables that are defined by the query’s headings. For is_heading, see query_rows().
+  """
+  rows = query_rows(query_file, normalize, is_heading)
+  cols = next(rows)
+  if callable(columns):
+    columns = columns(cols)
+  getters = [source if callable(source) else _field_getter(cols.index(source))
+             for source in columns.values()]
+  return copy_rows(cursor, table_name, columns.keys(),
+                   ([getter(row) for getter in getters]
+                    for row in rows if where is None or where(row)))
+
+
+def all_columns(transform=None):
+  """Columns mapping for a table whose columns are the query’s columns, in order.
+
+  The optional transform is applied to every value.
+  """
+  def mapping(cols):
+    if transform is None:
+      return {col: col for col in cols}
+    return {col: (lambda row, index=index: transform(row[index])) for index, col in enumerate(cols)}
+  return mapping
+
+
+def _field_getter(index: int):
+  return lambda row: row[index]
@@ -0,0 +1,234 @@
+#! /usr/local/bin/python3
+"""Bulk-load mode: load big tables with no indexes or constraints, then build them all at once.
+
+The create_*.sql files define tables with their primary keys, unique constraints, and foreign keys,
+so every row inserted pays for index maintenance and foreign key checks. In bulk-load mode, once a
+step has created its tables:
+
+  defer()    Saves the DDL for the tables’ primary keys, unique constraints, foreign keys, and other
+             indexes in the deferred_ddl table; drops them; and makes the tables UNLOGGED.
+
+Then the step loads the tables, and commits. After that:
+
+  restore()  Builds the primary key and unique indexes and the other indexes in parallel, each on a
+             connection of its own, and attaches the constraints to their indexes; makes the tables
+             LOGGED again; adds the foreign keys NOT VALID; and validates them in parallel.
+
+The tables are made LOGGED before the foreign keys are added because a logged table can’t reference
+an unlogged one. Until then, a crash would empty the tables, but they are being rebuilt anyway.
+
+Partitioned tables (the transfer rule tables) have no storage of their own, so it is their
+partitions that are made UNLOGGED and LOGGED, and their indexes are built partition by partition, in
+parallel. Then the constraints and indexes are added to the partitioned tables, which just attaches
+the partitions’ indexes to them. Foreign keys on partitioned tables can’t be added NOT VALID, so
+they are added, and validated, one at a time.
+
+Because the DDL is kept in the deferred_ddl table, a restore that fails (a duplicate key, for
+example) can be re-run once the problem has been fixed. The indexes and constraints that were built
+before the failure have been committed, so the re-run skips them:
+  bulk_load_mode.py --restore transfer_rules source_courses destination_courses
+"""
+
+import argparse
+import re
+import sys
+
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg
+from psycopg import sql
+
+# Number of connections to use for building indexes and validating constraints
+WORKERS = 4
+
+
+def defer(conn, table_names: list):
+  """Save and drop the tables’ constraints and indexes, and make the tables unlogged.
+
+  Runs in the caller’s transaction, so the tables should just have been created.
+  """
+  conn.execute("""
+               create table if not exists deferred_ddl (
+                 table_name text not null,
+                 kind text not null,  -- primary key, unique, foreign key, or index
+                 name text not null,
+                 definition text not null,
+                 saved_at timestamptz default now(),
+                 primary key (table_name, name))
+               """)
+  conn.execute('delete from deferred_ddl where table_name = any(%s)', (table_names, ))
+
+  for table_name in table_names:
+    conn.execute("""
+                 insert into deferred_ddl (table_name, kind, name, definition)
+                 select %s, case contype when 'p' then 'primary key'
+                                         when 'u' then 'unique'
+                                         else 'foreign key' end,
+                        conname, pg_get_constraintdef(oid)
+                   from pg_constraint
+                  where conrelid = %s::regclass and contype in ('p', 'u', 'f')
+                    and conparentid = 0  -- not the partitions’ copies
+                 """, (table_name, table_name))
+    conn.execute("""
+                 insert into deferred_ddl (table_name, kind, name, definition)
+                 select %s, 'index', r.relname, pg_get_indexdef(i.indexrelid)
+                   from pg_index i join pg_class r on r.oid = i.indexrelid
+                  where i.indrelid = %s::regclass
+                    and not exists (select 1 from pg_constraint c
+                                     where c.conindid = i.indexrelid
+                                       and c.conrelid = i.indrelid)
+                 """, (table_name, table_name))
+
+  # Drop the foreign keys first: they depend on the primary keys and unique constraints they
+  # reference.
+  deferred = conn.execute("""
+                          select table_name, kind, name from deferred_ddl
+                           where table_name = any(%s)
+                           order by kind = 'foreign key' desc, kind = 'index'
+                          """, (table_names, )).fetchall()
+  for table_name, kind, name in deferred:
+    if kind == 'index':
+      conn.execute(sql.SQL('drop index {}').format(sql.Identifier(name)))
+    else:
+      conn.execute(sql.SQL('alter table {} drop constraint {}')
+                   .format(sql.Identifier(table_name), sql.Identifier(name)))
+  for leaf_name in _leaves(conn, table_names):
+    conn.execute(sql.SQL('alter table {} set unlogged').format(sql.Identifier(leaf_name)))
+
+
+def _partitions(conn, table_name: str) -> list:
+  """The leaf partitions of a partitioned table, or an empty list if it isn’t partitioned."""
+  return [row[0] for row in conn.execute("""
+          select c.relname from pg_partition_tree(%s) t join pg_class c on c.oid = t.relid
+           where t.isleaf and t.level > 0
+          """, (table_name, ))]
+
+
+def _leaves(conn, table_names: list) -> list:
+  """The tables that have storage: the partitions of partitioned tables, and the other tables."""
+  return [leaf_name for table_name in table_names
+          for leaf_name in (_partitions(conn, table_name) or [table_name])]
+
+
+def _leaf_name(leaf_name: str, table_name: str, name: str) -> str:
+  """Name for a partition’s copy of an index or constraint: transfer_rules_pkey on partition
+  transfer_rules_qns01 is transfer_rules_qns01_pkey.
+  """
+  if name.startswith(table_name):
+    return leaf_name + name[len(table_name):]
+  return f'{leaf_name}_{name}'
+
+
+def _has_constraint(conn, table_name: str, name: str) -> bool:
+  """Whether the table already has the named constraint (from a restore that failed later on)."""
+  return conn.execute("""
+                      select 1 from pg_constraint
+                       where conrelid = %s::regclass and conname = %s
+                      """, (table_name, name)).fetchone() is not None
+
+
+def _execute(statement):
+  """Execute one statement on a connection of its own."""
+  with psycopg.connect('dbname=cuny_curriculum', autocommit=True) as conn:
+    conn.execute(statement)
+
+
+def _parallel(statements: list, workers: int):
+  """Execute statements concurrently. Any exception is raised once they have all been tried."""
+  if statements:
+    with ThreadPoolExecutor(max_workers=min(workers, len(statements))) as executor:
+      list(executor.map(_execute, statements))
+
+
+def restore(table_names: list, workers: int = WORKERS):
+  """Rebuild the saved indexes and constraints of tables loaded in bulk-load mode.
+
+  The tables’ contents must have been committed. Each statement commits as it completes, and
+  indexes and constraints that already exist are skipped, so a restore that failed can be re-run.
+  """
+  with psycopg.connect('dbname=cuny_curriculum', autocommit=True) as conn:
+    deferred = conn.execute("""
+                            select table_name, kind, name, definition from deferred_ddl
+                             where table_name = any(%s)
+                            """, (table_names, )).fetchall()
+
+    partitions = {table_name: _partitions(conn, table_name) for table_name in table_names}
+
+    # Primary key and unique constraints are built as unique indexes, so that they can be built
+    # concurrently with the other indexes on the same table, and then attached to their indexes.
+    # For a partitioned table, the indexes are built on its partitions, and the constraint or index
+    # is then added to the partitioned table, which attaches the partitions’ ones.
+    indexes = []
+    attachments = []
+    parent_ddl = []
+    foreign_keys = []
+    for table_name, kind, name, definition in deferred:
+      if kind == 'index':
+        if partitions[table_name]:
+          # The definition of a partitioned index is CREATE INDEX ... ON ONLY ...
+          create, method = re.match(r'(CREATE (?:UNIQUE )?INDEX) \S+ ON (?:ONLY )?\S+ (USING .*)$',
+                                    definition).groups()
+          for leaf_name in partitions[table_name]:
+            indexes.append(sql.SQL('{} if not exists {} on {} {}')
+                           .format(sql.SQL(create),
+                                   sql.Identifier(_leaf_name(leaf_name, table_name, name)),
+                                   sql.Identifier(leaf_name), sql.SQL(method)))
+          parent_ddl.append(sql.SQL('{} if not exists {} on {} {}')
+                            .format(sql.SQL(create), sql.Identifier(name),
+                                    sql.Identifier(table_name), sql.SQL(method)))
+        else:
+          indexes.append(sql.SQL(re.sub(r'^(CREATE (?:UNIQUE )?INDEX) ', r'\1 IF NOT EXISTS ',
+                                        definition)))
+      elif kind == 'foreign key':
+        foreign_keys.append((table_name, name, definition))
+      else:
+        columns = re.match(r'(?:PRIMARY KEY|UNIQUE) (\(.*\))$', definition).group(1)
+        targets = [(leaf_name, _leaf_name(leaf_name, table_name, name))
+                   for leaf_name in partitions[table_name]] or [(table_name, name)]
+        for target_name, index_name in targets:
+          indexes.append(sql.SQL('create unique index if not exists {} on {} {}')
+                         .format(sql.Identifier(index_name), sql.Identifier(target_name),
+                                 sql.SQL(columns)))
+          if not _has_constraint(conn, target_name, index_name):
+            attachments.append(sql.SQL('alter table {} add constraint {} {} using index {}')
+                               .format(sql.Identifier(target_name), sql.Identifier(index_name),
+                                       sql.SQL(kind), sql.Identifier(index_name)))
+        if partitions[table_name] and not _has_constraint(conn, table_name, name):
+          parent_ddl.append(sql.SQL('alter table {} add constraint {} {} {}')
+                            .format(sql.Identifier(table_name), sql.Identifier(name),
+                                    sql.SQL(kind), sql.SQL(columns)))
+    _parallel(indexes, workers)
+    for statement in attachments + parent_ddl:
+      conn.execute(statement)
+
+    _parallel([sql.SQL('alter table {} set logged').format(sql.Identifier(leaf_name))
+               for leaf_name in _leaves(conn, table_names)], workers)
+
+    validations = []
+    for table_name, name, definition in foreign_keys:
+      # A foreign key added by a restore that failed may not have been validated yet; validating
+      # one that has been does no harm.
+      if not _has_constraint(conn, table_name, name):
+        not_valid = sql.SQL('') if partitions[table_name] else sql.SQL(' not valid')
+        conn.execute(sql.SQL('alter table {} add constraint {} {}{}')
+                     .format(sql.Identifier(table_name), sql.Identifier(name),
+                             sql.SQL(definition), not_valid))
+      if not partitions[table_name]:
+        validations.append(sql.SQL('alter table {} validate constraint {}')
+                           .format(sql.Identifier(table_name), sql.Identifier(name)))
+    _parallel(validations, workers)
+
+    conn.execute('delete from deferred_ddl where table_name = any(%s)', (table_names, ))
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Restore the indexes and constraints of tables '
+                                   'loaded in bulk-load mode')
+  parser.add_argument('-r', '--restore', metavar='table', nargs='+', required=True)
+  parser.add_argument('-w', '--workers', type=int, default=WORKERS)
+  args = parser.parse_args()
+
+  try:
+    restore(args.restore, args.workers)
+  except psycopg.Error as err:
+    sys.exit(str(err))
@@ -0,0 +1,89 @@
+"""One pass over the course catalog query, for cuny_departments.py and populate_cuny_courses.py.
+
+QNS_QCCV_CU_CATALOG_NP.csv is the biggest query the update reads, and two steps need it:
+cuny_departments.py only needs to know how many courses each department offers under each division
+(the “votes” for the department’s division), while populate_cuny_courses.py needs the rows
+themselves. One scan produces both.
+
+Within one process the scan is kept in memory until populate_cuny_courses.py is done with it and
+clears the cache (catalog_scan.cache_clear()). So that a later step run as a separate process
+doesn’t have to parse the file again, the scan is also spilled to a compressed pickle file in the
+project directory; it is used only if the query file’s size and modification time still match.
+pipeline.py, which runs both steps in one process, turns the spill off.
+"""
+
+import csv
+import gzip
+import os
+import pickle
+
+from collections import Counter, namedtuple
+from functools import cache
+from pathlib import Path
+
+CATALOG_FILE = './latest_queries/QNS_QCCV_CU_CATALOG_NP.csv'
+
+# Not in latest_queries, where check_queries.py would take it for a stray query file
+spill_dir = Path('.')
+
+# Whether to spill new scans (for steps run as separate processes)
+spill = True
+
+# cols: the normalized column names
+# rows: the data rows, as lists of strings
+# votes: Counter of (institution, department, division) triples: acad_org and acad_group of each row
+Scan = namedtuple('Scan', 'cols rows votes')
+
+
+def spill_path(cat_file) -> Path:
+  """Where the scan of cat_file is spilled."""
+  return spill_dir / f'.{Path(cat_file).stem}.scan.pickle.gz'
+
+
+def scan(cat_file=CATALOG_FILE) -> Scan:
+  """Read the catalog query file once."""
+  with open(cat_file, newline='', errors='replace') as csv_file:
+    reader = csv.reader(csv_file)
+    header = next(reader)
+    header[0] = header[0].replace('\ufeff', '')
+    cols = [val.lower().replace(' ', '_').replace('/', '_') for val in header]
+    institution, department, division = [cols.index(col)
+                                         for col in ['institution', 'acad_org', 'acad_group']]
+    rows = []
+    votes = Counter()
+    for row in reader:
+      rows.append(row)
+      votes[(row[institution], row[department], row[division])] += 1
+  return Scan(cols, rows, votes)
+
+
+def catalog_scan(cat_file=CATALOG_FILE) -> Scan:
+  """The scan of cat_file: from memory, from the spill file if it is current, or from a new scan."""
+  return _catalog_scan(Path(cat_file).resolve())
+
+
+@cache
+def _catalog_scan(cat_file: Path) -> Scan:
+  """The scan, cached by the query file’s resolved path, however the caller named it."""
+  stat = os.stat(cat_file)
+  signature = (stat.st_size, stat.st_mtime_ns)
+  spill_file = spill_path(cat_file)
+  try:
+    with gzip.open(spill_file, 'rb') as spill_input:
+      spilled_signature, catalog = pickle.load(spill_input)
+    if spilled_signature == signature:
+      return Scan._make(catalog)
+  except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+    pass
+
+  catalog = scan(cat_file)
+  if spill:
+    partial = spill_file.with_suffix('.part')
+    with gzip.open(partial, 'wb', compresslevel=1) as spill_output:
+      pickle.dump((signature, tuple(catalog)), spill_output, protocol=pickle.HIGHEST_PROTOCOL)
+    partial.rename(spill_file)
+  return catalog
+
+
+# So the cache can be cleared as though catalog_scan() itself were the cached function.
+catalog_scan.cache_clear = _catalog_scan.cache_clear
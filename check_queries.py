@@ -46,6 +46,8 @@ from collections import namedtuple
 from datetime import date
 from pathlib import Path
 
+import query_archive
+
 DEBUG = os.getenv('DEBUG_CHECK_QUERIES')
 
 SIZE_CHECK_LIMIT = os.getenv('SIZE_CHECK_LIMIT')
@@ -130,6 +132,12 @@ def if_copacetic():
   return Copacetic(notices, stops)
 
 
+def archive_query(query: Path, query_date: str):
+  """Move a query file into the (compressed, deduplicated) archive, indexed by its creation date."""
+  query_archive.store(query, query.stem, query_date)
+  query.unlink()
+
+
 if __name__ == '__main__':
   # Command line options
   parser = argparse.ArgumentParser()
@@ -291,16 +299,16 @@ if __name__ == '__main__':
 
   # If there is a full set of valid new queries, archive the latest_queries and move in the new ones
   if len(stops) == 0 and not args.skip_archive:
-    # Move each latest_queries file to query_archive, with the file's date appended to its name
+    # Move each latest_queries file into query_archive, indexed by the file's date
     print('Archive previous queries')
     prev_mod_date = None
     for target_query in [Path(latest_queries_dir, f'{q}.csv') for q in required_query_names]:
       if target_query.exists():
         if prev_mod_date is None:
           prev_mod_date = date.fromtimestamp(target_query.stat().st_mtime).strftime('%Y-%m-%d')
-        target_query.rename(archive_dir / f'{target_query.stem}_{prev_mod_date}.csv')
+        archive_query(target_query, prev_mod_date)
         if DEBUG:
-          print(f'{target_query} moved to {archive_dir}/{target_query.stem}_{prev_mod_date}.csv',
+          print(f'{target_query} archived as {target_query.stem} {prev_mod_date}',
                 file=sys.stderr)
       else:
         # This happens when new queries are to the project: there is no 'latest' query available yet
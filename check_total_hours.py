@@ -1,30 +1,38 @@
 # Generate a report showing active courses where the number of contact hours is not the
 # sum of the component contact hours.
 
+import sys
+
 import psycopg
 from psycopg.rows import namedtuple_row
 
-from collections import namedtuple
-
-Component = namedtuple('Component', 'component hours')
-db = psycopg.connect('dbname=cuny_curriculum')
-cursor = db.cursor(row_factory=namedtuple_row)
-
-cursor.execute("""select  course_id,
-                          institution,
-                          discipline,
-                          catalog_number,
-                          course_status,
-                          contact_hours,
-                          components,
-                          designation,
-                          attributes
-                    from  cuny_courses
-                 order by course_status, institution, discipline, catalog_number""")
-for row in cursor.fetchall():
-  components = [Component._make(c) for c in row.components]
-  hours = sum([component.hours for component in components])
-  if hours != row.contact_hours and row.course_status == 'A':
+
+def check_total_hours(conn, file=sys.stdout):
+  """Write the report to file.
+
+  The component hours are summed, and the courses selected, in the db; only the courses to report
+  are fetched. (See also the contact_hours check in validate.py.)
+  """
+  cursor = conn.cursor(row_factory=namedtuple_row)
+
+  cursor.execute("""select  course_id,
+                            institution,
+                            discipline,
+                            catalog_number,
+                            course_status,
+                            contact_hours,
+                            components,
+                            designation,
+                            attributes,
+                            component_hours
+                      from  cuny_courses,
+                            lateral (select coalesce(sum((component->>1)::real), 0)
+                                              as component_hours
+                                       from jsonb_array_elements(components) component) hours
+                     where  course_status = 'A'
+                       and  component_hours <> contact_hours
+                   order by institution, discipline, catalog_number""")
+  for row in cursor:
     attributes = row.attributes
     if len(attributes) > 20:
       attributes = attributes[0:17] + '...'
@@ -37,6 +45,10 @@ for row in cursor.fetchall():
                   row.designation,
                   attributes,
                   row.contact_hours,
-                  hours,
-                  row.components))
-exit()
+                  row.component_hours,
+                  row.components), file=file)
+
+
+if __name__ == '__main__':
+  with psycopg.connect('dbname=cuny_curriculum') as db:
+    check_total_hours(db)
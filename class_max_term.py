@@ -1,42 +1,41 @@
 #! /usr/local/bin/python3
 """Create table of active courses and the term they were last offered.
 
-Not currently used, but but potentially useful for prioritizing rules than need to be updated.
+The transfer_rules staleness columns, last_offered_term and has_inactive_course, depend on it
+(see rule_staleness.py): populate_transfer_rules.py sets them from this table as it writes the
+rules, and the pipeline runs update_rule_staleness() after this step so rules that aren’t being
+reloaded get theirs brought up to date.
 """
-import csv
-import os
 import psycopg
-import sys
 
-from collections import namedtuple
-from psycopg.rows import namedtuple_row
+from bulk_load import load
+
+
+def create_class_max_term(conn):
+  """Create and populate the class_max_term table."""
+  cursor = conn.cursor()
+  cursor.execute("""
+  drop table if exists class_max_term;
+  create table class_max_term (
+  institution text,
+  max_term integer,
+  course_id integer,
+  offer_nbr integer,
+  career text,
+  class_status text,
+  primary key (course_id, offer_nbr))
+  """)
+  load(cursor, 'class_max_term', './latest_queries/QNS_CV_CLASS_MAX_TERM.csv',
+       {'institution': 'institution',
+        'max_term': lambda row: int(row.max_term),
+        'course_id': lambda row: int(row.course_id),
+        'offer_nbr': lambda row: int(row.offer_nbr),
+        'career': 'academic_career',
+        'class_status': 'class_status'},
+       where=lambda row: row.academic_career == 'UGRD',
+       normalize=lambda heading: heading.lower().replace(' ', '_'))
+
 
 if __name__ == "__main__":
-  conn = psycopg.connect('dbname=cuny_curriculum')
-  cursor = conn.cursor(row_factory=namedtuple_row)
-  with open('./latest_queries/QNS_CV_CLASS_MAX_TERM.csv') as csv_file:
-    csv_reader = csv.reader(csv_file)
-    for line in csv_reader:
-      if 1 == csv_reader.line_num:
-        Row = namedtuple('Row', ' '.join([c.lower().replace(' ', '_') for c in line]))
-        cursor.execute("""
-        drop table if exists class_max_term;
-        create table class_max_term (
-        institution text,
-        max_term integer,
-        course_id integer,
-        offer_nbr integer,
-        career text,
-        class_status text,
-        primary key (course_id, offer_nbr))
-        """)
-      else:
-        row = Row._make(line)
-        if row.academic_career != 'UGRD':
-          continue
-        cursor.execute(f"""
-        insert into class_max_term values
-        ('{row.institution}', {int(row.max_term)}, {int(row.course_id)}, {int(row.offer_nbr)},
-         '{row.academic_career}', '{row.class_status}')
-        """)
-conn.commit()
+  with psycopg.connect('dbname=cuny_curriculum') as conn:
+    create_class_max_term(conn)
@@ -0,0 +1,90 @@
+#! /usr/local/bin/python3
+"""Create the course_clusters table: the courses that are equivalent to each course.
+
+Two courses are equivalent if they are in the same CUNYfirst equivalence group (crse_equiv_tbl); the
+offer_nbrs of one course_id are cross-listed, so they are equivalent too. Equivalence is transitive,
+so the clusters are the connected components of the courses linked by equivalence groups, which are
+found here with union-find over course_ids. A course_id that is not linked to any other one is a
+cluster of its own.
+
+Each course_id’s row holds its cluster’s course_ids, so a whole cluster takes a single primary key
+lookup. The course_cluster() function does that lookup:
+  select * from cuny_courses where course_id = any(course_cluster(12345));
+"""
+
+import argparse
+
+import psycopg
+
+from bulk_load import copy_rows
+import profiling
+
+
+def find(parent: dict, course_id: int) -> int:
+  """The root of a course_id’s cluster, halving the path to it along the way."""
+  while parent[course_id] != course_id:
+    parent[course_id] = parent[parent[course_id]]
+    course_id = parent[course_id]
+  return course_id
+
+
+def union(parent: dict, size: dict, course_id: int, other_id: int):
+  """Merge the clusters of two course_ids, attaching the smaller one to the larger."""
+  root, other_root = find(parent, course_id), find(parent, other_id)
+  if root != other_root:
+    if size[root] < size[other_root]:
+      root, other_root = other_root, root
+    parent[other_root] = root
+    size[root] += size[other_root]
+
+
+def create_course_clusters(conn):
+  """Create and populate the course_clusters table, and the course_cluster() lookup function."""
+  cursor = conn.cursor()
+
+  profiling.phase('find clusters')
+  parent = dict()
+  size = dict()
+  group_members = dict()  # The first course_id seen in each equivalence group
+  cursor.execute('select course_id, equivalence_group from cuny_courses')
+  for course_id, equivalence_group in cursor:
+    if course_id not in parent:
+      parent[course_id] = course_id
+      size[course_id] = 1
+    if equivalence_group is not None:
+      union(parent, size, course_id, group_members.setdefault(equivalence_group, course_id))
+  clusters = dict()
+  for course_id in parent:
+    clusters.setdefault(find(parent, course_id), []).append(course_id)
+
+  profiling.phase('copy clusters')
+  cursor.execute("""
+                 drop table if exists course_clusters;
+                 create table course_clusters (
+                   course_id integer primary key,
+                   cluster_id integer not null,  -- the smallest course_id in the cluster
+                   cluster_courses integer[] not null);
+                 """)
+  copy_rows(cursor, 'course_clusters', ['course_id', 'cluster_id', 'cluster_courses'],
+            ((course_id, cluster_courses[0], cluster_courses)
+             for cluster_courses in map(sorted, clusters.values())
+             for course_id in cluster_courses))
+  cursor.execute("""
+                 create index on course_clusters (cluster_id);
+                 create or replace function course_cluster(course_id integer)
+                   returns integer[] as
+                 $$
+                   select cluster_courses from course_clusters
+                    where course_clusters.course_id = course_cluster.course_id
+                 $$ language sql stable;
+                 """)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  profiling.add_arguments(parser)
+  args = parser.parse_args()
+
+  with psycopg.connect('dbname=cuny_curriculum') as conn:
+    with profiling.profiled('course_clusters', args.profile, args.cprofile):
+      create_course_clusters(conn)
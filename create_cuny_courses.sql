@@ -1,5 +1,6 @@
 DROP TABLE IF EXISTS cuny_courses cascade;
 DROP TABLE IF EXISTS course_attributes cascade;
+DROP TABLE IF EXISTS cross_listings cascade;
 
 CREATE TABLE course_attributes (
   name text,
@@ -38,4 +39,22 @@ CREATE TABLE cuny_courses (
   primary key (course_id, offer_nbr),
   foreign key (institution, career) references cuny_careers,
   foreign key (institution, discipline) references cuny_disciplines
+);
+
+-- The offers of cross-listed courses (course_ids with more than one offer_nbr), written once when
+-- the catalog is loaded. All of a course_id’s offers are here, including the one a transfer rule
+-- refers to, whatever their institutions. A rule’s source course used to list its aliases in
+-- source_courses.aliases: the other offers of its course_id, and populate_transfer_rules.py drops
+-- any rule whose source course has an offer at an institution other than the rule’s source
+-- institution. So the aliases are the other offers here at the rule’s source institution, which
+-- for the rules that are kept is all of them. The cross_listing_aliases check (validate.py) reports
+-- any source course for which that doesn’t hold.
+CREATE TABLE cross_listings (
+  course_id integer,
+  offer_nbr integer,
+  institution text,
+  discipline text,
+  catalog_number text,
+  cuny_subject text,
+  primary key (course_id, offer_nbr)
 )
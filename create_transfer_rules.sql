@@ -9,11 +9,16 @@ insert into credit_sources values ('C', 'Catalog', 'Use Catalog Units');
 insert into credit_sources values ('E', 'External', 'Specify Maximum Units');
 insert into credit_sources values ('R', 'Rule', 'Specify Fixed Units');
 
+-- The three rule tables are partitioned by destination institution, which nearly all queries are
+-- scoped to, and which lets one institution’s rules be reloaded without touching the others. The
+-- partitions, one per institution, are created below. Primary keys, unique constraints, and the
+-- keys that reference transfer_rules have to include the partition key.
+
 -- The tranfer_rules table
 drop table if exists transfer_rules cascade;
 create table transfer_rules (
-  id serial primary key,
-  rule_key text unique,
+  id serial,
+  rule_key text,
   source_institution text not null,
   destination_institution text not null,
   subject_area text not null,
@@ -28,14 +33,29 @@ create table transfer_rules (
   credit_sources text not null, -- colon-separated src:dst CER values
   review_status integer default 0,
   effective_date date, -- latest effective date of any table/view in CF query
+  -- Staleness, set by rule_staleness.py
+  last_offered_term integer, -- latest term any of the rule’s courses was offered
+  has_inactive_course boolean, -- any of the rule’s courses is inactive
+  primary key (destination_institution, id),
+  unique (destination_institution, rule_key),
   foreign key (source_institution) references cuny_institutions,
-  foreign key (destination_institution) references cuny_institutions);
+  foreign key (destination_institution) references cuny_institutions)
+  partition by list (destination_institution);
+
+-- Rules are also looked up by id alone (the rule_key() function, for example), which has to probe
+-- every partition’s index; queries that know the destination institution should include it.
+create index on transfer_rules (id);
+
+-- For finding stale rules to review
+create index on transfer_rules (last_offered_term);
+create index on transfer_rules (destination_institution) where has_inactive_course;
 
 -- source_courses
 drop table if exists source_courses cascade;
 create table source_courses (
-  id serial primary key,
-  rule_id integer references transfer_rules,
+  id serial,
+  destination_institution text not null,
+  rule_id integer,
   course_id integer,
   offer_nbr integer,
   offer_count integer,  -- greater than 1 for cross-listed courses
@@ -48,13 +68,18 @@ create table source_courses (
   credit_source text references credit_sources,
   min_gpa real,
   max_gpa real,
-  aliases jsonb);
+  -- The course’s aliases, if it is cross-listed (offer_count > 1), are the other offers of its
+  -- course_id at the rule’s source institution in cross_listings (see create_cuny_courses.sql).
+  primary key (destination_institution, id),
+  foreign key (destination_institution, rule_id) references transfer_rules)
+  partition by list (destination_institution);
 
 -- destination_courses
 drop table if exists destination_courses cascade;
 create table destination_courses (
-  id serial primary key,
-  rule_id integer references transfer_rules,
+  id serial,
+  destination_institution text not null,
+  rule_id integer,
   course_id integer,
   offer_nbr integer,
   offer_count integer,  -- greater than 1 for cross-listed courses
@@ -66,5 +91,24 @@ create table destination_courses (
   credit_source text references credit_sources,
   course_status text,
   is_mesg boolean,
-  is_bkcr boolean);
+  is_bkcr boolean,
+  primary key (destination_institution, id),
+  foreign key (destination_institution, rule_id) references transfer_rules)
+  partition by list (destination_institution);
+
+-- The partitions: <table>_<institution>, for example transfer_rules_qns01
+do $$
+  declare
+    institution text;
+    table_name text;
+  begin
+    for institution in select code from cuny_institutions loop
+      foreach table_name in array array['transfer_rules', 'source_courses', 'destination_courses']
+      loop
+        execute format('create table %I partition of %I for values in (%L)',
+                       table_name || '_' || lower(institution), table_name, institution);
+      end loop;
+    end loop;
+  end
+$$;
 
@@ -0,0 +1,11 @@
+"""Constants shared by the scripts that build the cuny_curriculum tables.
+
+Nothing but assignments here, so importing this module costs nothing; the modules that used to hold
+these (cuny_divisions.py and cuny_departments.py) rebuild their tables when they run.
+"""
+
+# Institutions that don’t fit our model of undergraduate colleges for within-CUNY transfers.
+ignore_institutions = ['CUNY', 'UAPC1', 'MHC01']
+
+# Departments that have proven themselves to be problematic
+ignore_departments = ['PEES-BKL', 'SOC-YRK', 'JOUR-GRD']
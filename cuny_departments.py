@@ -10,7 +10,7 @@
 # paired with a division in the course catalog, and pick the division that has the largest number of
 # pairings when there is more than one.
 #
-# Generates a log file of anomalies found.
+# Records the anomalies found in the anomalies table (see anomalies.py) and divisions_report.log.
 
 import os
 import re
@@ -23,30 +23,27 @@ from datetime import date
 import psycopg
 from psycopg.rows import namedtuple_row
 
-from cuny_divisions import ignore_institutions
+from anomalies import Anomalies
+from bulk_load import copy_rows
+from catalog_scan import catalog_scan
+from cuny_config import ignore_departments, ignore_institutions
+import profiling
+import reference_data
 
-with psycopg.connect('dbname=cuny_curriculum') as db:
-  with db.cursor(row_factory=namedtuple_row) as cursor:
 
-    # Departments that have proven themselves to be problematic
-    ignore_departments = ['PEES-BKL', 'SOC-YRK', 'JOUR-GRD']
+def create_cuny_departments(conn):
+  """Create and populate the cuny_departments table."""
+  with conn.cursor(row_factory=namedtuple_row) as cursor:
 
     # Get list of known institutions
-    cursor.execute("""
-                     select code
-                     from cuny_institutions
-                   """)
-    known_institutions = [institution.code for institution in cursor.fetchall()]
+    known_institutions = reference_data.institutions(conn)
 
     # Get list of known institution-division pairs
     divisions = dict()
     Division_Key = namedtuple('Division_Key', 'institution division')
     Division_Info = namedtuple('Division_Info', 'courses')
 
-    cursor.execute("""
-                      select institution, division from cuny_divisions;
-                   """)
-    known_divisions = [(r.institution, r.division) for r in cursor.fetchall()]
+    known_divisions = reference_data.divisions(conn)
 
     # Create our cuny_departments table (CUNYfirst academic organizations)
     cursor.execute('drop table if exists cuny_departments cascade')
@@ -62,7 +59,7 @@ with psycopg.connect('dbname=cuny_curriculum') as db:
       """)
 
     # Create a dict of all known departments from CUNYfirst. Initialize each entry with an empty
-    # list of divisions.
+    # Counter of divisions.
     known_departments = dict()
     Department_Key = namedtuple('Department_Key', 'institution department')
     Department_Info = namedtuple('Department_Info',
@@ -71,6 +68,7 @@ with psycopg.connect('dbname=cuny_curriculum') as db:
                                     divisions
                                  """)
 
+    profiling.phase('read academic organizations')
     cols = None
     with open('./latest_queries/QNS_CV_ACADEMIC_ORGANIZATIONS.csv',
               newline='',
@@ -93,124 +91,100 @@ with psycopg.connect('dbname=cuny_curriculum') as db:
                                                                       row.formaldesc.replace('\'',
                                                                                              '’'),
                                                                       row.status,
-                                                                      []
+                                                                      Counter()
                                                                       ])
 
-    # Go through the entire course catalog and record the division for each one in the department’s
-    # dict entry.
+    # Use the division votes from the course catalog scan (the number of courses each department
+    # offers under each division) to tally the divisions claimed for each department.
     # Report data integrity anomalies.
-    courses = dict()
-    Course_Key = namedtuple('Course_Key', 'course_id offer_nbr')
-    Course_Info = namedtuple('Course_Info', 'discipline catalog_number')
 
-    # Open the log file and course catalog query file
-    with open('./divisions_report.log', 'w') as report:
+    # Open the anomaly recorder and scan the course catalog query file
+    with Anomalies('cuny_departments', log_file='./divisions_report.log') as report:
       anomalies = 0
-      with open('./latest_queries/QNS_QCCV_CU_CATALOG_NP.csv', newline='',
-                errors='replace') as csvfile:
-        cat_reader = csv.reader(csvfile)
-        cols = None
-        for row in cat_reader:
-          if cols is None:
-            row[0] = row[0].replace('\ufeff', '')
-            if 'Institution' == row[0]:
-              cols = [val.lower().replace(' ', '_').replace('/', '_') for val in row]
-              Col = namedtuple('Col', cols)
-          else:
-            row = Col._make(row)
-            institution = row.institution
-            discipline = row.subject.strip()
-
-            # If active_only, skip rows for inactive courses
-            #   Option removed: it breaks cuny_subjects.py
-            #   Key (department)=(BAR01) is not present in table "cuny_departments".
-            # course_status = row.crse_catalog_status
-            # can_schedule = row.schedule_course
-            # discipline_status = row.subject_eff_status
-            # if args.active_only and \
-            #    (course_status != 'A' or can_schedule != 'Y' or discipline_status != 'A'):
-            #   continue
-
-            # Report and ignore courses with unknown institution
-            if institution in ignore_institutions:
-              continue
-            if institution not in known_institutions:
-              report.write(f'Unknown institution ({institution}) for {_course_id:06}:'
-                           f'{_offer_nbr} .\n')
-              continue
-
-            # Ignore rows for known bogus departments
-            department = row.acad_org
-            if department in ignore_departments:
-              continue
-            # Report and ignore rows where the department is not in cuny_departments for the
-            # institution
-            department_key = Department_Key._make([institution, department])
-            if department_key not in known_departments.keys():
-              report.write(f'Bogus department for {department} at {institution}.\n')
-              continue
-
-            # Report and ignore rows where the institution-division pair is not in cuny_divisions
-            division = row.acad_group
-            if (institution, division) not in known_divisions:
-              report.write(f'Bogus institution-division pair: ({institution}-{division})\n')
-              continue
-
-            # Record the division claimed for this course’s department
-            known_departments[department_key].divisions.append(division)
-
-        # Tally phase complete. Now determine the correct division for each department
-        for department_key in known_departments.keys():
-          num_divisions = len(known_departments[department_key].divisions)
-          if num_divisions == 0:
-            # Report and ignore departments with no courses
-            qualifier = ''
-            # if args.active_only:
-            #   qualifier = 'active '
-            report.write(f'{department_key.department} at {department_key.institution} '
-                         f'ignored because it has no {qualifier}courses\n')
-            continue
-          elif num_divisions == 1:
-            # Counter would return empty list
-            which_division = known_departments[department_key].divisions[0]
-            num_courses = 1
+      profiling.phase('scan catalog')
+      catalog = catalog_scan()
+      profiling.phase('assign divisions')
+      for (institution, department, division), num_courses in catalog.votes.items():
+
+        # Report and ignore courses with unknown institution
+        if institution in ignore_institutions:
+          continue
+        if institution not in known_institutions:
+          report.add('unknown_institution', f'Unknown institution ({institution}) for '
+                     f'{num_courses:,} courses.', kept=False)
+          continue
+
+        # Ignore rows for known bogus departments
+        if department in ignore_departments:
+          continue
+        # Report and ignore rows where the department is not in cuny_departments for the
+        # institution
+        department_key = Department_Key._make([institution, department])
+        if department_key not in known_departments.keys():
+          report.add('unknown_department', f'Bogus department for {department} at '
+                     f'{institution} ({num_courses:,} courses).', kept=False)
+          continue
+
+        # Report and ignore rows where the institution-division pair is not in cuny_divisions
+        if (institution, division) not in known_divisions:
+          report.add('unknown_division',
+                     f'Bogus institution-division pair: ({institution}-{division}) '
+                     f'({num_courses:,} courses)', kept=False)
+          continue
+
+        # Record the division claimed for this department’s courses
+        known_departments[department_key].divisions[division] += num_courses
+
+      # Tally phase complete. Now determine the correct division for each department
+      department_rows = []
+      for department_key in known_departments.keys():
+        # Get list of (division, frequency) tuples, most frequent in position 0.
+        votes = known_departments[department_key].divisions.most_common()
+        if len(votes) == 0:
+          # Report and ignore departments with no courses
+          qualifier = ''
+          # if args.active_only:
+          #   qualifier = 'active '
+          report.add('no_courses', f'{department_key.department} at '
+                     f'{department_key.institution} has no {qualifier}courses.', kept=False)
+          continue
+        which_division = votes[0][0]
+        num_courses = votes[0][1]
+        if len(votes) > 1:
+          if votes[0][1] != 1:
+            suffix = 's'
           else:
-            # Get list of (division, frequency) tuples, most frequent in position 0.
-            votes = Counter(known_departments[department_key].divisions).most_common()
-            which_division = votes[0][0]
-            num_courses = votes[0][1]
-            if len(votes) > 1:
-              if votes[0][1] != 1:
-                suffix = 's'
-              else:
-                suffix = ''
-              report.write(f'{department_key.department} at {department_key.institution} '
-                           f'has {len(votes)} different divisions\n'
-                           f'  Using {which_division} for {votes[0][1]} course{suffix}\n')
-              for index in range(1, len(votes)):
-                num_courses += votes[index][1]
-                if votes[index][1] != 1:
-                  suffix = 's'
-                else:
-                  suffix = ''
-                report.write(f'  Using {which_division} instead of {votes[index][0]} '
-                             f'for {votes[index][1]} course{suffix}\n')
-              anomalies += 1
-          # Insert institution, division, department, department_name, status, num_courses
-          query = f"""
-                     insert into cuny_departments values(
-                     '{department_key.institution}',
-                     '{which_division}',
-                     '{department_key.department}',
-                     '{known_departments[department_key].department_name}',
-                     '{known_departments[department_key].status}',
-                     '{num_courses}')
-                   """
-          cursor.execute(query)
-
-      suffix = 's'
-      if anomalies == 1:
-        suffix = ''
-      if anomalies == 0:
-        anomalies = 'No'
-      report.write(f'{anomalies:,} course{suffix} found with inconsistent division{suffix}.\n')
+            suffix = ''
+          message = [f'{department_key.department} at {department_key.institution} '
+                     f'has {len(votes)} different divisions',
+                     f'  Using {which_division} for {votes[0][1]} course{suffix}']
+          for index in range(1, len(votes)):
+            num_courses += votes[index][1]
+            if votes[index][1] != 1:
+              suffix = 's'
+            else:
+              suffix = ''
+            message.append(f'  Using {which_division} instead of {votes[index][0]} '
+                           f'for {votes[index][1]} course{suffix}')
+          report.add('multiple_divisions', '\n'.join(message), kept=True)
+          anomalies += 1
+        # Institution, division, department, department_name, status, num_courses
+        department_rows.append((department_key.institution,
+                                which_division,
+                                department_key.department,
+                                known_departments[department_key].department_name,
+                                known_departments[department_key].status,
+                                num_courses))
+      profiling.phase('copy cuny_departments')
+      copy_rows(cursor, 'cuny_departments', ['institution', 'division', 'department',
+                                             'department_name', 'department_status',
+                                             'num_courses'], department_rows)
+
+      suffix = '' if anomalies == 1 else 's'
+      count = f'{anomalies:,}' if anomalies else 'No'
+      print(f'{count} course{suffix} found with inconsistent division{suffix}.', file=sys.stderr)
+
+
+if __name__ == '__main__':
+  with psycopg.connect('dbname=cuny_curriculum') as conn:
+    create_cuny_departments(conn)
@@ -2,20 +2,16 @@
 """ Make a copy of the CUNYfirst Academic Groups table.
 """
 
-import os
-import re
-import csv
-from collections import namedtuple
-from datetime import date, datetime
-
 import psycopg
 from psycopg.rows import namedtuple_row
 
-with psycopg.connect('dbname=cuny_curriculum') as db:
-  with db.cursor(row_factory=namedtuple_row) as cursor:
+from bulk_load import load
+from cuny_config import ignore_institutions
+
 
-    # Institutions that don’t fit our model of undergraduate colleges for within-CUNY transfers.
-    ignore_institutions = ['CUNY', 'UAPC1', 'MHC01']
+def create_cuny_divisions(conn):
+  """Create and populate the cuny_divisions table."""
+  with conn.cursor(row_factory=namedtuple_row) as cursor:
 
     # Get list of known departments
     # departments = dict()
@@ -30,7 +26,6 @@ with psycopg.connect('dbname=cuny_curriculum') as db:
     #   departments[row.institution].append(row.department)
 
     # Get names, etc. of known CUNY divisions (“academic groups”) and re-create the divisions table
-    cols = None
     cursor.execute('drop table if exists cuny_divisions cascade')
     cursor.execute("""create table cuny_divisions (
                         institution text references cuny_institutions,
@@ -42,21 +37,16 @@ with psycopg.connect('dbname=cuny_curriculum') as db:
                         )
                    """)
 
-    with open('./latest_queries/ACADEMIC_GROUPS.csv') as csv_file:
-      csv_reader = csv.reader(csv_file)
-      for line in csv_reader:
-        if cols is None:
-          cols = [c.lower().replace(' ', '_') for c in line]
-          Row = namedtuple('Row', cols)
-        else:
-          row = Row._make(line)
-          if row.institution in ignore_institutions:
-            continue
-          cursor.execute(f"""insert into cuny_divisions values(
-                               '{row.institution}',
-                               '{row.academic_group}',
-                               '{row.description}',
-                               '{row.status}',
-                               '{row.effective_date}'
-                              )
-                          """)
+    load(cursor, 'cuny_divisions', './latest_queries/ACADEMIC_GROUPS.csv',
+         {'institution': 'institution',
+          'division': 'academic_group',
+          'division_name': 'description',
+          'status': 'status',
+          'effective_date': 'effective_date'},
+         where=lambda row: row.institution not in ignore_institutions,
+         normalize=lambda heading: heading.lower().replace(' ', '_'))
+
+
+if __name__ == '__main__':
+  with psycopg.connect('dbname=cuny_curriculum') as conn:
+    create_cuny_divisions(conn)
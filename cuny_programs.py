@@ -1,95 +1,84 @@
 #! /usr/local/bin/python3
 """Build the cuny_programs table."""
 
-import csv
 import psycopg
 from psycopg.rows import namedtuple_row
 
-from collections import namedtuple
+from bulk_load import all_columns, load
 
-conn = psycopg.connect('dbname=cuny_curriculum')
-cursor = conn.cursor(row_factory=namedtuple_row)
 
-cursor.execute("""
-               drop table if exists cuny_programs;
-               create table cuny_programs (
-               id serial primary key,
-               nys_program_code integer,
-               institution text references cuny_institutions,
-               department text,
-               percent_owned float,
-               academic_plan text,
-               plan_type text,
-               description text,
-               cip_code text,
-               hegis_code text,
-               program_status text,
-               career text,
-               effective_date date,
-               first_term_valid text,
-               last_admit text)
-               """)
+def is_heading(line: list) -> bool:
+  """The query files can start with title lines; the column headings start with Institution."""
+  return line[0] == 'Institution'
 
-with open('./latest_queries/QCCV_PROG_PLAN_ORG.csv') as csvfile:
-  reader = csv.reader(csvfile)
-  cols = None
-  for line in reader:
-    if cols is None:
-      line[0] = line[0].replace('\ufeff', '')
-      if 'Institution' == line[0]:
-        cols = [val.lower().replace(' ', '_')
-                           .replace('/', '_')
-                           .replace('-', '_')
-                           .replace('?', '') for val in line]
-        Row = namedtuple('Row', cols)
-    else:
-      row = Row._make(line)
-      if row.institution in ['MHC01', 'UAPC1']:
-        continue
-      nys_program_code = '0' if row.nys_program_code == '' else row.nys_program_code
-      cursor.execute("""
-                     insert into cuny_programs values (default, %s, %s, %s, %s, %s, %s, %s,
-                                                                %s, %s, %s, %s, %s, %s, %s)
-                     """, (nys_program_code,
-                           row.institution,
-                           row.academic_organization,
-                           row.percent_owned,
-                           row.academic_plan,
-                           row.plan_type,
-                           row.transcript_description,
-                           row.cip_code,
-                           row.hegis_code,
-                           row.status,
-                           row.career,
-                           row.effective_date,
-                           row.first_term_valid,
-                           row.last_admit))
 
-with open('./latest_queries/ACAD_SUBPLAN_TBL.csv') as csvfile:
-  reader = csv.reader(csvfile)
-  cols = None
-  for line in reader:
-    line[0] = line[0].replace('\ufeff', '')
-    if cols is None:
-      if 'Institution' == line[0]:
-        cols = [val.lower().replace(' ', '_')
-                           .replace('/', '_')
-                           .replace('-', '') for val in line]
-        schema = ', '.join([f'{col} text' for col in cols])
-        schema = schema.replace('institution text', 'institution text references cuny_institutions')
-        cursor.execute(f"""
-                        drop table if exists cuny_subplans;
-                        create table cuny_subplans (
-                        {schema},
-                        primary key (institution, plan, subplan))
-                        """)
-        Row = namedtuple('Row', cols)
-    else:
-      row = Row._make(line)
-      values = ', '.join([f"""'{val.replace("'", '’')}'""" for val in row])
-      cursor.execute(f"""
-                      insert into cuny_subplans values ({values})
-                     """)
+def create_cuny_programs(conn):
+  """Create and populate the cuny_programs and cuny_subplans tables."""
+  cursor = conn.cursor(row_factory=namedtuple_row)
 
-conn.commit()
-conn.close()
+  cursor.execute("""
+                 drop table if exists cuny_programs;
+                 create table cuny_programs (
+                 id serial primary key,
+                 nys_program_code integer,
+                 institution text references cuny_institutions,
+                 department text,
+                 percent_owned float,
+                 academic_plan text,
+                 plan_type text,
+                 description text,
+                 cip_code text,
+                 hegis_code text,
+                 program_status text,
+                 career text,
+                 effective_date date,
+                 first_term_valid text,
+                 last_admit text)
+                 """)
+
+  load(cursor, 'cuny_programs', './latest_queries/QCCV_PROG_PLAN_ORG.csv',
+       {'nys_program_code': lambda row: row.nys_program_code or '0',
+        'institution': 'institution',
+        'department': 'academic_organization',
+        'percent_owned': 'percent_owned',
+        'academic_plan': 'academic_plan',
+        'plan_type': 'plan_type',
+        'description': 'transcript_description',
+        'cip_code': 'cip_code',
+        'hegis_code': 'hegis_code',
+        'program_status': 'status',
+        'career': 'career',
+        'effective_date': 'effective_date',
+        'first_term_valid': 'first_term_valid',
+        'last_admit': 'last_admit'},
+       # Repeated headings are skipped too.
+       where=lambda row: row.institution not in ['MHC01', 'UAPC1', 'Institution'],
+       normalize=lambda heading: heading.lower().replace(' ', '_')
+                                                .replace('/', '_')
+                                                .replace('-', '_')
+                                                .replace('?', ''),
+       is_heading=is_heading)
+
+  def subplan_columns(cols):
+    """Create the cuny_subplans table, with a text column for each query column."""
+    schema = ', '.join([f'{col} text' for col in cols])
+    schema = schema.replace('institution text', 'institution text references cuny_institutions')
+    cursor.execute(f"""
+                    drop table if exists cuny_subplans;
+                    create table cuny_subplans (
+                    {schema},
+                    primary key (institution, plan, subplan))
+                    """)
+    return all_columns(lambda value: value.replace("'", '’'))(cols)
+
+  load(cursor, 'cuny_subplans', './latest_queries/ACAD_SUBPLAN_TBL.csv', subplan_columns,
+       where=lambda row: row.institution != 'Institution',
+       normalize=lambda heading: heading.lower().replace(' ', '_')
+                                                .replace('/', '_')
+                                                .replace('-', ''),
+       is_heading=is_heading)
+
+
+if __name__ == '__main__':
+  with psycopg.connect('dbname=cuny_curriculum') as conn:
+    create_cuny_programs(conn)
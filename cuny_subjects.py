@@ -9,18 +9,17 @@ import re
 import sys
 
 from collections import namedtuple
-from cuny_divisions import ignore_institutions
+from cuny_config import ignore_institutions
 from datetime import date
 from pathlib import Path
 from psycopg.rows import namedtuple_row
+import profiling
+import reference_data
 
 
-parser = argparse.ArgumentParser('Create internal and external subject tables')
-parser.add_argument('--debug', '-d', action='store_true')
-args = parser.parse_args()
-
-with psycopg.connect('dbname=cuny_curriculum') as db:
-  with db.cursor(row_factory=namedtuple_row) as cursor:
+def create_cuny_subjects(conn, debug: bool = False):
+  """Create and populate the cuny_subjects and cuny_disciplines tables."""
+  with conn.cursor(row_factory=namedtuple_row) as cursor:
 
     # Internal subject (disciplines) and external subject area (cuny_subjects) queries
     discp_file = Path('./latest_queries/QNS_CV_CUNY_SUBJECT_TABLE.csv')
@@ -39,15 +38,11 @@ with psycopg.connect('dbname=cuny_curriculum') as db:
                    set update_date = %s, file_name = %s
                    where table_name = 'subjects'""", (extern_date, extern_file.name))
 
-    if args.debug:
+    if debug:
       print(f'cuny_subjects.py:\n  cuny_disciplines: {discp_file}\n  cuny_subjects: {extern_file}')
 
     # Get list of known departments
-    cursor.execute("""
-                    select department
-                    from cuny_departments
-                   """)
-    departments = [d.department for d in cursor.fetchall()]
+    departments = reference_data.departments(conn)
 
     # The cuny_subjects table
     # -------------------------------------------------------------------------------------------------
@@ -59,6 +54,7 @@ with psycopg.connect('dbname=cuny_curriculum') as db:
       """)
 
     # Populate cuny_subjects
+    profiling.phase('populate cuny_subjects')
     cursor.execute("insert into cuny_subjects values('missing', 'MISSING')")
     with open(extern_file) as csvfile:
       csv_reader = csv.reader(csvfile)
@@ -72,7 +68,7 @@ with psycopg.connect('dbname=cuny_curriculum') as db:
           row = Row._make(line)
           q = 'insert into cuny_subjects values(%s, %s)'
           cursor.execute(q, (row.external_subject_area, row.description.replace("'", "’")))
-      db.commit()
+      conn.commit()
 
     # The cuny_disciplines table
     # -------------------------------------------------------------------------------------------------
@@ -92,6 +88,7 @@ with psycopg.connect('dbname=cuny_curriculum') as db:
         """)
 
     # Populate cuny_disciplines
+    profiling.phase('populate cuny_disciplines')
 
     #
     # TEMPORARY: Add missing disciplines for courses that currently don't have one.
@@ -148,3 +145,14 @@ with psycopg.connect('dbname=cuny_curriculum') as db:
                                    row.hegis_code,
                                    row.status,
                                    external_subject_area))
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser('Create internal and external subject tables')
+  parser.add_argument('--debug', '-d', action='store_true')
+  profiling.add_arguments(parser)
+  args = parser.parse_args()
+
+  with psycopg.connect('dbname=cuny_curriculum') as conn:
+    with profiling.profiled('cuny_subjects', args.profile, args.cprofile):
+      create_cuny_subjects(conn, debug=args.debug)
@@ -1,9 +1,12 @@
 # Clear and re-populate the (requirement) designations table.
 
 import psycopg
-import csv
 
-with psycopg.connect('dbname=cuny_curriculum') as conn:
+from bulk_load import load
+
+
+def create_designations(conn):
+  """Create and populate the designations table."""
   with conn.cursor() as cursor:
     cursor.execute('drop table if exists designations cascade')
     cursor.execute("""
@@ -11,16 +14,13 @@ with psycopg.connect('dbname=cuny_curriculum') as conn:
         designation text primary key,
         description text)
         """)
-    with open('./latest_queries/QCCV_RQMNT_DESIG_TBL.csv') as csvfile:
-      csv_reader = csv.reader(csvfile)
-      cols = None
-      for row in csv_reader:
-        if cols == None:
-          row[0] = row[0].replace('\ufeff', '')
-          cols = [val.lower().replace(' ', '_').replace('/', '_') for val in row]
-        else:
-          q = """insert into designations values('{}', '{}')""".format(
-              row[cols.index('designation')],
-              row[cols.index('formal_description')].replace('l&Q', 'l & Q').replace('eR', 'e R'))
-          cursor.execute(q)
-      cursor.execute("insert into designations values ('', 'No Designation')")
+    load(cursor, 'designations', './latest_queries/QCCV_RQMNT_DESIG_TBL.csv',
+         {'designation': 'designation',
+          'description': lambda row: row.formal_description.replace('l&Q', 'l & Q')
+                                                           .replace('eR', 'e R')})
+    cursor.execute("insert into designations values ('', 'No Designation')")
+
+
+if __name__ == '__main__':
+  with psycopg.connect('dbname=cuny_curriculum') as conn:
+    create_designations(conn)
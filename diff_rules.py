@@ -0,0 +1,222 @@
+#! /usr/local/bin/python3
+"""Report the differences between two sets of transfer rules.
+
+Each of the two rules sources can be:
+  * A date (YYYY-MM-DD) of a set of rules archived by archive_rules.sh in rules_archive/.
+  * A QNS_CV_SR_TRNS_INTERNAL_RULES query file.
+  * query:YYYY-MM-DD for the QNS_CV_SR_TRNS_INTERNAL_RULES query with that date in the query
+    archive.
+
+Both sources are reduced to the same facts about each rule: its source courses with their GPA
+ranges and credit sources, its destination courses with their transfer credits, and its effective
+date. The facts are sorted by rule_key on disk (external_sort.py), and the two sorted streams are
+merge-joined one rule at a time, so memory use does not depend on the number of rules.
+
+Query files are taken as they are, except for the rows populate_transfer_rules.py always ignores
+(not a transfer course, or an ignored institution), so comparing a query with an archive will also
+report the rules populate_transfer_rules.py rejected. Source course credits in the archives come
+from the catalog, not the rule, so they are not compared.
+
+Output is one line per difference: rule_key, change (added, removed, modified), field, old value,
+and new value, either as CSV or as an aligned table. Counts of each kind of change go to stderr.
+"""
+
+import argparse
+import bz2
+import csv
+import sys
+
+from collections import Counter, namedtuple
+from datetime import date
+from itertools import groupby
+from pathlib import Path
+
+import query_archive
+
+from cuny_config import ignore_institutions
+from external_sort import sorted_rows
+
+rules_archive_dir = Path('./rules_archive')
+rules_query_name = 'QNS_CV_SR_TRNS_INTERNAL_RULES'
+
+Rule = namedtuple('Rule', 'source_courses destination_courses effective_date')
+Difference = namedtuple('Difference', 'rule_key change field old new')
+
+
+def number(value: str) -> str:
+  """Canonical string for a numeric value, so 3, 3.0, and 3.000 all compare equal."""
+  return f'{float(value):g}'
+
+
+# Fact extraction
+# -------------------------------------------------------------------------------------------------
+# Facts are lists of strings with the rule_key first, then a kind: S for a source course
+# (course_id, offer_nbr, min_gpa, max_gpa, credit_source), D for a destination course (course_id,
+# offer_nbr, transfer_credits), or E for the effective date.
+
+def archive_facts(archive_date: str):
+  """Generate the facts for a set of archived rules."""
+  def archive_rows(table_name: str):
+    with bz2.open(rules_archive_dir / f'{archive_date}_{table_name}.csv.bz2', 'rt',
+                  newline='') as csv_file:
+      yield from csv.reader(csv_file)
+
+  for rule_key, course_id, offer_nbr, min_credits, max_credits, credit_source, min_gpa, max_gpa \
+      in archive_rows('source_courses'):
+    yield [rule_key, 'S', str(int(course_id)), str(int(offer_nbr)), number(min_gpa),
+           number(max_gpa), credit_source]
+  for rule_key, course_id, offer_nbr, transfer_credits in archive_rows('destination_courses'):
+    yield [rule_key, 'D', str(int(course_id)), str(int(offer_nbr)), number(transfer_credits)]
+  for rule_key, effective_date in archive_rows('effective_dates'):
+    yield [rule_key, 'E', effective_date]
+
+
+def query_facts(csv_file):
+  """Generate the facts for the rows of a transfer rules query file."""
+  csv_reader = csv.reader(csv_file)
+  Record = None
+  for line in csv_reader:
+    if Record is None:
+      line[0] = line[0].replace('\ufeff', '')
+      Record = namedtuple('Record', [val.lower().replace(' ', '_').replace('/', '_')
+                                     for val in line])
+      continue
+    try:
+      record = Record._make(line)
+      if record.transfer_course != 'Y' or \
+         record.source_institution in ignore_institutions or \
+         record.destination_institution in ignore_institutions:
+        continue
+      rule_key = (f'{record.source_institution}:{record.destination_institution}:'
+                  f'{record.component_subject_area.replace(" ", "_")}:'
+                  f'{int(record.src_equivalency_component)}')
+      effective_date = max(date(month=int(month), day=int(day), year=int(year))
+                           for month, day, year in [field.split('/') for field in
+                                                    [record.transfer_subject_eff_date,
+                                                     record.transfer_component_eff_date,
+                                                     record.source_inst_eff_date,
+                                                     record.transfer_to_eff_date,
+                                                     record.crse_offer_eff_date,
+                                                     record.crse_offer_view_eff_date]])
+      yield [rule_key, 'S', str(int(record.source_course_id)), str(int(record.source_offer_nbr)),
+             number(record.min_grade_pts), number(record.max_grade_pts),
+             record.subject_credit_source]
+      yield [rule_key, 'D', str(int(record.destination_course_id)),
+             str(int(record.destination_offer_nbr)), number(record.units_taken)]
+      yield [rule_key, 'E', effective_date.isoformat()]
+    except (TypeError, ValueError) as err:
+      print(f'Line {csv_reader.line_num} ignored: {err}', file=sys.stderr)
+
+
+def source_facts(source: str):
+  """Generate the facts for a rules source given on the command line."""
+  if source.startswith('query:'):
+    with query_archive.open_query(rules_query_name, source.removeprefix('query:')) as csv_file:
+      yield from query_facts(csv_file)
+  elif Path(source).is_file():
+    with open(source, newline='', errors='replace') as csv_file:
+      yield from query_facts(csv_file)
+  elif (rules_archive_dir / f'{source}_source_courses.csv.bz2').exists():
+    yield from archive_facts(source)
+  else:
+    raise FileNotFoundError(f'{source} is not a rules archive date or a rules query file')
+
+
+def rules(source: str):
+  """Generate (rule_key, Rule) pairs in rule_key order."""
+  facts = sorted_rows(source_facts(source), key=lambda fact: fact[0])
+  for rule_key, rule_facts in groupby(facts, key=lambda fact: fact[0]):
+    source_courses = dict()
+    destination_courses = dict()
+    effective_date = ''
+    for fact in rule_facts:
+      if fact[1] == 'S':
+        source_courses[(fact[2], fact[3])] = tuple(fact[4:])
+      elif fact[1] == 'D':
+        destination_courses[(fact[2], fact[3])] = fact[4]
+      else:
+        effective_date = max(effective_date, fact[2])
+    yield rule_key, Rule(source_courses, destination_courses, effective_date)
+
+
+# Comparison
+# -------------------------------------------------------------------------------------------------
+def course_list(courses: dict) -> str:
+  """Colon-separated course_id.offer_nbr list, like transfer_rules.sending_courses."""
+  return ':'.join(f'{int(course_id):06}.{offer_nbr}' for course_id, offer_nbr in sorted(courses))
+
+
+def compare(rule_key: str, old: Rule, new: Rule):
+  """Generate the field-level differences between two versions of a rule."""
+  if old.source_courses.keys() != new.source_courses.keys():
+    yield Difference(rule_key, 'modified', 'source_courses',
+                     course_list(old.source_courses), course_list(new.source_courses))
+  for course in sorted(old.source_courses.keys() & new.source_courses.keys()):
+    course_str = f'{int(course[0]):06}.{course[1]}'
+    old_min, old_max, old_credit_source = old.source_courses[course]
+    new_min, new_max, new_credit_source = new.source_courses[course]
+    if (old_min, old_max) != (new_min, new_max):
+      yield Difference(rule_key, 'modified', f'gpa {course_str}',
+                       f'{old_min}-{old_max}', f'{new_min}-{new_max}')
+    if old_credit_source != new_credit_source:
+      yield Difference(rule_key, 'modified', f'credit_source {course_str}',
+                       old_credit_source, new_credit_source)
+
+  if old.destination_courses.keys() != new.destination_courses.keys():
+    yield Difference(rule_key, 'modified', 'destination_courses',
+                     course_list(old.destination_courses), course_list(new.destination_courses))
+  for course in sorted(old.destination_courses.keys() & new.destination_courses.keys()):
+    if old.destination_courses[course] != new.destination_courses[course]:
+      yield Difference(rule_key, 'modified', f'credits {int(course[0]):06}.{course[1]}',
+                       old.destination_courses[course], new.destination_courses[course])
+
+  if old.effective_date != new.effective_date:
+    yield Difference(rule_key, 'modified', 'effective_date', old.effective_date,
+                     new.effective_date)
+
+
+def diff(old_source: str, new_source: str):
+  """Merge-join two rule streams, generating Differences."""
+  old_rules = rules(old_source)
+  new_rules = rules(new_source)
+  old_key, old_rule = next(old_rules, (None, None))
+  new_key, new_rule = next(new_rules, (None, None))
+  while old_key is not None or new_key is not None:
+    if new_key is None or (old_key is not None and old_key < new_key):
+      yield Difference(old_key, 'removed', 'rule', course_list(old_rule.source_courses) + ' => '
+                       + course_list(old_rule.destination_courses), '')
+      old_key, old_rule = next(old_rules, (None, None))
+    elif old_key is None or new_key < old_key:
+      yield Difference(new_key, 'added', 'rule', '', course_list(new_rule.source_courses) + ' => '
+                       + course_list(new_rule.destination_courses))
+      new_key, new_rule = next(new_rules, (None, None))
+    else:
+      yield from compare(old_key, old_rule, new_rule)
+      old_key, old_rule = next(old_rules, (None, None))
+      new_key, new_rule = next(new_rules, (None, None))
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Differences between two sets of transfer rules')
+  parser.add_argument('old', help='archive date, rules query file, or query:YYYY-MM-DD')
+  parser.add_argument('new', help='archive date, rules query file, or query:YYYY-MM-DD')
+  parser.add_argument('-f', '--format', choices=['csv', 'table'], default='csv')
+  args = parser.parse_args()
+
+  counts = Counter()
+  changed_rules = set()
+  if args.format == 'csv':
+    csv_writer = csv.writer(sys.stdout)
+    csv_writer.writerow(Difference._fields)
+  for difference in diff(args.old, args.new):
+    if difference.rule_key not in changed_rules:
+      changed_rules = {difference.rule_key}
+      counts[difference.change] += 1
+    if args.format == 'csv':
+      csv_writer.writerow(difference)
+    else:
+      print(f'{difference.rule_key:<28} {difference.change:<8} {difference.field:<28} '
+            f'{difference.old:>24} => {difference.new}')
+
+  for change in ['added', 'removed', 'modified']:
+    print(f'{counts[change]:>10,} rules {change}', file=sys.stderr)
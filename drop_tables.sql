@@ -1,4 +1,5 @@
-drop table if exists course_attributes, credit_sources, crse_equiv_tbl, cuny_careers, cuny_courses,
-cuny_departments, cuny_disciplines, cuny_divisions, cuny_institutions, cuny_programs, cuny_subjects,
-cuny_subplans, designations, destination_courses, source_courses, subject_rule_map, transfer_rules
+drop table if exists course_attributes, course_clusters, credit_sources, cross_listings,
+crse_equiv_tbl, cuny_careers, cuny_courses, cuny_departments, cuny_disciplines, cuny_divisions,
+cuny_institutions, cuny_programs, cuny_subjects, cuny_subplans, designations, destination_courses,
+requirement_courses, source_courses, subject_rule_map, transfer_rules
 cascade;
@@ -0,0 +1,50 @@
+"""Sort more rows than fit in memory.
+
+Rows are collected in chunks of at most chunk_size rows; each chunk is sorted and spilled to an
+anonymous temporary CSV file, and the sorted chunks are merged as they are read back. The merge is
+stable: rows with equal keys come out in the order they went in. Only one chunk, plus one row per
+spilled chunk, is ever in memory.
+
+Rows are lists of strings going out as well as coming in, so the key function has to work on the
+string values.
+"""
+
+import csv
+import heapq
+import tempfile
+
+CHUNK_SIZE = 250_000
+
+
+def sorted_rows(rows, key, chunk_size: int = CHUNK_SIZE):
+  """Generate rows (lists of strings) in key order."""
+  chunk_files = []
+  chunk = []
+  try:
+    for row in rows:
+      chunk.append(row)
+      if len(chunk) >= chunk_size:
+        chunk_files.append(_spill(sorted(chunk, key=key)))
+        chunk = []
+
+    if not chunk_files:
+      # Everything fit in memory
+      yield from sorted(chunk, key=key)
+      return
+
+    if chunk:
+      chunk_files.append(_spill(sorted(chunk, key=key)))
+      chunk = []
+    yield from heapq.merge(*[csv.reader(chunk_file) for chunk_file in chunk_files], key=key)
+
+  finally:
+    for chunk_file in chunk_files:
+      chunk_file.close()
+
+
+def _spill(chunk: list):
+  """Write a sorted chunk to a temporary file, and return the file, rewound for reading."""
+  chunk_file = tempfile.TemporaryFile('w+', newline='', encoding='utf-8')
+  csv.writer(chunk_file).writerows(chunk)
+  chunk_file.seek(0)
+  return chunk_file
@@ -0,0 +1,24 @@
+#! /usr/local/bin/python3
+"""SHA-256 of a file’s contents, for the update steps’ input hashes and the query archive.
+
+Kept apart from update_steps.py so query_archive.py can use it without needing psycopg.
+"""
+
+import hashlib
+import sys
+
+from pathlib import Path
+
+
+def file_hash(path: Path) -> str:
+  """SHA-256 of a file’s contents, read in 1 MB blocks so large query files are never in memory."""
+  digest = hashlib.sha256()
+  with open(path, 'rb') as input_file:
+    while block := input_file.read(0x100000):
+      digest.update(block)
+  return digest.hexdigest()
+
+
+if __name__ == '__main__':
+  for arg in sys.argv[1:]:
+    print(f'{file_hash(Path(arg))}  {arg}')
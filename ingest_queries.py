@@ -0,0 +1,186 @@
+#! /usr/local/bin/python3
+"""Ingest a new set of CUNYfirst query files into latest_queries in one streaming pass per file.
+
+This replaces the iconv step in get_cuny and the file shuffling in check_queries.py. Each query
+file in the source directory (query_downloads, where get_cuny puts the files it gets from
+Tumbleweed, or any other local directory where a set of query files has been dropped) is read just
+once: invalid UTF-8 sequences are dropped (like iconv -c), a leading byte order mark is removed, and
+the result is written to a temporary file in latest_queries under the query’s normalized name. The
+files are processed in parallel.
+
+Once all the files have been ingested, they are validated the same way check_queries.py validates
+the queries folder: there has to be one file for each required query, they all have to have the
+same date, and their sizes have to be close to the sizes of the files they replace. If that all
+goes well, the previous latest_queries files are archived and the new ones are renamed into place.
+Otherwise the temporary files are removed and nothing is changed.
+
+Command line options are the same as for check_queries.py: --skip_date_check, --skip_size_check,
+--skip_archive, and --size_check_limit.
+"""
+
+import argparse
+import codecs
+import os
+import sys
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from pathlib import Path
+
+from check_queries import archive_query, latest_queries_dir, required_query_names, \
+    size_check_limit
+
+DEBUG = os.getenv('DEBUG_INGEST_QUERIES')
+
+BLOCK_SIZE = 0x100000
+
+Ingested = namedtuple('Ingested', 'query_name source target size num_lines num_dropped')
+
+
+def new_query_files(source_dir: Path) -> dict:
+  """Newest file for each required query in the source directory.
+
+  CUNYfirst appends a process id to the query name; any other suffix means it’s some other query.
+  """
+  newest = dict()
+  for csv_file in source_dir.glob('*.csv'):
+    query_name = csv_file.stem.strip('0123456789-')
+    if query_name not in required_query_names:
+      continue
+    if query_name not in newest or newest[query_name].stat().st_mtime < csv_file.stat().st_mtime:
+      newest[query_name] = csv_file
+  return newest
+
+
+def sanitize(query_name: str, source: Path) -> Ingested:
+  """Copy source to a temporary file in latest_queries, dropping invalid UTF-8 and any BOM.
+
+  The temporary file gets the source’s modification time, which is how the query’s date is tracked.
+  """
+  target = latest_queries_dir / f'.{query_name}.csv.part'
+  decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+  num_lines = num_bytes = bom_bytes = 0
+  with open(source, 'rb') as source_file, open(target, 'w', encoding='utf-8',
+                                                 newline='') as target_file:
+    at_start = True
+    while block := source_file.read(BLOCK_SIZE):
+      num_bytes += len(block)
+      text = decoder.decode(block)
+      if at_start and text:
+        if text.startswith('\ufeff'):
+          text = text[1:]
+          bom_bytes = len(codecs.BOM_UTF8)
+        at_start = False
+      num_lines += text.count('\n')
+      target_file.write(text)
+    target_file.write(decoder.decode(b'', final=True))
+  stat = source.stat()
+  os.utime(target, (stat.st_atime, stat.st_mtime))
+  size = target.stat().st_size
+  return Ingested(query_name, source, target, size, num_lines, num_bytes - bom_bytes - size)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Ingest new CUNYfirst query files')
+  parser.add_argument('-d', '--debug', action='store_true')
+  parser.add_argument('-s', '--source', default=Path(latest_queries_dir.parent, 'query_downloads'),
+                      help='directory containing the new query files (default: query_downloads)')
+  parser.add_argument('-sd', '--skip_date_check', action='store_true')
+  parser.add_argument('-ss', '--skip_size_check', action='store_true')
+  parser.add_argument('-sa', '--skip_archive', action='store_true')
+  parser.add_argument('-scl', '--size_check_limit', type=int)
+  args = parser.parse_args()
+
+  if args.size_check_limit:
+    size_check_limit = float(args.size_check_limit) / 100.0
+
+  if args.debug:
+    DEBUG = True
+
+  source_dir = Path(args.source)
+  assert source_dir.is_dir(), f'{source_dir} does not exist'
+
+  notices = []
+  stops = []
+
+  new_queries = new_query_files(source_dir)
+  for query_name in required_query_names:
+    if query_name not in new_queries:
+      stops.append(f'STOP: No query file for {query_name} in {source_dir}')
+  if stops:
+    for stop in stops:
+      print(stop, file=sys.stderr)
+    sys.exit(1)
+
+  # Sanitize the files in parallel
+  print(f'Ingest {len(new_queries)} query files from {source_dir}')
+  # If any of them fails, the partial files the others wrote are removed before giving up.
+  try:
+    with ProcessPoolExecutor(max_workers=min(len(new_queries), os.cpu_count() or 1)) as executor:
+      ingested = list(executor.map(sanitize, new_queries.keys(), new_queries.values()))
+  except Exception:
+    for part_file in latest_queries_dir.glob('.*.csv.part'):
+      part_file.unlink(missing_ok=True)
+    raise
+
+  # Validate the ingested files
+  new_mod_date = None
+  for query in ingested:
+    if DEBUG:
+      print(f'{query.query_name:32} {query.size:>12,} bytes {query.num_lines:>10,} lines '
+            f'{query.num_dropped:,} bytes dropped', file=sys.stderr)
+    if query.num_dropped:
+      notices.append(f'NOTICE: Dropped {query.num_dropped:,} bytes of invalid UTF-8 from '
+                     f'{query.source.name}')
+    if query.num_lines < 2:
+      stops.append(f'STOP: {query.source.name} has no data rows')
+      continue
+
+    new_date = date.fromtimestamp(query.target.stat().st_mtime).strftime('%Y-%m-%d')
+    if new_mod_date is None:
+      new_mod_date = new_date
+    if not args.skip_date_check and new_date != new_mod_date:
+      stops.append(f'STOP: {query.source.name:>36} Expected {new_mod_date}, but got {new_date}.')
+
+    target_query = latest_queries_dir / f'{query.query_name}.csv'
+    if args.skip_size_check or not target_query.exists():
+      notices.append(f'NOTICE: size check skipped for {query.source.name}')
+    else:
+      target_size = target_query.stat().st_size
+      if abs(target_size - query.size) > (size_check_limit * target_size):
+        stops.append(f'STOP: {query.source.name} size ({query.size:,}) is not within '
+                     f'{int(size_check_limit * 100)}% of the previous query’s size '
+                     f'({target_size:,})')
+
+  if stops:
+    for query in ingested:
+      query.target.unlink()
+  else:
+    # Archive the previous latest_queries files and move the new ones into place
+    if not args.skip_archive:
+      print('Archive previous queries')
+      prev_mod_date = None
+      for query in ingested:
+        target_query = latest_queries_dir / f'{query.query_name}.csv'
+        if target_query.exists():
+          if prev_mod_date is None:
+            prev_mod_date = date.fromtimestamp(target_query.stat().st_mtime).strftime('%Y-%m-%d')
+          archive_query(target_query, prev_mod_date)
+        else:
+          notices.append(f'NOTICE: Unable to archive {target_query} because it does not exist')
+
+    print('Move new queries to latest_queries')
+    for query in ingested:
+      query.target.rename(latest_queries_dir / f'{query.query_name}.csv')
+      query.source.unlink()
+
+  for notice in notices:
+    print(notice, file=sys.stderr)
+  for stop in stops:
+    print(stop, file=sys.stderr)
+  if stops:
+    s = '' if len(stops) == 1 else 's'
+    print(f'Ingest Queries: {len(stops)} STOP{s}')
+    sys.exit(1)
+  print(f'Ingested {len(ingested)} queries dated {new_mod_date}')
@@ -3,15 +3,15 @@
 
     All table fields are text unless the column name starts with “count” or ends with “date.
 """
-import csv
 import psycopg
 import sys
 
-from collections import namedtuple
 from datetime import date
 from pathlib import Path
 from psycopg.rows import namedtuple_row
 
+from bulk_load import all_columns, load
+
 # For cuny_curriculum tables that are just copies of the CUNYfirst queries, this query_files dict
 # allows us to build all the local tables in a uniform way. Unfortunately, adding CIP codes to the
 # set of "base tables" made this messy.
@@ -22,7 +22,9 @@ query_files = {'cuny_cip_code_tbl': 'CIP_CODE_TBL',
                'cuny_acad_subplan_tbl': 'ACAD_SUBPLAN_TBL',
                'cuny_acad_subplan_enrollments': 'ACAD_SUBPLAN_ENRL'}
 
-with psycopg.connect('dbname=cuny_curriculum') as conn:
+
+def load_cuny_base_tables(conn):
+  """Create and populate the tables in query_files."""
   with conn.cursor(row_factory=namedtuple_row) as cursor:
 
     for table_name, query_name in query_files.items():
@@ -38,41 +40,40 @@ with psycopg.connect('dbname=cuny_curriculum') as conn:
         num_rows = len(csv_file.readlines())
       date_str = date.fromtimestamp(latest.stat().st_mtime)
 
-      with open(latest) as csv_file:
-        print(f'Loading {table_name} from {latest.name} {date_str} ({num_rows:,} rows)')
+      print(f'Loading {table_name} from {latest.name} {date_str} ({num_rows:,} rows)')
+
+      def table_columns(cols):
+        """Create the table from the query’s column names, and return its columns mapping."""
+        col_defs = ''
+        for col in cols:
+          col_defs += 'enrollment int,\n' if col.startswith('count_') \
+              else f'{col} date,\n' if col.endswith('date') \
+              else f'{col} text,\n'
+        if cols[0] == 'institution':
+          pkey = ['institution', 'plan']
+          if 'subplan' in cols:
+            pkey.append('subplan')
+          pkey = 'primary key(' + ', '.join(pkey) + ')'
+        else:
+          pkey = f'primary key ({cols[0]})'
+          print(f'WARNING: Using first column ({cols[0]}) as primary key for {table_name}',
+                file=sys.stderr)
+        cursor.execute(f"""
+        drop table if exists {table_name};
+        create table {table_name} (
+          {col_defs}
+          {pkey})
+        """)
+        columns = all_columns(lambda v: int(v) if v.isdigit() else v.replace('\'', '’'))(cols)
+        return {'enrollment' if col.startswith('count_') else col: value
+                for col, value in columns.items()}
+
+      load(cursor, table_name, latest, table_columns,
+           normalize=lambda heading: heading.lower().replace(' ', '_')
+                                                    .replace('-', '')
+                                                    .replace('academic_', ''))
 
-        reader = csv.reader(csv_file)
-        for line in reader:
-          if reader.line_num == 1:
-            cols = [col.lower().replace(' ', '_').replace('-', '').replace('academic_', '')
-                    for col in line]
-            Row = namedtuple('Row', cols)
-            col_defs = ''
-            for col in cols:
-              col_defs += 'enrollment int,\n' if col.startswith('count_') \
-                  else f'{col} date,\n' if col.endswith('date') \
-                  else f'{col} text,\n'
-            if cols[0] == 'institution':
-              pkey = ['institution', 'plan']
-              if 'subplan' in cols:
-                pkey.append('subplan')
-              pkey = 'primary key(' + ', '.join(pkey) + ')'
-            else:
-              pkey = f'primary key ({cols[0]})'
-              print(f'WARNING: Using first column ({cols[0]}) as primary key for {table_name}',
-                    file=sys.stderr)
-            cursor.execute(f"""
-            drop table if exists {table_name};
-            create table {table_name} (
-              {col_defs}
-              {pkey})
-            """)
 
-            values_clause = ', '.join(['%s'] * len(cols))
-            insert_query = f'insert into {table_name} values({values_clause})'
-          else:
-            row = Row._make(line)
-            values = [int(v) if v.isdigit() else v.replace('\'', '’') for v in row]
-            cursor.execute(f"""
-            {insert_query}
-            """, values)
+if __name__ == '__main__':
+  with psycopg.connect('dbname=cuny_curriculum') as conn:
+    load_cuny_base_tables(conn)
@@ -13,13 +13,13 @@ Renaming CUNYfirst fields:
   Census Date             census_date
 
 """
-import csv
 import psycopg
 
-from collections import namedtuple
-from psycopg.rows import namedtuple_row
+from bulk_load import load
 
-with psycopg.connect('dbname=cuny_curriculum') as conn:
+
+def load_sessions_table(conn):
+  """Create and populate the cuny_sessions table."""
   with conn.cursor() as cursor:
 
     cursor.execute("""
@@ -44,27 +44,15 @@ with psycopg.connect('dbname=cuny_curriculum') as conn:
                  'census_date': 'census_date',
                  'session_end_date': 'classes_end'
                  }
-    with open('./latest_queries/QNS_CV_SESSION_TABLE.csv') as sess:
-      reader = csv.reader(sess)
-      for line in reader:
-        if reader.line_num == 1:
-          cols = [c.lower().replace(' ', '_') for c in line]
-        else:
-          row = dict()
-          for index, value in enumerate(line):
-            row[cols[index]] = value
-          if row['career'].startswith('U'):
-            column_names = ['institution', 'term', 'session']
-            placeholders = '%s, %s, %s'
-            values = [row['institution'], row['term'], row['session']]
-            # Handle missing dates
-            for field in ['first_date_to_enroll', 'open_enrollment_date', 'last_date_to_enroll',
-                          'session_beginning_date', 'census_date', 'session_end_date']:
-                if row[field]:
-                  column_names.append(csv_to_db[field])
-                  placeholders += ', %s'
-                  values.append(row[field])
-            column_names = ', '.join(column_names)
-            cursor.execute(f"""
-            insert into cuny_sessions ({column_names}) values ({placeholders})
-            """, values)
+    columns = {'institution': 'institution', 'term': 'term', 'session': 'session'}
+    # Missing dates are null
+    for field, column in csv_to_db.items():
+      columns[column] = lambda row, field=field: getattr(row, field) or None
+    load(cursor, 'cuny_sessions', './latest_queries/QNS_CV_SESSION_TABLE.csv', columns,
+         where=lambda row: row.career.startswith('U'),
+         normalize=lambda heading: heading.lower().replace(' ', '_'))
+
+
+if __name__ == '__main__':
+  with psycopg.connect('dbname=cuny_curriculum') as conn:
+    load_sessions_table(conn)
@@ -9,58 +9,64 @@
       being part of an equivalence group rather than having been reviewed by the CCCRC.
 """
 import os
-import csv
-import sys
 import argparse
 
-from collections import namedtuple
-
 import psycopg
 from psycopg.rows import namedtuple_row
 
-parser = argparse.ArgumentParser()
-parser.add_argument('--debug', '-d', action='store_true')
-parser.add_argument('--progress', '-p', action='store_true')
-args = parser.parse_args()
+from bulk_load import load
+import profiling
+
+query_file = './latest_queries/QNS_CV_CRSE_EQUIV_TBL.csv'
 
-try:
-  terminal = open(os.ttyname(0), 'wt')
-except OSError as e:
-  # No progress reporting unless run from command line
-  terminal = open('/dev/null', 'wt')
 
-num_rows = 0
-conn = psycopg.connect('dbname=cuny_curriculum')
-cursor = conn.cursor(row_factory=namedtuple_row)
+def create_crse_equiv_tbl(conn, progress: bool = False):
+  """Create and populate the crse_equiv_tbl table."""
+  try:
+    terminal = open(os.ttyname(0), 'wt')
+  except OSError as e:
+    # No progress reporting unless run from command line
+    terminal = open('/dev/null', 'wt')
 
-cursor.execute("""
-  drop table if exists crse_equiv_tbl cascade;
-  create table crse_equiv_tbl (
-    equivalent_course_group integer primary key,
-    description text)
-""")
+  cursor = conn.cursor(row_factory=namedtuple_row)
+  cursor.execute("""
+    drop table if exists crse_equiv_tbl cascade;
+    create table crse_equiv_tbl (
+      equivalent_course_group integer primary key,
+      description text)
+  """)
 
-total_rows = sum(1 for line in open('./latest_queries/QNS_CV_CRSE_EQUIV_TBL.csv'))
-with open('./latest_queries/QNS_CV_CRSE_EQUIV_TBL.csv') as csvfile:
-  csv_reader = csv.reader(csvfile)
-  raw = next(csv_reader, False)   # header row
-  raw[0] = raw[0].replace('\ufeff', '')
-  Equiv_Table_Row = namedtuple('Equiv_Table_Row',
-                               [val.lower().replace(' ', '_').replace('/', '_') for val in raw])
-  raw = next(csv_reader, False)   # first data row
-  while raw:
+  total_rows = sum(1 for line in open(query_file))
+  num_rows = 0
+
+  def is_valid(row):
+    """Report and skip rows with a non-integer equivalent_course_group."""
+    nonlocal num_rows
     num_rows += 1
-    if args.progress and 0 == num_rows % 1000:
+    if progress and 0 == num_rows % 1000:
       print(f'{num_rows:,} / {total_rows:,}\r', end='', file=terminal)
-    row = Equiv_Table_Row._make(raw)
     try:
       int(row.equivalent_course_group)
-      cursor.execute('insert into crse_equiv_tbl values (%s, %s)', (row.equivalent_course_group,
-                                                                    row.description))
+      return True
     except ValueError:
       print('Invalid Index:', row)
-    raw = next(csv_reader, False)   # next data row
-  if args.progress:
+      return False
+
+  load(cursor, 'crse_equiv_tbl', query_file,
+       {'equivalent_course_group': 'equivalent_course_group',
+        'description': 'description'},
+       where=is_valid)
+  if progress:
     print(file=terminal)
-conn.commit()
-conn.close()
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--debug', '-d', action='store_true')
+  parser.add_argument('--progress', '-p', action='store_true')
+  profiling.add_arguments(parser)
+  args = parser.parse_args()
+
+  with psycopg.connect('dbname=cuny_curriculum') as conn:
+    with profiling.profiled('crse_equiv_tbl', args.profile, args.cprofile):
+      create_crse_equiv_tbl(conn, progress=args.progress)
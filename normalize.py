@@ -0,0 +1,41 @@
+#! /usr/local/bin/python3
+"""Normalize catalog text: course titles, descriptions, and requisites.
+
+  Straight apostrophes become ’
+  Carriage returns are dropped, and newlines become spaces
+  A space (or newline) after an opening parenthesis is dropped
+  Straight double quotes become curly quotes, alternating “ and ” (see smartify.py)
+
+All of that is done in a single pass of one compiled regular expression. Results are cached by raw
+string, and interned: the offers of cross-listed courses mostly share their titles and descriptions,
+so the same text is normalized once and stored once. The cache holds on to every string it has
+seen, so callers clear it (normalize.cache_clear()) when they are done, as populate_cuny_courses.py
+does.
+"""
+
+import re
+import sys
+
+from functools import lru_cache
+from itertools import cycle
+
+_pattern = re.compile(r'\(\r*[ \n]|[\'\r\n"]')
+_replacements = {"'": '’', '\r': '', '\n': ' '}
+
+
+@lru_cache(maxsize=None)
+def normalize(raw: str) -> str:
+  """The normalized version of a string."""
+  quotes = cycle('“”')
+
+  def replacement(match):
+    text = match.group()
+    if text == '"':
+      return next(quotes)
+    return _replacements.get(text, '(')
+
+  return sys.intern(_pattern.sub(replacement, raw))
+
+
+if __name__ == '__main__':
+  print(normalize(' '.join(sys.argv[1:])))
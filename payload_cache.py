@@ -0,0 +1,202 @@
+#! /usr/local/bin/python3
+"""Read-through redis cache of the course and rule payloads that Transfer Explorer renders.
+
+A payload is the JSON for one course (all its offer_nbrs’ cuny_courses rows) or one transfer rule
+(its transfer_rules row, with its source and destination courses), built by the db in one query.
+Payloads are cached in redis under versioned keys:
+
+  payload:<kind>:<version>:<id>     The payload, where kind is course or rule, and id is a course_id
+                                    or a rule_key
+  payload:<kind>:version            The current version of the kind’s payloads
+
+A kind’s version is made from the versions the updates table records for its tables (see
+update_steps.py), so when update_db changes a table, the payloads built from it are simply no longer
+looked up, and they expire. pipeline.py warms the cache for the kinds whose tables have changed, and
+only then sets the new version, so the web workers switch to a fully-loaded set of payloads.
+
+In the app:
+  courses = payload_cache.fetch(conn, 'course', [12345, 67890])   # {course_id: payload, ...}
+
+fetch() gets all the payloads it can with one MGET, and queries the db just for the ones that are
+missing, caching them as it goes. Without redis (the module isn’t installed, or the server isn’t
+running), everything comes from the db.
+
+To warm the cache by hand:
+  payload_cache.py [kind ...]
+"""
+
+import argparse
+import json
+import sys
+
+from collections import namedtuple
+
+import psycopg
+from psycopg import sql
+
+try:
+  import redis
+except ImportError:
+  redis = None
+
+EXPIRE = 8 * 24 * 60 * 60  # Seconds: a week, plus a day for an update_db run to finish
+BATCH_SIZE = 1000          # Payloads per round trip when warming the cache
+
+# The query for a kind of payload returns (id, payload) pairs; where selects the rows for a list of
+# ids, using the parameters that params makes from the ids.
+Payload = namedtuple('Payload', 'tables query where params')
+
+payloads = {
+    'course': Payload(['cuny_courses'], """
+        select course_id, json_agg(c order by offer_nbr)::text
+          from cuny_courses c {}
+         group by course_id
+        """,
+        'where course_id = any(%s)',
+        lambda ids: ([int(course_id) for course_id in ids], )),
+
+    # The destination institution, which is part of the rule key, lets the lookup use the rule
+    # tables’ unique (destination_institution, rule_key) index.
+    'rule': Payload(['transfer_rules', 'source_courses', 'destination_courses'], """
+        select r.rule_key,
+               json_build_object(
+                 'rule', r,
+                 'source_courses',
+                 (select json_agg(s order by s.discipline, s.cat_num, s.offer_nbr)
+                    from source_courses s
+                   where s.destination_institution = r.destination_institution
+                     and s.rule_id = r.id),
+                 'destination_courses',
+                 (select json_agg(d order by d.discipline, d.cat_num, d.offer_nbr)
+                    from destination_courses d
+                   where d.destination_institution = r.destination_institution
+                     and d.rule_id = r.id))::text
+          from transfer_rules r {}
+        """,
+        'where r.destination_institution = any(%s) and r.rule_key = any(%s)',
+        lambda ids: (list({rule_key.split(':')[1] for rule_key in ids}), list(ids))),
+}
+
+# The redis connection: None until first used, False if redis is not available.
+_server = None
+
+
+def _redis():
+  """The redis connection, or False if there isn’t one."""
+  global _server
+  if _server is None:
+    _server = False
+    if redis is not None:
+      try:
+        server = redis.Redis(host='localhost', socket_connect_timeout=1)
+        server.ping()
+        _server = server
+      except redis.exceptions.RedisError:
+        pass
+  return _server
+
+
+def db_version(conn, kind: str) -> str:
+  """A kind’s current version: the versions of its tables, joined with dots."""
+  tables = payloads[kind].tables
+  versions = dict(conn.execute("""
+                               select table_name, version from updates
+                                where table_name = any(%s)
+                               """, (tables, )).fetchall())
+  return '.'.join(str(versions.get(table_name, 0)) for table_name in tables)
+
+
+def _query(conn, kind: str, ids=None):
+  """Query the payloads for the ids (default: all of them); return a cursor over (id, payload)."""
+  payload = payloads[kind]
+  if ids is None:
+    cursor = conn.cursor(name=f'{kind}_payloads')
+    cursor.execute(sql.SQL(payload.query).format(sql.SQL('')))
+  else:
+    cursor = conn.cursor()
+    cursor.execute(sql.SQL(payload.query).format(sql.SQL(payload.where)), payload.params(ids))
+  return cursor
+
+
+def _store(server, kind: str, version: str, rows) -> int:
+  """Cache (id, payload) rows in batches; return the number cached."""
+  num_rows = 0
+  with server.pipeline(transaction=False) as pipe:
+    for payload_id, payload in rows:
+      pipe.set(f'payload:{kind}:{version}:{payload_id}', payload, ex=EXPIRE)
+      num_rows += 1
+      if num_rows % BATCH_SIZE == 0:
+        pipe.execute()
+    pipe.execute()
+  return num_rows
+
+
+def fetch(conn, kind: str, ids) -> dict:
+  """The payloads (decoded) for a list of ids, keyed by id. Ids that don’t exist are left out."""
+  ids = list(dict.fromkeys(ids))
+  blobs = [None] * len(ids)
+  server = _redis()
+  if server:
+    try:
+      version = server.get(f'payload:{kind}:version')
+      if version is None:
+        version = db_version(conn, kind)
+        server.set(f'payload:{kind}:version', version)
+      else:
+        version = version.decode()
+      blobs = server.mget([f'payload:{kind}:{version}:{payload_id}' for payload_id in ids])
+    except redis.exceptions.RedisError:
+      server = False
+
+  result = {payload_id: json.loads(blob)
+            for payload_id, blob in zip(ids, blobs) if blob is not None}
+  missing = [payload_id for payload_id, blob in zip(ids, blobs) if blob is None]
+  if missing:
+    # Rows come back with ids of the db’s type; the caller’s ids might be strings.
+    requested = {str(payload_id): payload_id for payload_id in missing}
+    rows = _query(conn, kind, missing).fetchall()
+    if server:
+      try:
+        _store(server, kind, version, rows)
+      except redis.exceptions.RedisError:
+        pass
+    for payload_id, payload in rows:
+      result[requested[str(payload_id)]] = json.loads(payload)
+  return result
+
+
+def warm(conn, kinds=None) -> dict:
+  """Cache all the payloads of the kinds (default: all of them) under their current versions, then
+  make those the versions in use. Returns the number of payloads cached for each kind.
+  """
+  server = _redis()
+  if not server:
+    return dict()
+  counts = dict()
+  for kind in kinds or payloads.keys():
+    version = db_version(conn, kind)
+    with _query(conn, kind) as cursor:
+      counts[kind] = _store(server, kind, version, cursor)
+    server.set(f'payload:{kind}:version', version)
+  return counts
+
+
+def kinds_using(table_names) -> list:
+  """The kinds of payloads built from any of the tables."""
+  return [kind for kind, payload in payloads.items()
+          if any(table_name in payload.tables for table_name in table_names)]
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Warm the course and rule payload cache')
+  parser.add_argument('kinds', metavar='kind', nargs='*')
+  args = parser.parse_args()
+  for kind in args.kinds:
+    if kind not in payloads:
+      parser.error(f'unknown kind: {kind} (choose from {", ".join(payloads.keys())})')
+
+  with psycopg.connect('dbname=cuny_curriculum') as conn:
+    if not _redis():
+      sys.exit('redis is not available')
+    for kind, count in warm(conn, args.kinds or None).items():
+      print(f'{kind:8} {count:>9,} payloads cached')
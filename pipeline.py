@@ -0,0 +1,307 @@
+#! /usr/local/bin/python3
+"""Run the update_db steps that (re-)build the cuny_curriculum tables, all in one process.
+
+Run as separate scripts, each step pays for starting a Python interpreter (or psql), opening a
+connection, and re-reading the reference tables it shares with other steps. Here every step runs as
+a function on one shared connection, and the reference tables come from the read-through cache in
+reference_data.py, so those costs are paid just once. The anomalies recorders (anomalies.py) still
+open connections of their own, so anomalies are kept even if a step fails.
+
+When all the steps are done, the course and rule payloads built from the tables that have changed
+are cached in redis (payload_cache.py), and the post-load checks in validate.py run concurrently.
+
+Steps are the ones declared in update_steps.py, run in the same order. As in update_db, a step whose
+inputs are unchanged since it last ran is skipped unless --force is given, and a step’s input hash
+is recorded when it completes, along with the versions of the tables whose contents have changed,
+which are announced with NOTIFY cuny_curriculum_updated. Each step is committed separately, so a
+failure leaves the steps that completed before it in place, and they will be skipped on the next
+run.
+
+Progress messages go to stdout; update_db appends them to update.log. If a step fails, the last line
+written is “ERROR: <step> failed” and the exit code is 1.
+
+Usage:
+  python3 -m pipeline [--force] [--bulk] [--workers n] [--progress] [--report]
+                      [--profile | --cprofile] [--list]
+"""
+
+import argparse
+import importlib
+import resource
+import subprocess
+import sys
+
+from datetime import date
+from pathlib import Path
+from time import perf_counter
+
+import psycopg
+from psycopg.rows import namedtuple_row
+
+import bulk_load_mode
+import catalog_scan
+import payload_cache
+import profiling
+import reference_data
+import update_steps
+
+from class_max_term import create_class_max_term
+from course_clusters import create_course_clusters
+from cuny_careers import create_cuny_careers
+from cuny_departments import create_cuny_departments
+from cuny_divisions import create_cuny_divisions
+from cuny_programs import create_cuny_programs
+from cuny_subjects import create_cuny_subjects
+from designations import create_designations
+from load_cuny_base_tables import load_cuny_base_tables
+from load_sessions_table import load_sessions_table
+from mk_crse_equiv_tbl import create_crse_equiv_tbl
+from populate_cuny_courses import populate_cuny_courses
+from populate_transfer_rules import populate_transfer_rules
+from progress import Progress
+from requirement_courses import create_requirement_courses
+from rule_staleness import update_rule_staleness
+from summary_views import create_summary_views
+from validate import run_checks
+
+# The file name has a hyphen in it, so it can’t be imported with an import statement.
+create_subject_rule_map = importlib.import_module('mk_subject-rule_map').create_subject_rule_map
+
+
+def run_sql(conn, file_name: str):
+  """Execute the statements in a .sql file (the equivalent of psql -f)."""
+  conn.execute(Path(file_name).read_text())
+
+
+def say(message: str, end='\n'):
+  """Progress message for update.log."""
+  print(message, end=end, flush=True)
+
+
+# Step actions
+# -------------------------------------------------------------------------------------------------
+def do_cuny_institutions(conn, args):
+  run_sql(conn, 'cuny_institutions.sql')
+  conn.execute("""
+               update updates set update_date = %s, file_name = 'cuny_institutions.sql'
+               where table_name = 'cuny_institutions'
+               """, (date.fromtimestamp(Path('cuny_institutions.sql').stat().st_mtime), ))
+
+
+def do_cuny_courses(conn, args):
+  run_sql(conn, 'create_cuny_courses.sql')
+  run_sql(conn, 'view_courses.sql')
+  if deferred_tables('cuny_courses', args):
+    bulk_load_mode.defer(conn, deferred_tables('cuny_courses', args))
+  populate_cuny_courses(conn, progress=args.progress)
+
+
+def do_transfer_rules(conn, args):
+  # The tables are re-created in the step’s transaction. With --workers too, that isn’t committed
+  # until the loaded partitions have been swapped in, so the app never sees the tables empty.
+  run_sql(conn, 'create_transfer_rules.sql')
+  if deferred_tables('transfer_rules', args):
+    bulk_load_mode.defer(conn, deferred_tables('transfer_rules', args))
+  populate_transfer_rules(conn, progress=args.progress, report=args.report, workers=args.workers)
+
+
+def do_class_max_term(conn, args):
+  create_class_max_term(conn)
+  # The rules’ staleness columns depend on class_max_term too. (Rules that are being reloaded get
+  # theirs as they are written: see rule_staleness.py.)
+  if conn.execute("select to_regclass('transfer_rules') is not null").fetchone()[0]:
+    update_rule_staleness(conn)
+
+
+# The big tables that are loaded in bulk-load mode (--bulk); see bulk_load_mode.py. Their indexes
+# and constraints are restored once the step’s load has been committed.
+bulk_tables = {
+    'cuny_courses': ['cuny_courses'],
+    'transfer_rules': ['transfer_rules', 'source_courses', 'destination_courses'],
+}
+
+
+def deferred_tables(step_name: str, args) -> list:
+  """The tables whose indexes and constraints a step defers, if any. With --workers, the transfer
+  rules are loaded into staging tables that are indexed as soon as they are loaded, so nothing is
+  deferred.
+  """
+  if not args.bulk or (step_name == 'transfer_rules' and args.workers):
+    return []
+  return bulk_tables.get(step_name, [])
+
+
+# The progress message and action for each step in update_steps.steps.
+actions = {
+    'load_cuny_base_tables': ('LOAD BASE TABLES', lambda conn, args: load_cuny_base_tables(conn)),
+    'cuny_institutions': ('CREATE TABLE cuny_institutions', do_cuny_institutions),
+    'cuny_programs': ('CREATE academic_programs', lambda conn, args: create_cuny_programs(conn)),
+    'cuny_careers': ('CREATE TABLE cuny_careers', lambda conn, args: create_cuny_careers(conn)),
+    'cuny_divisions': ('CREATE TABLE cuny_divisions',
+                       lambda conn, args: create_cuny_divisions(conn)),
+    'cuny_departments': ('CREATE TABLE cuny_departments',
+                         lambda conn, args: create_cuny_departments(conn)),
+    'cuny_subjects': ('CREATE TABLE cuny_subjects', lambda conn, args: create_cuny_subjects(conn)),
+    'designations': ('CREATE TABLE designations', lambda conn, args: create_designations(conn)),
+    'crse_equiv_tbl': ('CREATE TABLE crse_equiv_tbl',
+                       lambda conn, args: create_crse_equiv_tbl(conn, progress=args.progress)),
+    'cuny_courses': ('CREATE and POPULATE cuny_courses', do_cuny_courses),
+    'course_clusters': ('CREATE TABLE course_clusters',
+                        lambda conn, args: create_course_clusters(conn)),
+    'review_status_bits': ('CREATE TABLE review_status_bits',
+                           lambda conn, args: run_sql(conn, 'review_status_bits.sql')),
+    'transfer_rules': ('CREATE and POPULATE transfer_rules, source_courses, destination_courses',
+                       do_transfer_rules),
+    'subject_rule_map': ('SPEEDUP transfer_rule lookups',
+                         lambda conn, args: create_subject_rule_map(conn,
+                                                                    progress=args.progress)),
+    'cuny_sessions': ('RECREATE cuny_sessions table', lambda conn, args: load_sessions_table(conn)),
+    'class_max_term': ('CREATE class_max_term table', do_class_max_term),
+    'requirement_courses': ('CREATE TABLE requirement_courses',
+                            lambda conn, args: create_requirement_courses(conn)),
+    'summary_views': ('CREATE summary views', lambda conn, args: create_summary_views(conn)),
+}
+
+
+def after_transfer_rules(conn, args):
+  # Archive transfer rules (only when they have been rebuilt)
+  say('Archive transfer rules')
+  subprocess.run(['./archive_rules.sh'], stderr=subprocess.STDOUT)
+
+
+# Tables that a step changes besides its own (update_steps.py), whose versions have to be updated.
+also_changes = {
+    'class_max_term': ['transfer_rules'],
+}
+
+
+# Actions to take once a step has been committed and recorded.
+followups = {
+    'transfer_rules': after_transfer_rules,
+}
+
+
+def run_pipeline(conn, args):
+  """Run the steps, skipping the ones whose inputs are unchanged unless args.force."""
+  cursor = conn.cursor(row_factory=namedtuple_row)
+  steps_feed = Progress('update_db', unit='steps', total=len(update_steps.steps))
+  changed_tables = set()
+  for step_num, step_name in enumerate(update_steps.steps):
+    if not args.force and update_steps.is_unchanged(cursor, step_name):
+      conn.commit()
+      say(f'SKIP {step_name}: inputs unchanged.')
+      continue
+
+    steps_feed.update(step_num, force=True, current_step=step_name)
+    message, action = actions[step_name]
+    say(f'{message}... ', end='')
+    step_start = perf_counter()
+    try:
+      with profiling.profiled(step_name, args.profile, args.cprofile):
+        action(conn, args)
+      conn.commit()
+      if deferred_tables(step_name, args):
+        bulk_load_mode.restore(deferred_tables(step_name, args))
+    except (Exception, SystemExit) as err:
+      conn.rollback()
+      steps_feed.fail()
+      say(f'\n{err}')
+      raise RuntimeError(f'{step_name} failed') from err
+    finally:
+      # Anything cached from the step’s tables is stale now, or was read inside a rolled back
+      # transaction.
+      reference_data.invalidate(*update_steps.steps[step_name].tables)
+
+    update_steps.record(cursor, step_name)
+    # Tell apps that cache the tables which of them have changed.
+    changed = update_steps.record_contents(cursor, step_name, also_changes.get(step_name, []))
+    if changed:
+      update_steps.notify(cursor, changed)
+      changed_tables.update(changed.keys())
+    conn.commit()
+    say(f'done in {perf_counter() - step_start:.1f} sec.')
+
+    if step_name in followups:
+      followups[step_name](conn, args)
+      conn.commit()
+      say('done.')
+
+  steps_feed.finish(len(update_steps.steps))
+
+  # Cache the course and rule payloads built from the tables that have changed (if redis is there).
+  kinds = payload_cache.kinds_using(changed_tables)
+  # All the steps have been committed by now, so a failure here leaves the tables in place, but it
+  # is reported the same way.
+  if kinds:
+    say(f'WARM payload cache ({", ".join(kinds)})... ', end='')
+    try:
+      counts = payload_cache.warm(conn, kinds)
+      conn.commit()
+    except Exception as err:
+      conn.rollback()
+      say(f'\n{err}')
+      raise RuntimeError('payload_cache failed') from err
+    say(f'{sum(counts.values()):,} payloads cached.' if counts else 'no redis.')
+
+  # The checks run on connections of their own, concurrently; findings go to validation_findings.
+  # Checks that fail are reported as such, and don’t stop the others.
+  say('VALIDATE tables... ')
+  try:
+    counts = run_checks()
+  except Exception as err:
+    say(f'\n{err}')
+    raise RuntimeError('validate failed') from err
+  failed = [check_name for check_name, num_findings in counts.items() if num_findings is None]
+  if failed:
+    raise RuntimeError(f'validate failed ({", ".join(failed)})')
+  say('done.')
+
+
+if __name__ == '__main__':
+  soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+  resource.setrlimit(resource.RLIMIT_NOFILE, [0x400, hard])
+
+  parser = argparse.ArgumentParser(description='Run the cuny_curriculum update steps')
+  parser.add_argument('-b', '--bulk', action='store_true',
+                      help='load the big tables with their indexes and constraints deferred')
+  parser.add_argument('-f', '--force', action='store_true',
+                      help='drop all tables and rebuild everything')
+  parser.add_argument('-l', '--list', action='store_true')
+  parser.add_argument('-p', '--progress', action='store_true')
+  parser.add_argument('-r', '--report', action='store_true')
+  parser.add_argument('-w', '--workers', type=int, default=0,
+                      help='load the transfer rules with this many worker processes')
+  profiling.add_arguments(parser)
+  args = parser.parse_args()
+
+  if args.list:
+    for step_name in update_steps.steps:
+      print(f'{step_name:24} {actions[step_name][0]}')
+    sys.exit(0)
+
+  # The catalog scan is shared in memory by the steps that use it, so there’s no need to spill it.
+  catalog_scan.spill = False
+
+  with psycopg.connect('dbname=cuny_curriculum', row_factory=namedtuple_row) as conn:
+    # Kill any existing connections to the db. Tables are dropped only for a full rebuild:
+    # otherwise each step drops and re-creates its own tables, and steps whose inputs are unchanged
+    # leave their tables in place.
+    say('DROP Connections ... ', end='')
+    run_sql(conn, 'drop_connections.sql')
+    if args.force:
+      say('and Tables (full rebuild) ... ', end='')
+      run_sql(conn, 'drop_tables.sql')
+    conn.commit()
+    say('done.')
+
+    say('CREATE FUNCTIONs numeric_part and rule_key ... ', end='')
+    run_sql(conn, 'numeric_part.sql')
+    run_sql(conn, 'rule_key.sql')
+    conn.commit()
+    say('done.')
+
+    try:
+      run_pipeline(conn, args)
+    except RuntimeError as err:
+      say(f'ERROR: {err}')
+      sys.exit(1)
@@ -3,6 +3,9 @@
 
 Uses the result of the CUNYfirst query, QNS_CV_SR_TRNS_INTERNAL_RULES.
 
+Anomalies (“Note ...” below) go to the anomalies table (see anomalies.py), and are also written to
+transfer_rule_conflicts.log.
+
   Note and ignore query records that have invalid course_id fields (lookup fails).
 
   Note, but keep, query records where the textual description of the course does not match the
@@ -46,94 +49,48 @@ Uses the result of the CUNYfirst query, QNS_CV_SR_TRNS_INTERNAL_RULES.
           Note rules that specify inactive destination courses
           Build lists of source disciplines for all rules
     3. Insert rules and course lists into database tables
+
+    Normally, all the rules are built in memory before any are inserted. With --external_sort, the
+    query rows are sorted by rule key on disk first (external_sort.py), and each rule is inserted
+    as soon as its rows have been processed, so memory use does not grow with the number of rules.
+
+    The three tables are partitioned by destination institution (create_transfer_rules.sql), and
+    the rules are inserted one destination institution at a time, so each partition is loaded in
+    turn. With --institution, only the rules to the given destination institution(s) are processed,
+    and only their partitions are cleared and reloaded; the other institutions’ rules are untouched:
+      populate_transfer_rules.py --institution QNS01 BKL01
+    Afterwards, run mk_subject-rule_map.py and summary_views.py to bring the tables and views
+    derived from the rules up to date.
+
+    With --workers, the assembled rules are sharded by destination institution, and each shard is
+    loaded with COPY by a worker process of its own; the loaded partitions then replace the current
+    ones in a single transaction (see load_shard() and swap_partitions()).
 """
 
 import argparse
 import csv
-import json
 import os
 import psycopg
+import re
 import resource
 import sys
 
-from collections import namedtuple, defaultdict
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import date
+from itertools import chain, groupby
 from time import perf_counter
 
-from cuny_divisions import ignore_institutions
+from anomalies import Anomalies
+from bulk_load import copy_rows
+from cuny_config import ignore_institutions
+from external_sort import sorted_rows
+from progress import CountingFile, Progress
+from psycopg import sql
 from psycopg.rows import namedtuple_row
-
-soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
-resource.setrlimit(resource.RLIMIT_NOFILE, [0x400, hard])
-
-parser = argparse.ArgumentParser()
-parser.add_argument('--debug', '-d', action='store_true')
-parser.add_argument('--progress', '-p', action='store_true')  # to stderr
-parser.add_argument('--report', '-r', action='store_true')    # to stdout
-args = parser.parse_args()
-
-app_start = perf_counter()
-
-try:
-  terminal = open(os.ttyname(0), 'wt')
-except OSError:
-  # No progress reporting unless run from command line
-  terminal = open('/dev/null', 'wt')
-
-
-# Start Execution
-# =================================================================================================
-if args.progress:
-  print('\nInitializing.', file=terminal)
-
-conn = psycopg.connect('dbname=cuny_curriculum')
-cursor = conn.cursor(row_factory=namedtuple_row)
-
-# Get most recent transfer_rules query file
-cf_rules_file = './latest_queries/QNS_CV_SR_TRNS_INTERNAL_RULES.csv'
-file_date = date\
-    .fromtimestamp(os.lstat(cf_rules_file).st_mtime).strftime('%Y-%m-%d')
-num_lines = sum(1 for line in open(cf_rules_file))
-
-if args.report:
-  print('\n  Transfer rules query file: {} {}'.format(file_date, cf_rules_file))
-
-# There are some garbage institution "names" in the transfer_rules, but the app’s
-# cuny_institutions table is “definitive”.
-cursor.execute("""select code
-                  from cuny_institutions
-                  order by code""")
-known_institutions = [record.code for record in cursor.fetchall()]
-
-# # Use the disciplines table for reporting cases where the component_subject_area isn't
-# # there.
-# cursor.execute("""select institution, discipline
-#                   from cuny_disciplines""")
-# valid_disciplines = [(record.institution, record.discipline)
-#                      for record in cursor.fetchall()]
-
-# Cache the information that might be used for all courses in the course_cache dict.
-# Index by course_id, but include info for each offer_nbr.
-cursor.execute("""
-               select course_id,
-                      offer_nbr,
-                      institution,
-                      discipline,
-                      catalog_number,
-                      numeric_part(catalog_number) as cat_num,
-                      cuny_subject,
-                      min_credits,
-                      max_credits,
-                      course_status,
-                      designation in ('MLA', 'MNL') as is_mesg,
-                      attributes ~* 'BKCR' as is_bkcr
-                      from cuny_courses""")
-course_cache = defaultdict(list)
-for course in cursor.fetchall():
-  course_cache[course.course_id].append(course)
-
-# Logging file
-conflicts = open('transfer_rule_conflicts.log', 'w')
+from rule_staleness import staleness
+import profiling
+import reference_data
 
 # Templates for building the three tables
 Rule_Key = namedtuple('Rule_Key',
@@ -152,7 +109,6 @@ Source_Course = namedtuple('Source_Course', """
                            credit_source
                            min_gpa
                            max_gpa
-                           source_aliases
                            """)
 Destination_Course = namedtuple('Destination_Course', """
                                 course_id
@@ -195,445 +151,884 @@ def rule_key_to_str(self):
 
 setattr(Rule_Key, '__str__', rule_key_to_str)
 
-rules_dict = dict()
-
-# Step 1: Go through the CF query file; extract a dict of rules and associated courses.
-# -----------------------------------------------------------------
-if args.progress:
-  print('\nStep 1/2: Process the csv file.', file=terminal)
-start_time = perf_counter()
-with open(cf_rules_file) as csvfile:
-  csv_reader = csv.reader(csvfile)
-  cols = None
-  line_num = 0
-  for line in csv_reader:
-    if cols is None:
-      line[0] = line[0].replace('\ufeff', '')
-      cols = [val.lower().replace(' ', '_').replace('/', '_') for val in line]
-      Record = namedtuple('Record', cols)
-      if args.debug:
-        print(cols)
-        for col in cols:
-          print('{} = {}; '.format(col, cols.index(col)), end='')
-        print()
-    else:
-      line_num += 1
-      if args.progress and line_num % 10000 == 0:
-        elapsed_time = perf_counter() - start_time
-        total_time = num_lines * elapsed_time / line_num
-        secs_remaining = total_time - elapsed_time
-        mins_remaining = int((secs_remaining) / 60)
-        secs_remaining = int(secs_remaining - (mins_remaining * 60))
-        print('line {:,}/{:,} ({:.1f}%) Estimated time remaining: {}:{:02}\r'
-              .format(line_num,
-                      num_lines,
-                      100 * line_num / num_lines,
-                      mins_remaining,
-                      secs_remaining),
-              end='', file=terminal)
 
-      try:
-        record = Record._make(line)
-      except TypeError as te:
-        print(f'{te}\nline {line_num}:, {line}', file=sys.stderr)
-        continue
+def rule_values(rule_key, rule, staleness_values: tuple) -> tuple:
+  """Values of the transfer_rules columns (other than id) for a rule, in rule_columns order.
 
-      # 2020-0902: Check "Transfer Course" flag
-      if record.transfer_course != 'Y':
-        continue
+  staleness_values is the rule’s (last_offered_term, has_inactive_course); see rule_staleness.py.
+  """
+  assert ' ' not in rule_key, f'{rule_key} has a space in it'
 
-      if record.source_institution in ignore_institutions or \
-         record.destination_institution in ignore_institutions:
-         conflicts.write(f'Ignoring rule from {record.source_institution} to '
-                         f'{record.destination_institution}\n')
-         continue
-      try:
-        rule_key = Rule_Key(record.source_institution,
-                            record.destination_institution,
-                            record.component_subject_area.replace(' ', '_'),
-                            int(record.src_equivalency_component))
-      except ValueError as e:
-        conflicts.write(f'Unable to construct Rule Key for {record}.\n{e}')
+  # Build the colon-delimited discipline and subject strings
+  source_disciplines_str = ':' + ':'.join(sorted(rule.source_disciplines)) + ':'
+  destination_disciplines_str = ':'.join(sorted(rule.destination_disciplines))
+  source_subjects_str = ':' + ':'.join(sorted(rule.source_subjects)) + ':'
+  destination_subjects_str = ':' + ':'.join(sorted(rule.destination_subjects)) + ':'
+  sending_courses = ':'.join(sorted([f'{c.course_id:06}.{c.offer_nbr}'
+                                    for c in rule.source_courses]))
+  receiving_courses = ':'.join(sorted([f'{c.course_id:06}.{c.offer_nbr}'
+                                      for c in rule.destination_courses]))
+  credit_sources = (f'{"".join(sorted(rule.src_credit_sources))}:'
+                    f'{"".join(sorted(rule.dst_credit_sources))}')
+  return rule_key + (':'.join([str(part) for part in rule_key]),
+                     source_disciplines_str,
+                     source_subjects_str,
+                     sending_courses,
+                     destination_disciplines_str,
+                     destination_subjects_str,
+                     receiving_courses,
+                     credit_sources,
+                     rule.priority,
+                     rule.effective_date.isoformat()) + staleness_values
+
+
+def course_order(course):
+  """Sort key for a rule’s source or destination courses."""
+  return (course.discipline, course.cat_num, course.offer_nbr)
+
+
+# Parallel loading (--workers)
+# -------------------------------------------------------------------------------------------------
+# Once all the rules have been assembled, they are sharded by destination institution, and each
+# shard is loaded by a worker process of its own, with COPY, into staging copies of the
+# institution’s three partitions. Each worker commits its staging tables, and builds their indexes
+# and constraints. Then, in the caller’s transaction, the staging tables are swapped in for the
+# partitions, so the load becomes visible all at once, or not at all.
+#
+# The partitioned tables may have been (re-)created in the caller’s transaction, which the workers
+# can’t see, so the caller reads the staging tables’ definitions from them and passes those to the
+# workers. For the same reason, ids are assigned in advance: each shard gets a range of values from
+# each table’s id sequence.
+
+rule_tables = ['transfer_rules', 'source_courses', 'destination_courses']
+rule_columns = ['source_institution', 'destination_institution', 'subject_area', 'group_number',
+                'rule_key', 'source_disciplines', 'source_subjects', 'sending_courses',
+                'destination_disciplines', 'destination_subjects', 'receiving_courses',
+                'credit_sources', 'priority', 'effective_date', 'last_offered_term',
+                'has_inactive_course']
+source_columns = ['destination_institution', 'rule_id', 'course_id', 'offer_nbr', 'offer_count',
+                  'discipline', 'catalog_number', 'cat_num', 'cuny_subject', 'min_credits',
+                  'max_credits', 'credit_source', 'min_gpa', 'max_gpa']
+destination_columns = ['destination_institution', 'rule_id', 'course_id', 'offer_nbr',
+                       'offer_count', 'discipline', 'catalog_number', 'cat_num', 'cuny_subject',
+                       'transfer_credits', 'credit_source', 'course_status', 'is_mesg', 'is_bkcr']
+
+# A staging table’s column definitions, primary key and unique constraint definitions, and
+# (create, method) pairs for its other indexes.
+Staging_Definition = namedtuple('Staging_Definition', 'columns constraints indexes')
+
+
+def partition_name(table_name: str, institution: str) -> str:
+  """Name of an institution’s partition of one of the rule tables (create_transfer_rules.sql)."""
+  return f'{table_name}_{institution.lower()}'
+
+
+def staging_name(table_name: str, institution: str) -> str:
+  return f'staging_{partition_name(table_name, institution)}'
+
+
+def staging_definitions(cursor) -> dict:
+  """The definitions of the staging tables, by table name, read from the partitioned tables.
+
+  The staging tables get the same columns, primary key, unique constraints, and indexes as the
+  partitioned tables, so that attaching them doesn’t have to build any. Their ids are assigned by
+  the caller, so the id columns have no defaults.
+  """
+  definitions = dict()
+  for table_name in rule_tables:
+    cursor.execute("""
+                   select format('%%I %%s', a.attname, format_type(a.atttypid, a.atttypmod))
+                          || case when a.attnotnull then ' not null' else '' end
+                          || case when d.adbin is null or a.attname = 'id' then ''
+                                  else ' default ' || pg_get_expr(d.adbin, d.adrelid) end
+                     from pg_attribute a
+                          left join pg_attrdef d on (d.adrelid, d.adnum) = (a.attrelid, a.attnum)
+                    where a.attrelid = %s::regclass and a.attnum > 0 and not a.attisdropped
+                    order by a.attnum
+                   """, (table_name, ))
+    columns = [row[0] for row in cursor.fetchall()]
+    cursor.execute("""
+                   select pg_get_constraintdef(oid) from pg_constraint
+                    where conrelid = %s::regclass and contype in ('p', 'u')
+                   """, (table_name, ))
+    constraints = [row[0] for row in cursor.fetchall()]
+    cursor.execute("""
+                   select pg_get_indexdef(i.indexrelid) from pg_index i
+                    where i.indrelid = %s::regclass
+                      and not exists (select 1 from pg_constraint c
+                                       where c.conindid = i.indexrelid
+                                         and c.conrelid = i.indrelid)
+                   """, (table_name, ))
+    indexes = [re.match(r'(CREATE (?:UNIQUE )?INDEX) \S+ ON (?:ONLY )?\S+ (USING .*)$',
+                        row[0]).groups()
+               for row in cursor.fetchall()]
+    definitions[table_name] = Staging_Definition(columns, constraints, indexes)
+  return definitions
+
+
+def reserve_ids(cursor, table_name: str, num_ids: int) -> int:
+  """Take num_ids consecutive values from a table’s id sequence; return the first one."""
+  if num_ids == 0:
+    return 0
+  cursor.execute("""
+                 select setval(seq, nextval(seq) + %s - 1)
+                   from pg_get_serial_sequence(%s, 'id') seq
+                 """, (num_ids, table_name))
+  return cursor.fetchone()[0] - num_ids + 1
+
+
+def load_shard(shard: tuple) -> tuple:
+  """Worker process: load one destination institution’s rules into staging tables, and commit.
+
+  The shard is (institution, list of (rule_key, rule, staleness values) triples, the first id
+  reserved for the shard in each table, staging table definitions). Returns the institution and the
+  number of rules loaded.
+  """
+  institution, rules, first_ids, definitions = shard
+  with psycopg.connect('dbname=cuny_curriculum') as conn:
+    cursor = conn.cursor()
+    for table_name in rule_tables:
+      staging = sql.Identifier(staging_name(table_name, institution))
+      cursor.execute(sql.SQL('drop table if exists {}').format(staging))
+      cursor.execute(sql.SQL("""
+                             create table {} (
+                               {},
+                               constraint partition_bound check (destination_institution = {}))
+                             """).format(staging,
+                                         sql.SQL(', ').join(map(sql.SQL,
+                                                                definitions[table_name].columns)),
+                                         sql.Literal(institution)))
+
+    ordered_rules = sorted(rules, key=lambda item: item[0])
+    rule_ids = list(range(first_ids['transfer_rules'],
+                          first_ids['transfer_rules'] + len(ordered_rules)))
+    copy_rows(cursor, staging_name('transfer_rules', institution), ['id'] + rule_columns,
+              ((rule_id, ) + rule_values(rule_key, rule, staleness_values)
+               for rule_id, (rule_key, rule, staleness_values) in zip(rule_ids, ordered_rules)))
+    # The rules’ course lists have the same names as the course tables.
+    for table_name, columns in [('source_courses', source_columns),
+                                ('destination_courses', destination_columns)]:
+      course_rows = ((institution, rule_id) + course
+                     for rule_id, (_, rule, _) in zip(rule_ids, ordered_rules)
+                     for course in sorted(getattr(rule, table_name), key=course_order))
+      copy_rows(cursor, staging_name(table_name, institution), ['id'] + columns,
+                ((row_id, ) + row for row_id, row in enumerate(course_rows, first_ids[table_name])))
+
+    for table_name in rule_tables:
+      staging = sql.Identifier(staging_name(table_name, institution))
+      for definition in definitions[table_name].constraints:
+        cursor.execute(sql.SQL('alter table {} add {}').format(staging, sql.SQL(definition)))
+      for create, method in definitions[table_name].indexes:
+        cursor.execute(sql.SQL('{} on {} {}').format(sql.SQL(create), staging, sql.SQL(method)))
+      cursor.execute(sql.SQL('analyze {}').format(staging))
+  return institution, len(rules)
+
+
+def drop_staging_tables(cursor, institutions: list):
+  """Drop any staging tables left by a load that failed."""
+  for institution in institutions:
+    for table_name in reversed(rule_tables):
+      cursor.execute(sql.SQL('drop table if exists {}')
+                     .format(sql.Identifier(staging_name(table_name, institution))))
+
+
+def swap_partitions(cursor, institutions: list):
+  """Replace the institutions’ partitions of the rule tables with their staging tables.
+
+  Runs in the caller’s transaction. Course partitions are detached before the rule partitions they
+  reference, and attached after them.
+  """
+  for institution in institutions:
+    for table_name in reversed(rule_tables):
+      partition = sql.Identifier(partition_name(table_name, institution))
+      cursor.execute(sql.SQL('alter table {} detach partition {}')
+                     .format(sql.Identifier(table_name), partition))
+      cursor.execute(sql.SQL('drop table {}').format(partition))
+    for table_name in rule_tables:
+      partition = partition_name(table_name, institution)
+      staging = staging_name(table_name, institution)
+      cursor.execute(sql.SQL('alter table {} rename to {}')
+                     .format(sql.Identifier(staging), sql.Identifier(partition)))
+      # The partition_bound check constraint lets the attach skip scanning the table.
+      cursor.execute(sql.SQL('alter table {} attach partition {} for values in ({})')
+                     .format(sql.Identifier(table_name), sql.Identifier(partition),
+                             sql.Literal(institution)))
+      cursor.execute(sql.SQL('alter table {} drop constraint partition_bound')
+                     .format(sql.Identifier(partition)))
+      cursor.execute("""
+                     select c.relname from pg_index i join pg_class c on c.oid = i.indexrelid
+                      where i.indrelid = %s::regclass and c.relname like 'staging\\_%%'
+                     """, (partition, ))
+      for index_name, in cursor.fetchall():
+        cursor.execute(sql.SQL('alter index {} rename to {}')
+                       .format(sql.Identifier(index_name),
+                               sql.Identifier(index_name[len('staging_'):])))
+
+
+def populate_transfer_rules(conn, progress: bool = False, report: bool = False, debug: bool = False,
+                            external_sort: bool = False, institutions: list = None,
+                            workers: int = 0):
+  """Clear and re-populate the transfer_rules, source_courses, and destination_courses tables.
+
+  If institutions is given, only the rules to those destination institutions are replaced. If
+  workers is given, the rules are loaded by that many worker processes (see load_shard()); if the
+  load fails, the transaction is rolled back, and the workers’ staging tables are dropped.
+  """
+  if workers and external_sort:
+    raise ValueError('external_sort and workers are mutually exclusive')
+  app_start = perf_counter()
+
+  try:
+    terminal = open(os.ttyname(0), 'wt')
+  except OSError:
+    # No progress reporting unless run from command line
+    terminal = open('/dev/null', 'wt')
+
+  if progress:
+    print('\nInitializing.', file=terminal)
+
+  cursor = conn.cursor(row_factory=namedtuple_row)
+
+  # Get most recent transfer_rules query file
+  cf_rules_file = './latest_queries/QNS_CV_SR_TRNS_INTERNAL_RULES.csv'
+  file_date = date\
+      .fromtimestamp(os.lstat(cf_rules_file).st_mtime).strftime('%Y-%m-%d')
+
+  if report:
+    print('\n  Transfer rules query file: {} {}'.format(file_date, cf_rules_file))
+
+  profiling.phase('read reference data')
+
+  # There are some garbage institution "names" in the transfer_rules, but the app’s
+  # cuny_institutions table is “definitive”.
+  known_institutions = reference_data.institutions(conn)
+  if institutions:
+    unknown = [institution for institution in institutions if institution not in known_institutions]
+    if unknown:
+      raise ValueError(f'Unknown institution(s): {", ".join(unknown)}')
+
+  # # Use the disciplines table for reporting cases where the component_subject_area isn't
+  # # there.
+  # valid_disciplines = reference_data.disciplines(conn)
+
+  # Cache the information that might be used for all courses in the course_cache dict.
+  # Index by course_id, but include info for each offer_nbr.
+  course_cache = reference_data.course_cache(conn)
+
+  # For the rules’ staleness columns
+  max_terms = reference_data.max_terms(conn)
+
+  def rule_staleness(rule) -> tuple:
+    """The rule’s (last_offered_term, has_inactive_course)."""
+    return staleness([(course.course_id, course.offer_nbr)
+                      for course in chain(rule.source_courses, rule.destination_courses)],
+                     max_terms, course_cache)
+
+  # Logging file
+  anomalies = Anomalies('transfer_rules', log_file='transfer_rule_conflicts.log')
+
+  rules_dict = dict()
+
+  def add_record(record):
+    """Validate one row of the CF query file and add its courses to its rule in rules_dict.
+
+    Rules that turn out to be invalid are deleted from rules_dict.
+    """
+    # 2020-0902: Check "Transfer Course" flag
+    if record.transfer_course != 'Y':
+      return
+
+    # Reloading just some destination institutions’ rules
+    if institutions and record.destination_institution not in institutions:
+      return
+
+    if record.source_institution in ignore_institutions or \
+       record.destination_institution in ignore_institutions:
+      anomalies.add('ignored_institution', f'Rule from {record.source_institution} to '
+                    f'{record.destination_institution}.', kept=False)
+      return
+    try:
+      rule_key = Rule_Key(record.source_institution,
+                          record.destination_institution,
+                          record.component_subject_area.replace(' ', '_'),
+                          int(record.src_equivalency_component))
+    except ValueError as e:
+      anomalies.add('bad_rule_key', f'Unable to construct Rule Key for {record}: {e}', kept=False)
+      return
+
+    # Determine the effective date of the row (the latest effective date of any of the
+    # tables that make up the CF query).
+    date_vals = [[int(f) for f in field.split('/')]for field in
+                 [record.transfer_subject_eff_date,
+                  record.transfer_component_eff_date,
+                  record.source_inst_eff_date,
+                  record.transfer_to_eff_date,
+                  record.crse_offer_eff_date,
+                  record.crse_offer_view_eff_date]]
+    effective_date = max([date(month=v[0], day=v[1], year=v[2]) for v in date_vals])
+    if rule_key not in rules_dict.keys():
+      # source_courses, source_disciplines, source_subjects,
+      # destination_courses, destination_disciplines,
+      # source_credit_sources, destination_credit_sources,
+      # Rule Priority, Effective Date
+      rules_dict[rule_key] = Rule_Tuple(set(), set(), set(), set(), set(), set(), set(), set(),
+                                        record.transfer_priority, effective_date)
+    elif effective_date > rules_dict[rule_key].effective_date:
+      rules_dict[rule_key].effective_date.replace(year=effective_date.year,
+                                                  month=effective_date.month,
+                                                  day=effective_date.day)
+      if rules_dict[rule_key].priority != record.transfer_priority:
+        anomalies.add('conflicting_priorities', f'Conflicting priorities: '
+                      f'{rules_dict[rule_key].priority} != {record.transfer_priority}.',
+                      rule_key=rule_key, kept=True)
+
+    # Filter out rules where the source or destination institution is bogus.
+    if record.source_institution not in known_institutions:
+      anomalies.add('unknown_institution',
+                    f'Unknown source institution: {record.source_institution}.',
+                    rule_key=rule_key, kept=False)
+      del rules_dict[rule_key]
+      return
+    if record.destination_institution not in known_institutions:
+      anomalies.add('unknown_institution',
+                    f'Unknown destination institution: {record.destination_institution}.',
+                    rule_key=rule_key, kept=False)
+      del rules_dict[rule_key]
+      return
+
+    # if (record.source_institution, record.component_subject_area) \
+    #    not in valid_disciplines:
+    #   # Report the anomaly, but accept the record.
+    #   conflicts.write(
+    #       'Notice: Component Subject Area {} not a CUNY Subject Area for rule {}. '
+    #       'Record kept.\n'.format(record.component_subject_area, rule_key))
+
+    # Process source_course_id
+    # ------------------------
+    course_id = int(record.source_course_id)
+    offer_nbr = int(record.source_offer_nbr)
+    try:
+      courses = course_cache[course_id]
+    except KeyError:
+      anomalies.add('source_not_in_catalog',
+                    f'Source course {course_id:06}:{offer_nbr} not in course catalog.',
+                    rule_key=rule_key, course_id=course_id, kept=False)
+      del rules_dict[rule_key]
+      return
+
+    # Iterate over the matching courses. The one with the same offer_nbr is the source course;
+    # others are aliases (cross-listed). Ignore any where the institution is wrong.
+    the_source_course = None
+    source_aliases = []
+    for course in courses:
+      # Check if this is the course specified in the rule, or an alias (cross-listed)
+      if course.offer_nbr == offer_nbr:
+        the_source_course = course
+      else:
+        source_aliases.append(course)
+
+      # Ignore rules where the source institution and the course institution don't match
+      if course.institution != rule_key.source_institution:
+        anomalies.add('source_institution_mismatch',
+                      f'Source course {course_id:06}:{offer_nbr} institution '
+                      f'{courses[0].institution} does not match rule source institution '
+                      f'{rule_key.source_institution}.',
+                      rule_key=rule_key, course_id=course_id, kept=False)
+        del rules_dict[rule_key]
+        the_source_course = 'Bogus'
         continue
 
-      # Determine the effective date of the row (the latest effective date of any of the
-      # tables that make up the CF query).
-      date_vals = [[int(f) for f in field.split('/')]for field in
-                   [record.transfer_subject_eff_date,
-                    record.transfer_component_eff_date,
-                    record.source_inst_eff_date,
-                    record.transfer_to_eff_date,
-                    record.crse_offer_eff_date,
-                    record.crse_offer_view_eff_date]]
-      effective_date = max([date(month=v[0], day=v[1], year=v[2]) for v in date_vals])
-      if rule_key not in rules_dict.keys():
-        # source_courses, source_disciplines, source_subjects,
-        # destination_courses, destination_disciplines,
-        # source_credit_sources, destination_credit_sources,
-        # Rule Priority, Effective Date
-        rules_dict[rule_key] = Rule_Tuple(set(), set(), set(), set(), set(), set(), set(), set(),
-                                          record.transfer_priority, effective_date)
-      elif effective_date > rules_dict[rule_key].effective_date:
-        rules_dict[rule_key].effective_date.replace(year=effective_date.year,
-                                                    month=effective_date.month,
-                                                    day=effective_date.day)
-        if rules_dict[rule_key].priority != record.transfer_priority:
-          conflicts.write(f'\nConflicting priorities for {rule_key}: '
-                          f'{rules_dict[rule_key].priority} != {record.transfer_priority} '
-                          f'Record kept.\n')
-
-      # Filter out rules where the source or destination institution is bogus.
-      if record.source_institution not in known_institutions:
-        conflicts.write('Unknown source institution: {} for rule {}. Rule ignored.\n'
-                        .format(record.source_institution, rule_key))
-        del rules_dict[rule_key]
+      # Warn about courses with bogus catalog_number on the source side.
+      if (course.cat_num < 0):
+        anomalies.add('bogus_catalog_number',
+                      f'Source course {course_id:06}: looks bogus {course.catalog_number=}.',
+                      rule_key=rule_key, course_id=course_id, kept=True)
+
+      # Ignore rules where the sending course is MESG, BKCR, or carries no credits.
+      if course.is_mesg or course.is_bkcr:
+        anomalies.add('mesg_or_bkcr_source',
+                      f'Source course {course_id:06}: is a MESG or BKCR course.',
+                      rule_key=rule_key, course_id=course_id, kept=False)
+        rules_dict.pop(rule_key, None)  # Might have been deleted above
         continue
-      if record.destination_institution not in known_institutions:
-        conflicts.write('Unknown destination institution: {} for rule {}. Rule ignored.\n'
-                        .format(record.destination_institution, rule_key))
-        del rules_dict[rule_key]
+      if float(course.max_credits) < 0.1:
+        anomalies.add('zero_credit_source', f'Source course {course_id:06} is zero credits.',
+                      rule_key=rule_key, course_id=course_id, kept=False)
+        rules_dict.pop(rule_key, None)  # Might have been deleted above
         continue
 
-      # if (record.source_institution, record.component_subject_area) \
-      #    not in valid_disciplines:
-      #   # Report the anomaly, but accept the record.
-      #   conflicts.write(
-      #       'Notice: Component Subject Area {} not a CUNY Subject Area for rule {}. '
-      #       'Record kept.\n'.format(record.component_subject_area, rule_key))
-
-      # Process source_course_id
-      # ------------------------
-      course_id = int(record.source_course_id)
-      offer_nbr = int(record.source_offer_nbr)
+    # Make sure the source course_id:offer_nbr was found
+    if the_source_course is None:
+      anomalies.add('source_offer_nbr_mismatch',
+                    f'Source course {course_id:06}.{offer_nbr} has no matching offer number in '
+                    f'course_catalog.',
+                    rule_key=rule_key, course_id=course_id, kept=False)
+      del rules_dict[rule_key]
+      return
+
+    if rule_key in rules_dict.keys():
+      # Only one course gets added to the rule, but all (cross-listed) disciplines and
+      # subjects
+
+      source_course = Source_Course(the_source_course.course_id,
+                                    the_source_course.offer_nbr,
+                                    len(courses),
+                                    the_source_course.discipline,
+                                    the_source_course.catalog_number,
+                                    float(the_source_course.cat_num),
+                                    the_source_course.cuny_subject,
+                                    the_source_course.min_credits,
+                                    the_source_course.max_credits,
+                                    record.subject_credit_source,
+                                    record.min_grade_pts,
+                                    record.max_grade_pts)
+      rules_dict[rule_key].source_courses.add(source_course)
+      rules_dict[rule_key].src_credit_sources.add(record.subject_credit_source)
+
+      # Add all source disciplines and cuny_subjects to the rule
+      for course in [the_source_course] + source_aliases:
+        rules_dict[rule_key].source_disciplines.add(course.discipline)
+        rules_dict[rule_key].source_subjects.add(course.cuny_subject)
+
+        # The following check fails 3M times; it's the norm (at some schools) to specify 0-99
+        # credits at the receiving side. Retained as comments for documentation purposes
+        # Report rules with inconsistent min/max source credits
+        # if float(course.min_credits) != float(record.src_min_units):
+        #   conflicts.write(f'{rule_key} Source course {course.course_id:06}:{course.offer_nbr} '
+        #                   f'has {course.min_credits} min credits, but rule says '
+        #                   f'{record.src_min_units=}. Rule Kept.\n')
+        # if float(course.max_credits) != float(record.src_max_units):
+        #   conflicts.write(f'{rule_key} Source course {course.course_id:06}:{course.offer_nbr} '
+        #                   f'has {course.max_credits} max credits, but rule says '
+        #                   f'{record.src_max_units=} Rule Kept.\n')
+
+        # There are min/max units from CRSE_CATALOG, TRANSFER_FROM, and TRANSFER_TO, but min_units
+        # never matter.
+        # If the Internal Equiv Course Value from TRNSFR_COMP is:
+        # C — Use CRSE_CATALOG.max_units
+        # R — Use TRANSFER_TO.max_units
+        #
+        # Vivek: If the option is set to E then it uses incoming value  else – its hard coded to
+        # local catalog max or specified in the rule.
+        #
+        # Vivek: For E it always takes lowest of (incoming or transfer_to.max_units ) in
+        # reconciliation
+        #
+        # me:  “incoming” means TRANSFER_FROM.max_units, right?
+        #
+        # Vivek: Correct -  but transfer from joined with care (sic?) catalog Max unit
+        #
+        # subject_credit_source component_credit_source:  frequency
+        #                     R                       R:  1,193,010
+        #                     R                       E:    225,118
+        #                     E                       R:    163,835
+        #                     E                       E:     80,195
+        #                     C                       R:      1,398
+        #                     C                       E:         39
+        #                     R                       C:          5
+        #                     E                       C:          2
+        #                     C                       C:          1
+
+      # Process destination course list (if the rule wasn’t deleted during source processing)
+      # -----------------------------------------------------------------------------------
+      course_id = int(record.destination_course_id)
+      offer_nbr = int(record.destination_offer_nbr)
+
       try:
         courses = course_cache[course_id]
       except KeyError:
-        conflicts.write(f'{rule_key} Source course {course_id:06}:{offer_nbr} not in course '
-                        f'catalog. Rule ignored.\n')
+        anomalies.add('destination_not_in_catalog',
+                      f'Destination course {course_id:06} not in catalog.',
+                      rule_key=rule_key, course_id=course_id, kept=False)
         del rules_dict[rule_key]
-        continue
+        return
 
-      # Iterate over the matching courses. The one with the same offer_nbr is the source course;
-      # others are aliases (cross-listed). Ignore any where the institution is wrong.
-      the_source_course = None
-      source_aliases = []
+      # Ignore rules where the destination is not in our catalog of undergraduate courses
+      if len(courses) == 0:
+        anomalies.add('destination_not_undergraduate',
+                      f'Destination course {course_id}:{offer_nbr} not in undergraduate catalog.',
+                      rule_key=rule_key, course_id=course_id, kept=False)
+        del rules_dict[rule_key]
+        return
+
+      # Check each destination course: must belong to destination institution, and the offer_nbr
+      # of one of them must match the offer_nbr of the CSV record.
+      the_destination_course = None
       for course in courses:
-        # Check if this is the course specified in the rule, or an alias (cross-listed)
-        if course.offer_nbr == offer_nbr:
-          the_source_course = course
-        else:
-          source_aliases.append(course)
-
-        # Ignore rules where the source institution and the course institution don't match
-        if course.institution != rule_key.source_institution:
-          conflicts.write(f'{rule_key} Source course {course_id:06}:{offer_nbr} institution '
-                          f'{courses[0].institution} does not match rule source institution '
-                          f'{rule_key.source_institution}. Rule Ignored.\n')
+        if course.institution != record.destination_institution:
+          anomalies.add('destination_institution_mismatch',
+                        f'Destination course {course_id}:{offer_nbr} belongs to '
+                        f'{course.institution}, not to {record.destination_institution}.',
+                        rule_key=rule_key, course_id=course_id, kept=False)
           del rules_dict[rule_key]
-          the_source_course = 'Bogus'
-          continue
-
-        # Warn about courses with bogus catalog_number on the source side.
-        if (course.cat_num < 0):
-          conflicts.write(
-              f'{rule_key} Source course {course_id:06}: looks bogus {course.catalog_number=}. '
-              f'Rule Kept\n')
-
-        # Ignore rules where the sending course is MESG, BKCR, or carries no credits.
-        if course.is_mesg or course.is_bkcr:
-          conflicts.write(f'{rule_key} Source course {course_id:06}: is a MESG or BKCR course. '
-                          f'Rule Ignored\n')
-          rules_dict.pop(rule_key, None)  # Might have been deleted above
-          continue
-        if float(course.max_credits) < 0.1:
-          conflicts.write(f'{rule_key} Source course {course_id:06} is zero credits. '
-                          f'Rule Ignored.\n')
-          rules_dict.pop(rule_key, None)  # Might have been deleted above
-          continue
-
-      # Make sure the source course_id:offer_nbr was found
-      if the_source_course is None:
-        conflicts.write(f'{rule_key} Source course {course_id:06}.{offer_nbr} has no matching '
-                        f'offer number in course_catalog. Rule ignored.\n')
+          the_destination_course = 'Bogus'
+          break
+        if course.offer_nbr == offer_nbr:
+          the_destination_course = course
+      if the_destination_course == 'Bogus':
+        return
+      if the_destination_course is None:
+        anomalies.add('destination_offer_nbr_mismatch',
+                      f'Destination course {course_id}:{offer_nbr} has no matching offer_nbr in '
+                      f'cuny_courses.',
+                      rule_key=rule_key, course_id=course_id, kept=False)
         del rules_dict[rule_key]
-        continue
+        return
+
+      # INACCURACY: the number of credits transferred should be record.units_taken only if the
+      # subject_credit_source is 'C'
+      #    C Catalog  Use Catalog Units
+      #    E External Specify Maximum Units
+      #    R Rule     Specify Fixed Units
+      # Vivek says "if the option is set to E then it uses incoming value  else – its hard
+      # coded to local catalog max or specified in the rule."
+      # (The rule has dst_min_units and dst_max_units; the combination of E and 99.0 for max
+      # means “whatever it takes” for BKCR destination courses.)
+      destination_course = Destination_Course(course_id,
+                                              offer_nbr,
+                                              len(courses),
+                                              courses[0].discipline,
+                                              courses[0].catalog_number,
+                                              float(courses[0].cat_num),
+                                              courses[0].cuny_subject,
+                                              record.units_taken,
+                                              record.subject_credit_source,
+                                              courses[0].course_status,
+                                              courses[0].is_mesg,
+                                              courses[0].is_bkcr)
+      rules_dict[rule_key].destination_courses.add(destination_course)
+      rules_dict[rule_key].destination_disciplines.add(destination_course.discipline)
+      rules_dict[rule_key].destination_subjects.add(destination_course.cuny_subject)
+      rules_dict[rule_key].dst_credit_sources.add(record.subject_credit_source)
+
+      # Report weirdnesses
+      if len(courses) > 1:
+        anomalies.add('cross_listed_destination',
+                      f'Destination course {destination_course.course_id:06} is cross-listed '
+                      f'{len(courses)} times.',
+                      rule_key=rule_key, course_id=course_id, kept=True)
+      for course in courses:
+        if not (course.is_mesg or course.is_bkcr) and course.cat_num < 0:
+          anomalies.add('bogus_catalog_number',
+                        f'Destination course {course.course_id:06} with non-numeric catalog number '
+                        f'‘{course.catalog_number}’.',
+                        rule_key=rule_key, course_id=course_id, kept=True)
+        if course.course_status != 'A':
+          anomalies.add('inactive_destination', f'Destination course {course_id:06} is inactive.',
+                        rule_key=rule_key, course_id=course_id, kept=True)
+
+  def insert_rule(rule_key, rule):
+    """Insert a rule into transfer_rules, and its courses into source_ and destination_courses."""
+    # Insert the rule, getting back it's id
+    cursor.execute("""insert into transfer_rules (
+                                    source_institution,
+                                    destination_institution,
+                                    subject_area,
+                                    group_number,
+                                    rule_key,
+                                    source_disciplines,
+                                    source_subjects,
+                                    sending_courses,
+                                    destination_disciplines,
+                                    destination_subjects,
+                                    receiving_courses,
+                                    credit_sources,
+                                    priority,
+                                    effective_date,
+                                    last_offered_term,
+                                    has_inactive_course)
+                                  values (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
+                                          %s, %s)
+                                  returning id""",
+                   rule_values(rule_key, rule, rule_staleness(rule)))
+    rule_id = cursor.fetchone()[0]
+
+    # Sort and insert the source_courses
+    for course in sorted(rule.source_courses, key=course_order):
+      cursor.execute("""insert into source_courses
+                                    (
+                                      destination_institution,
+                                      rule_id,
+                                      course_id,
+                                      offer_nbr,
+                                      offer_count,
+                                      discipline,
+                                      catalog_number,
+                                      cat_num,
+                                      cuny_subject,
+                                      min_credits,
+                                      max_credits,
+                                      credit_source,
+                                      min_gpa,
+                                      max_gpa
+                                    )
+                                    values (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                     """, (rule_key.destination_institution, rule_id) + course)
+
+    # Sort and insert the destination_courses
+    for course in sorted(rule.destination_courses, key=course_order):
+      cursor.execute("""insert into destination_courses
+                                    (
+                                      destination_institution,
+                                      rule_id,
+                                      course_id,
+                                      offer_nbr,
+                                      offer_count,
+                                      discipline,
+                                      catalog_number,
+                                      cat_num,
+                                      cuny_subject,
+                                      transfer_credits,
+                                      credit_source,
+                                      course_status,
+                                      is_mesg,
+                                      is_bkcr
+                                    )
+                                    values (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                     """, (rule_key.destination_institution, rule_id) + course)
+
+  def sort_key(line):
+    """Rule key (as a tuple) for a raw CSV line, for sorting and grouping rows by rule.
+
+    The destination institution comes first, so the rules are inserted one partition at a time.
+    Rows that can’t produce a valid rule key all sort to the front, where add_record() reports them.
+    """
+    try:
+      source_institution, destination_institution, subject_area, group_number = \
+          [line[index] for index in key_columns]
+      return (destination_institution, source_institution, subject_area.replace(' ', '_'),
+              int(group_number))
+    except (IndexError, ValueError):
+      return ('', '', '', -1)
+
+  def show_progress(line_num):
+    """Show the line number and the estimated time remaining."""
+    num_lines = rules_file.estimated_lines()
+    elapsed_time = perf_counter() - start_time
+    total_time = num_lines * elapsed_time / line_num
+    secs_remaining = total_time - elapsed_time
+    mins_remaining = int((secs_remaining) / 60)
+    secs_remaining = int(secs_remaining - (mins_remaining * 60))
+    print('line {:,}/{:,} ({:.1f}%) Estimated time remaining: {}:{:02}\r'
+          .format(line_num,
+                  num_lines,
+                  100 * line_num / num_lines,
+                  mins_remaining,
+                  secs_remaining),
+          end='', file=terminal)
 
-      if rule_key in rules_dict.keys():
-        # Only one course gets added to the rule, but all (cross-listed) disciplines and
-        # subjects
-
-        source_course = Source_Course(the_source_course.course_id,
-                                      the_source_course.offer_nbr,
-                                      len(courses),
-                                      the_source_course.discipline,
-                                      the_source_course.catalog_number,
-                                      float(the_source_course.cat_num),
-                                      the_source_course.cuny_subject,
-                                      the_source_course.min_credits,
-                                      the_source_course.max_credits,
-                                      record.subject_credit_source,
-                                      record.min_grade_pts,
-                                      record.max_grade_pts,
-                                      json.dumps(source_aliases))
-        rules_dict[rule_key].source_courses.add(source_course)
-        rules_dict[rule_key].src_credit_sources.add(record.subject_credit_source)
-
-        # Add all source disciplines and cuny_subjects to the rule
-        for course in [the_source_course] + source_aliases:
-          rules_dict[rule_key].source_disciplines.add(course.discipline)
-          rules_dict[rule_key].source_subjects.add(course.cuny_subject)
-
-          # The following check fails 3M times; it's the norm (at some schools) to specify 0-99
-          # credits at the receiving side. Retained as comments for documentation purposes
-          # Report rules with inconsistent min/max source credits
-          # if float(course.min_credits) != float(record.src_min_units):
-          #   conflicts.write(f'{rule_key} Source course {course.course_id:06}:{course.offer_nbr} '
-          #                   f'has {course.min_credits} min credits, but rule says '
-          #                   f'{record.src_min_units=}. Rule Kept.\n')
-          # if float(course.max_credits) != float(record.src_max_units):
-          #   conflicts.write(f'{rule_key} Source course {course.course_id:06}:{course.offer_nbr} '
-          #                   f'has {course.max_credits} max credits, but rule says '
-          #                   f'{record.src_max_units=} Rule Kept.\n')
-
-          # There are min/max units from CRSE_CATALOG, TRANSFER_FROM, and TRANSFER_TO, but min_units
-          # never matter.
-          # If the Internal Equiv Course Value from TRNSFR_COMP is:
-          # C — Use CRSE_CATALOG.max_units
-          # R — Use TRANSFER_TO.max_units
-          #
-          # Vivek: If the option is set to E then it uses incoming value  else – its hard coded to
-          # local catalog max or specified in the rule.
-          #
-          # Vivek: For E it always takes lowest of (incoming or transfer_to.max_units ) in
-          # reconciliation
-          #
-          # me:  “incoming” means TRANSFER_FROM.max_units, right?
-          #
-          # Vivek: Correct -  but transfer from joined with care (sic?) catalog Max unit
-          #
-          # subject_credit_source component_credit_source:  frequency
-          #                     R                       R:  1,193,010
-          #                     R                       E:    225,118
-          #                     E                       R:    163,835
-          #                     E                       E:     80,195
-          #                     C                       R:      1,398
-          #                     C                       E:         39
-          #                     R                       C:          5
-          #                     E                       C:          2
-          #                     C                       C:          1
-
-        # Process destination course list (if the rule wasn’t deleted during source processing)
-        # -----------------------------------------------------------------------------------
-        course_id = int(record.destination_course_id)
-        offer_nbr = int(record.destination_offer_nbr)
+  def clear_subject_rule_map(destinations):
+    """Delete the destination institutions’ rules from subject_rule_map, which references
+    transfer_rules, if it exists. They have to be re-added (mk_subject-rule_map.py) afterwards.
+    """
+    cursor.execute("select to_regclass('subject_rule_map')")
+    if cursor.fetchone()[0] is not None:
+      cursor.execute('delete from subject_rule_map where destination_institution = any(%s)',
+                     (destinations, ))
+
+  def record_update():
+    """Update the update date."""
+    cursor.execute("""
+                   update updates
+                   set update_date = '{}', file_name = '{}'
+                   where table_name = 'transfer_rules'""".format(file_date, cf_rules_file))
+
+  def clear_tables():
+    """Clear the three db tables (or just the institutions’ partitions) and update the update date.
+    """
+    if institutions:
+      # Truncating a partition that is referenced by a foreign key would cascade to the whole
+      # referencing table, so the rows are deleted instead; the deletes are pruned to the
+      # institutions’ partitions.
+      clear_subject_rule_map(institutions)
+      for table_name in ['source_courses', 'destination_courses', 'transfer_rules']:
+        cursor.execute(f'delete from {table_name} where destination_institution = any(%s)',
+                       (institutions, ))
+    else:
+      cursor.execute('truncate source_courses, destination_courses, transfer_rules cascade')
+    record_update()
+
+  # Step 1: Go through the CF query file; extract a dict of rules and associated courses.
+  # -----------------------------------------------------------------
+  # With the --external_sort option, the rows are first sorted by rule key on disk, and each rule is
+  # inserted into the db as soon as all its rows have been processed, so rules_dict never holds more
+  # than one rule. Otherwise, rules_dict holds all the rules, and they are inserted in Step 2.
+  if progress:
+    print('\nStep 1/2: Process the csv file.', file=terminal)
+  profiling.phase('sort, validate and insert rules' if external_sort else 'validate rules')
+  start_time = perf_counter()
+  with open(cf_rules_file) as csvfile:
+    rules_file = CountingFile(csvfile)
+    csv_reader = csv.reader(rules_file)
+    line = next(csv_reader)
+    line[0] = line[0].replace('\ufeff', '')
+    cols = [val.lower().replace(' ', '_').replace('/', '_') for val in line]
+    Record = namedtuple('Record', cols)
+    if debug:
+      print(cols)
+      for col in cols:
+        print('{} = {}; '.format(col, cols.index(col)), end='')
+      print()
+
+    if external_sort:
+      key_columns = [cols.index(col) for col in ['source_institution', 'destination_institution',
+                                                 'component_subject_area',
+                                                 'src_equivalency_component']]
+      clear_tables()
+      groups = (group for _, group in groupby(sorted_rows(csv_reader, key=sort_key), key=sort_key))
+    else:
+      groups = ([line] for line in csv_reader)
+
+    num_rules = 0
+    line_num = 0
+    lines_feed = Progress('transfer_rules', unit='lines')
+    for group in groups:
+      for line in group:
+        line_num += 1
+        if line_num % 1000 == 0:
+          lines_feed.update(line_num, rules_file.estimated_lines())
+          if progress and line_num % 10000 == 0:
+            show_progress(line_num)
 
         try:
-          courses = course_cache[course_id]
-        except KeyError:
-          conflicts.write(f'{rule_key} Destination course {course_id:06} not in catalog. '
-                          f'Rule Ignored.\n')
-          del rules_dict[rule_key]
-          continue
-
-        # Ignore rules where the destination is not in our catalog of undergraduate courses
-        if len(courses) == 0:
-          conflicts.write(f'{rule_key}: Destination course {course_id}:{offer_nbr} not in '
-                          f'undergraduate catalog. Rule Ignored\n')
-          del rules_dict[rule_key]
+          record = Record._make(line)
+        except TypeError as te:
+          print(f'{te}\nline {line_num}:, {line}', file=sys.stderr)
           continue
-
-        # Check each destination course: must belong to destination institution, and the offer_nbr
-        # of one of them must match the offer_nbr of the CSV record.
-        the_destination_course = None
-        for course in courses:
-          if course.institution != record.destination_institution:
-            conflicts.write(f'{rule_key}: Destination course {course_id}:{offer_nbr} belongs to '
-                            f'{course.institution}, not to {record.destination_institution}. '
-                            f'Rule Ignored\n')
-            del rules_dict[rule_key]
-            the_destination_course = 'Bogus'
-            break
-          if course.offer_nbr == offer_nbr:
-            the_destination_course = course
-        if the_destination_course == 'Bogus':
-          continue
-        if the_destination_course is None:
-          conflicts.write(f'{rule_key}: Destination course {course_id}:{offer_nbr} has no matching '
-                          f'offer_nbr in cuny_courses. Rule Ignored\n')
-          del rules_dict[rule_key]
-          continue
-
-        # INACCURACY: the number of credits transferred should be record.units_taken only if the
-        # subject_credit_source is 'C'
-        #    C Catalog  Use Catalog Units
-        #    E External Specify Maximum Units
-        #    R Rule     Specify Fixed Units
-        # Vivek says "if the option is set to E then it uses incoming value  else – its hard
-        # coded to local catalog max or specified in the rule."
-        # (The rule has dst_min_units and dst_max_units; the combination of E and 99.0 for max
-        # means “whatever it takes” for BKCR destination courses.)
-        destination_course = Destination_Course(course_id,
-                                                offer_nbr,
-                                                len(courses),
-                                                courses[0].discipline,
-                                                courses[0].catalog_number,
-                                                float(courses[0].cat_num),
-                                                courses[0].cuny_subject,
-                                                record.units_taken,
-                                                record.subject_credit_source,
-                                                courses[0].course_status,
-                                                courses[0].is_mesg,
-                                                courses[0].is_bkcr)
-        rules_dict[rule_key].destination_courses.add(destination_course)
-        rules_dict[rule_key].destination_disciplines.add(destination_course.discipline)
-        rules_dict[rule_key].destination_subjects.add(destination_course.cuny_subject)
-        rules_dict[rule_key].dst_credit_sources.add(record.subject_credit_source)
-
-        # Report weirdnesses
-        if len(courses) > 1:
-          conflicts.write(
-              f'{rule_key} Destination course {destination_course.course_id:06} is cross-listed '
-              f'{len(courses)} times. Rule Kept.\n')
-        for course in courses:
-          if not (course.is_mesg or course.is_bkcr) and course.cat_num < 0:
-            conflicts.write(f'{rule_key} Destination course {course.course_id:06} with non-numeric '
-                            f'catalog number ‘{course.catalog_number}’. Rule Kept.\n')
-          if course.course_status != 'A':
-            conflicts.write(f'{rule_key} Destination course {course_id:06} is inactive. '
-                            f'Rule Kept.\n')
-
-if args.progress:
-  print(f'\n  Found {len(rules_dict.keys()):,} rules', file=terminal)
-  secs = perf_counter() - start_time
-  mins = int(secs / 60)
-  secs = int(secs - 60 * mins)
-  print(f'\n  That took {mins} min {secs} sec.', file=terminal)
-  print('\nStep 2/2: Populate the three tables', file=terminal)
-  start_time = perf_counter()
-
-# Step 2
-# -------------------------------------------------------------------------------------------------
-# Clear the three db tables and re-populate them.
-cursor.execute('truncate source_courses, destination_courses, transfer_rules cascade')
-
-# update the update date
-cursor.execute("""
-               update updates
-               set update_date = '{}', file_name = '{}'
-               where table_name = 'transfer_rules'""".format(file_date, cf_rules_file))
-
-total_keys = len(rules_dict.keys())
-keys_so_far = 0
-for rule_key in rules_dict.keys():
-  assert ' ' not in rule_key, f'{rule_key} has a space in it'
-
-  keys_so_far += 1
-  if args.progress and 0 == keys_so_far % 1000:
-    print(f'\r{keys_so_far:,}/{total_keys:,} keys. {100 * keys_so_far / total_keys:.1f}%',
-          end='', file=terminal)
-
-  # Build the colon-delimited discipline and subject strings
-  source_disciplines_str = ':' + ':'.join(sorted(rules_dict[rule_key].source_disciplines)) + ':'
-  destination_disciplines_str = ':'.join(sorted(rules_dict[rule_key].destination_disciplines))
-  source_subjects_str = ':' + ':'.join(sorted(rules_dict[rule_key].source_subjects)) + ':'
-  destination_subjects_str = ':' + ':'.join(sorted(rules_dict[rule_key].destination_subjects)) + ':'
-  sending_courses = ':'.join(sorted([f'{c.course_id:06}.{c.offer_nbr}'
-                                    for c in rules_dict[rule_key].source_courses]))
-  receiving_courses = ':'.join(sorted([f'{c.course_id:06}.{c.offer_nbr}'
-                                      for c in rules_dict[rule_key].destination_courses]))
-
-  # Insert the rule, getting back it's id
-  credit_sources = (f'{"".join(sorted(rules_dict[rule_key].src_credit_sources))}:'
-                    f'{"".join(sorted(rules_dict[rule_key].dst_credit_sources))}')
-  cursor.execute("""insert into transfer_rules (
-                                  source_institution,
-                                  destination_institution,
-                                  subject_area,
-                                  group_number,
-                                  rule_key,
-                                  source_disciplines,
-                                  source_subjects,
-                                  sending_courses,
-                                  destination_disciplines,
-                                  destination_subjects,
-                                  receiving_courses,
-                                  credit_sources,
-                                  priority,
-                                  effective_date)
-                                values (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                                returning id""",
-                 rule_key + (':'.join([str(part) for part in rule_key]),
-                             source_disciplines_str,
-                             source_subjects_str,
-                             sending_courses,
-                             destination_disciplines_str,
-                             destination_subjects_str,
-                             receiving_courses,
-                             credit_sources,
-                             rules_dict[rule_key].priority,
-                             rules_dict[rule_key].effective_date.isoformat()))
-  rule_id = cursor.fetchone()[0]
-
-  # Sort and insert the source_courses
-  for course in sorted(rules_dict[rule_key].source_courses,
-                       key=lambda c: (c.discipline, c.cat_num, c.offer_nbr)):
-    cursor.execute("""insert into source_courses
-                                  (
-                                    rule_id,
-                                    course_id,
-                                    offer_nbr,
-                                    offer_count,
-                                    discipline,
-                                    catalog_number,
-                                    cat_num,
-                                    cuny_subject,
-                                    min_credits,
-                                    max_credits,
-                                    credit_source,
-                                    min_gpa,
-                                    max_gpa,
-                                    aliases
-                                  )
-                                  values (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                   """, (rule_id, ) + course)
-
-  # Sort and insert the destination_courses
-  for course in sorted(rules_dict[rule_key].destination_courses,
-                       key=lambda c: (c.discipline, c.cat_num, c.offer_nbr)):
-    cursor.execute("""insert into destination_courses
-                                  (
-                                    rule_id,
-                                    course_id,
-                                    offer_nbr,
-                                    offer_count,
-                                    discipline,
-                                    catalog_number,
-                                    cat_num,
-                                    cuny_subject,
-                                    transfer_credits,
-                                    credit_source,
-                                    course_status,
-                                    is_mesg,
-                                    is_bkcr
-                                  )
-                                  values (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                   """, (rule_id, ) + course)
-
-cursor.execute('select count(*) from transfer_rules')
-num_rules = cursor.fetchone()[0]
-if args.progress:
-  secs = perf_counter() - start_time
-  mins = int(secs / 60)
-  secs = int(secs - 60 * mins)
-  print(f'\n  That took {mins} min {secs} sec.', file=terminal)
-  print(f'\nThere are {num_rules:,} rules', file=terminal)
-
-conflicts.close()
-conn.commit()
-conn.close()
-
-if args.report:
-  secs = perf_counter() - app_start
-  mins = int(secs / 60)
-  secs = int(secs - 60 * mins)
-  print(f'\n  Generated {num_rules:,} rules in {mins} min {secs} sec.')
+        add_record(record)
+
+      if external_sort:
+        # All the rows for the rule(s) in this group have been processed
+        for rule_key, rule in rules_dict.items():
+          insert_rule(rule_key, rule)
+          num_rules += 1
+        rules_dict.clear()
+    lines_feed.finish(line_num)
+
+  if progress:
+    if external_sort:
+      print(f'\n  Inserted {num_rules:,} rules', file=terminal)
+    else:
+      print(f'\n  Found {len(rules_dict.keys()):,} rules', file=terminal)
+    secs = perf_counter() - start_time
+    mins = int(secs / 60)
+    secs = int(secs - 60 * mins)
+    print(f'\n  That took {mins} min {secs} sec.', file=terminal)
+    print('\nStep 2/2: Populate the three tables', file=terminal)
+    start_time = perf_counter()
+
+  # Step 2
+  # -----------------------------------------------------------------------------------------------
+  # Clear the three db tables and re-populate them. (Already done in Step 1 with --external_sort.)
+  # With --workers, the institutions’ partitions are loaded in parallel and swapped in instead.
+  if workers:
+    profiling.phase('load partitions')
+    # Every institution’s partitions are replaced, including those of any that have no rules now.
+    destinations = institutions or sorted(known_institutions)
+    shards = {institution: [] for institution in destinations}
+    for rule_key, rule in rules_dict.items():
+      shards[rule_key.destination_institution].append((rule_key, rule, rule_staleness(rule)))
+    definitions = staging_definitions(cursor)
+    # Biggest shards first, so the workers finish at about the same time.
+    work = []
+    for institution, rules in sorted(shards.items(), key=lambda shard: -len(shard[1])):
+      first_ids = {'transfer_rules': reserve_ids(cursor, 'transfer_rules', len(rules))}
+      for table_name in ['source_courses', 'destination_courses']:
+        first_ids[table_name] = reserve_ids(cursor, table_name,
+                                            sum(len(getattr(rule, table_name))
+                                                for _, rule, _ in rules))
+      work.append((institution, rules, first_ids, definitions))
+
+    total_keys = len(rules_dict.keys())
+    keys_so_far = 0
+    rules_feed = Progress('transfer_rules', unit='rules', total=total_keys)
+    try:
+      with ProcessPoolExecutor(max_workers=workers) as executor:
+        try:
+          for future in as_completed([executor.submit(load_shard, shard) for shard in work]):
+            institution, num_loaded = future.result()
+            keys_so_far += num_loaded
+            rules_feed.update(keys_so_far, force=True)
+            if progress:
+              print(f'\r{keys_so_far:,}/{total_keys:,} keys. '
+                    f'{100 * keys_so_far / total_keys:.1f}% ({institution} loaded)',
+                    end='', file=terminal)
+        except BaseException:
+          # Don’t start the shards that are still waiting for a worker.
+          executor.shutdown(cancel_futures=True)
+          raise
+
+      profiling.phase('swap partitions')
+      clear_subject_rule_map(destinations)
+      swap_partitions(cursor, destinations)
+    except BaseException:
+      # The staging tables the workers committed would outlive the rollback. They can’t be dropped
+      # until the rollback releases the locks the swap may have taken on them.
+      conn.rollback()
+      drop_staging_tables(cursor, destinations)
+      conn.commit()
+      raise
+    record_update()
+    rules_feed.finish(keys_so_far)
+
+  elif not external_sort:
+    profiling.phase('insert rules')
+    clear_tables()
+
+    total_keys = len(rules_dict.keys())
+    keys_so_far = 0
+    rules_feed = Progress('transfer_rules', unit='rules', total=total_keys)
+    # One destination institution (partition) at a time
+    for rule_key, rule in sorted(rules_dict.items(),
+                                 key=lambda item: item[0].destination_institution):
+      keys_so_far += 1
+      if 0 == keys_so_far % 1000:
+        rules_feed.update(keys_so_far)
+        if progress:
+          print(f'\r{keys_so_far:,}/{total_keys:,} keys. {100 * keys_so_far / total_keys:.1f}%',
+                end='', file=terminal)
+      insert_rule(rule_key, rule)
+    rules_feed.finish(keys_so_far)
+
+  cursor.execute('select count(*) from transfer_rules')
+  num_rules = cursor.fetchone()[0]
+  if progress:
+    secs = perf_counter() - start_time
+    mins = int(secs / 60)
+    secs = int(secs - 60 * mins)
+    print(f'\n  That took {mins} min {secs} sec.', file=terminal)
+    print(f'\nThere are {num_rules:,} rules', file=terminal)
+
+  anomalies.close()
+
+  if report:
+    secs = perf_counter() - app_start
+    mins = int(secs / 60)
+    secs = int(secs - 60 * mins)
+    print(f'\n  Generated {num_rules:,} rules in {mins} min {secs} sec.')
+
+
+if __name__ == '__main__':
+  soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+  resource.setrlimit(resource.RLIMIT_NOFILE, [0x400, hard])
+
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--debug', '-d', action='store_true')
+  parser.add_argument('--external_sort', '-e', action='store_true')  # bounded memory
+  parser.add_argument('--workers', '-w', type=int, default=0,
+                      help='load the institutions’ partitions with this many worker processes')
+  parser.add_argument('--institution', '-i', metavar='institution', nargs='+',
+                      help='reload only the rules to these destination institutions')
+  parser.add_argument('--progress', '-p', action='store_true')  # to stderr
+  parser.add_argument('--report', '-r', action='store_true')    # to stdout
+  profiling.add_arguments(parser)
+  args = parser.parse_args()
+
+  institutions = [institution.upper() for institution in args.institution] \
+      if args.institution else None
+
+  with psycopg.connect('dbname=cuny_curriculum') as conn:
+    with profiling.profiled('transfer_rules', args.profile, args.cprofile):
+      populate_transfer_rules(conn, progress=args.progress, report=args.report, debug=args.debug,
+                              external_sort=args.external_sort, institutions=institutions,
+                              workers=args.workers)
@@ -0,0 +1,134 @@
+"""Optional profiling of the phases of an update step, enabled from the command line.
+
+A step marks the start of each of its phases (reading a query file, validating, writing to the db,
+...) by calling phase(name); each phase ends where the next one starts, and the last one ends when
+the step finishes. Unless profiling has been started, phase() does nothing, so the calls can stay in
+the code.
+
+With --profile, the elapsed time and the peak memory allocated by Python (tracemalloc) are recorded
+for each phase and written to profiles/<run date>/<step>.txt. With --cprofile, a cProfile dump of
+each phase is written there as well, as <step>.<phase>.prof, for use with pstats or snakeviz.
+Tracing memory allocations slows a step down noticeably, so the times are for comparing phases with
+each other, not with unprofiled runs.
+
+In a script:
+  profiling.add_arguments(parser)
+  ...
+  with profiling.profiled('cuny_courses', args.profile, args.cprofile):
+    populate_cuny_courses(conn)
+"""
+
+import cProfile
+import re
+import sys
+import tracemalloc
+
+from contextlib import contextmanager
+from datetime import date, datetime
+from pathlib import Path
+from time import perf_counter
+
+profiles_dir = Path('profiles')
+
+# The step being profiled, if any
+_profile = None
+
+
+class _Profile:
+  """Timings, peak memory, and (optionally) cProfile stats for the phases of one step."""
+
+  def __init__(self, step: str, cprofile: bool = False):
+    self.step = step
+    self.cprofile = cprofile
+    self.directory = profiles_dir / date.today().isoformat()
+    self.started = datetime.now()
+    self.start_time = perf_counter()
+    self.results = []   # (phase name, seconds, peak bytes)
+    self.stopped_tracing = not tracemalloc.is_tracing()
+    if self.stopped_tracing:
+      tracemalloc.start()
+    self._begin('setup')
+
+  def _begin(self, name: str):
+    self.phase_name = name
+    tracemalloc.reset_peak()
+    self.profiler = cProfile.Profile() if self.cprofile else None
+    self.phase_start = perf_counter()
+    if self.profiler:
+      self.profiler.enable()
+
+  def _end(self):
+    if self.profiler:
+      self.profiler.disable()
+    self.results.append((self.phase_name, perf_counter() - self.phase_start,
+                         tracemalloc.get_traced_memory()[1]))
+    if self.profiler:
+      self.directory.mkdir(parents=True, exist_ok=True)
+      self.profiler.dump_stats(self.directory / f'{self.step}.{_slug(self.phase_name)}.prof')
+
+  def phase(self, name: str):
+    self._end()
+    self._begin(name)
+
+  def finish(self) -> Path:
+    """End the last phase, write the report, and return its path."""
+    self._end()
+    if self.stopped_tracing:
+      tracemalloc.stop()
+    self.directory.mkdir(parents=True, exist_ok=True)
+    report_path = self.directory / f'{self.step}.txt'
+    with open(report_path, 'w') as report:
+      print(f'{self.step} started {self.started:%Y-%m-%d %H:%M:%S}\n', file=report)
+      print(f'  {"Phase":32} {"Seconds":>9} {"Peak MB":>9}', file=report)
+      for name, seconds, peak in self.results:
+        print(f'  {name:32} {seconds:9.2f} {peak / 1e6:9.1f}', file=report)
+      print(f'  {"Total":32} {perf_counter() - self.start_time:9.2f} '
+            f'{max(peak for _, _, peak in self.results) / 1e6:9.1f}', file=report)
+    return report_path
+
+
+def _slug(name: str) -> str:
+  """Phase name made safe for use in a file name."""
+  return re.sub(r'\W+', '_', name).strip('_').lower()
+
+
+def start(step: str, cprofile: bool = False):
+  """Start profiling a step."""
+  global _profile
+  _profile = _Profile(step, cprofile)
+
+
+def phase(name: str):
+  """Mark the start of a phase of the step being profiled, if there is one."""
+  if _profile is not None:
+    _profile.phase(name)
+
+
+def finish():
+  """Stop profiling, and write the report."""
+  global _profile
+  if _profile is not None:
+    report_path = _profile.finish()
+    _profile = None
+    print(f'Profile written to {report_path}', file=sys.stderr)
+
+
+@contextmanager
+def profiled(step: str, profile: bool = False, cprofile: bool = False):
+  """Profile the enclosed step if profile or cprofile is true."""
+  if not (profile or cprofile):
+    yield
+    return
+  start(step, cprofile)
+  try:
+    yield
+  finally:
+    finish()
+
+
+def add_arguments(parser):
+  """Add the --profile and --cprofile options to an argparse parser."""
+  parser.add_argument('--profile', action='store_true',
+                      help=f'record time and peak memory for each phase in {profiles_dir}/<date>/')
+  parser.add_argument('--cprofile', action='store_true',
+                      help='like --profile, and also write cProfile stats for each phase')
@@ -0,0 +1,150 @@
+"""Publish the progress of a running update step to redis.
+
+Progress messages written to the terminal are lost when update_db runs from cron, so the steps also
+publish their progress to redis, where the transfer app and operators can see how far along an
+update is. For each step, the redis hash update_db_progress:<step> holds the latest state:
+
+  step        The update_steps.py step name
+  status      running, done, or failed
+  done        Number of units (rows, rules, ...) done so far
+  total       Total number of units, if known; possibly an estimate
+  unit        What is being counted
+  percent     100 * done / total
+  rate        Units per second
+  eta         Estimated seconds remaining
+  updated_at  Unix time of this update
+
+and the same state is published as JSON on the update_db_progress channel. Updates are published at
+most once per second (and when a step finishes), so reporting progress for every row costs little
+more than a call to perf_counter().
+
+Progress is not essential: if the redis module is not installed or the redis server is not running,
+nothing is published.
+
+Total row counts for query files are estimated from how many bytes have been read (see
+CountingFile), so there is no need to read a file an extra time just to count its lines.
+"""
+
+import json
+import os
+
+from time import perf_counter, time
+
+try:
+  import redis
+except ImportError:
+  redis = None
+
+CHANNEL = 'update_db_progress'
+INTERVAL = 1.0  # Minimum seconds between updates
+
+# The redis connection: None until first used, False if redis is not available.
+_server = None
+
+
+def _redis():
+  """The redis connection, or False if there isn’t one."""
+  global _server
+  if _server is None:
+    _server = False
+    if redis is not None:
+      try:
+        server = redis.Redis(host='localhost', socket_connect_timeout=1)
+        server.ping()
+        _server = server
+      except redis.exceptions.RedisError:
+        pass
+  return _server
+
+
+class Progress:
+  """Rate-limited progress reports for one step."""
+
+  def __init__(self, step: str, unit: str = 'rows', total: int = None, interval: float = INTERVAL):
+    self.step = step
+    self.unit = unit
+    self.total = total
+    self.interval = interval
+    self.done = 0
+    self.start_time = perf_counter()
+    self.last_time = None
+    self.key = f'{CHANNEL}:{step}'
+    self.fields = {}
+    self._publish('running')
+
+  def update(self, done: int, total: int = None, force: bool = False, **fields):
+    """Note how many units are done, and publish if it has been long enough since the last time,
+    or if force is true.
+
+    Fields can be extra information to include in the hash, such as the phase of the step.
+    """
+    self.done = done
+    if total is not None:
+      self.total = total
+    self.fields.update(fields)
+    if force or perf_counter() - self.last_time >= self.interval:
+      self._publish('running')
+
+  def finish(self, done: int = None):
+    """Publish the final state."""
+    if done is not None:
+      self.done = done
+    self.total = self.done
+    self._publish('done')
+
+  def fail(self):
+    """Publish the state the step was in when it failed."""
+    self._publish('failed')
+
+  def _publish(self, status: str):
+    self.last_time = perf_counter()
+    server = _redis()
+    if not server:
+      return
+    elapsed = self.last_time - self.start_time
+    rate = self.done / elapsed if elapsed > 0 else 0.0
+    state = {'step': self.step,
+             'status': status,
+             'done': self.done,
+             'total': '' if self.total is None else int(self.total),
+             'unit': self.unit,
+             'percent': f'{100 * self.done / self.total:.1f}' if self.total else '',
+             'rate': f'{rate:.1f}',
+             'eta': f'{(self.total - self.done) / rate:.0f}' if self.total and rate else '',
+             'updated_at': f'{time():.0f}',
+             **self.fields}
+    try:
+      with server.pipeline() as pipe:
+        pipe.hset(self.key, mapping=state)
+        pipe.publish(CHANNEL, json.dumps(state))
+        pipe.execute()
+    except redis.exceptions.RedisError:
+      pass
+
+
+class CountingFile:
+  """Iterate over the lines of an open text file, keeping count of the lines and characters read.
+
+  The character count stands in for the byte offset (query files are almost all ASCII), giving an
+  estimate of how many lines there are in all before the file has been read to the end.
+  """
+
+  def __init__(self, file):
+    self.file = file
+    self.size = os.fstat(file.fileno()).st_size
+    self.chars_read = 0
+    self.lines_read = 0
+    self.at_end = False
+
+  def __iter__(self):
+    for line in self.file:
+      self.chars_read += len(line)
+      self.lines_read += 1
+      yield line
+    self.at_end = True
+
+  def estimated_lines(self) -> int:
+    """Estimated number of lines in the file: exact once the whole file has been read."""
+    if self.at_end or self.chars_read == 0:
+      return self.lines_read
+    return int(self.lines_read * self.size / self.chars_read)
@@ -0,0 +1,125 @@
+#! /usr/local/bin/python3
+"""Content-addressed, compressed archive of previous CUNYfirst query files.
+
+Many of the query files are identical from one week to the next, so each distinct file is stored
+just once, as an xz-compressed blob named by the SHA-256 of its contents:
+
+    query_archive/blobs/<sha256>.csv.xz
+
+The date index, query_archive/index.csv, has one row per archived (query_date, query_name) pair,
+giving the hash of the blob that holds it and its uncompressed size.
+
+open_query() returns a text stream for any archived query that reads just like the original CSV
+file, decompressing as it goes, so old runs can be replayed without first restoring the files.
+
+The Python lzma module can’t write multi-block (seekable) xz streams, so the blobs are read from the
+beginning; for replaying whole files that costs nothing.
+
+Command line:
+  query_archive.py --list [query_name]        List archived queries and their dates.
+  query_archive.py --cat query_name [date]    Write an archived query (latest if no date) to stdout.
+  query_archive.py --migrate                  Convert uncompressed <name>_<date>.csv archive files.
+"""
+
+import argparse
+import csv
+import lzma
+import shutil
+import sys
+
+from collections import namedtuple
+from pathlib import Path
+
+from file_hash import file_hash
+
+archive_dir = Path(Path.home(), 'Projects/cuny_curriculum/query_archive')
+blobs_dir = archive_dir / 'blobs'
+index_file = archive_dir / 'index.csv'
+
+# Low presets compress the big query files several times faster than the default, for not much
+# less compression of this kind of text.
+XZ_PRESET = 3
+
+Archived = namedtuple('Archived', 'query_date query_name sha256 size')
+
+
+def blob_path(sha256: str) -> Path:
+  """Where the blob with the given hash is stored."""
+  return blobs_dir / f'{sha256}.csv.xz'
+
+
+def archived_queries(query_name: str = None) -> list:
+  """Index entries, optionally for just one query, in date order."""
+  if not index_file.exists():
+    return []
+  with open(index_file, newline='') as csv_file:
+    entries = [Archived._make(row) for row in csv.reader(csv_file)]
+  return sorted(entry for entry in entries if query_name in (None, entry.query_name))
+
+
+def store(query: Path, query_name: str, query_date: str) -> Archived:
+  """Add a query file to the archive, compressing it only if its contents are not already there.
+
+  The query file itself is left in place.
+  """
+  blobs_dir.mkdir(parents=True, exist_ok=True)
+  sha256 = file_hash(query)
+  blob = blob_path(sha256)
+  if not blob.exists():
+    partial = blob.with_suffix('.part')
+    with open(query, 'rb') as query_file, lzma.open(partial, 'wb', preset=XZ_PRESET) as blob_file:
+      shutil.copyfileobj(query_file, blob_file, 0x100000)
+    partial.rename(blob)
+
+  entry = Archived(query_date, query_name, sha256, str(query.stat().st_size))
+  if entry not in archived_queries(query_name):
+    with open(index_file, 'a', newline='') as csv_file:
+      csv.writer(csv_file).writerow(entry)
+  return entry
+
+
+def open_query(query_name: str, query_date: str = None):
+  """Open an archived query as a text stream, like open() on the original CSV file.
+
+  With no query_date, the most recently archived version is opened.
+  """
+  entries = archived_queries(query_name)
+  if query_date is not None:
+    entries = [entry for entry in entries if entry.query_date == query_date]
+  if not entries:
+    raise FileNotFoundError(f'{query_name} {query_date or ""} is not in the query archive')
+  return lzma.open(blob_path(entries[-1].sha256), 'rt', encoding='utf-8', newline='')
+
+
+def migrate():
+  """Move uncompressed <query_name>_<date>.csv files from the archive folder into blobs."""
+  for csv_path in sorted(archive_dir.glob('*_????-??-??.csv')):
+    query_name, query_date = csv_path.stem.rsplit('_', 1)
+    entry = store(csv_path, query_name, query_date)
+    print(f'{csv_path.name} => {entry.sha256[0:12]}')
+    csv_path.unlink()
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Compressed, deduplicated query archive')
+  group = parser.add_mutually_exclusive_group(required=True)
+  group.add_argument('-l', '--list', nargs='?', const='', metavar='query_name')
+  group.add_argument('-c', '--cat', nargs='+', metavar=('query_name', 'date'))
+  group.add_argument('-m', '--migrate', action='store_true')
+  args = parser.parse_args()
+
+  if args.migrate:
+    migrate()
+
+  elif args.cat:
+    with open_query(*args.cat[0:2]) as query_file:
+      shutil.copyfileobj(query_file, sys.stdout)
+
+  else:
+    entries = archived_queries(args.list or None)
+    blob_bytes = sum(blob.stat().st_size for blob in blobs_dir.glob('*.csv.xz'))
+    for entry in entries:
+      print(f'{entry.query_date} {entry.query_name:32} {entry.sha256[0:12]} {int(entry.size):>13,}')
+    print(f'{len(entries):,} archived queries; '
+          f'{len(set(entry.sha256 for entry in entries)):,} distinct; '
+          f'{blob_bytes:,} bytes compressed')
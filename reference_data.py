@@ -0,0 +1,100 @@
+"""Read-through cache of the reference tables that several update steps consult.
+
+Run as separate scripts, each step queries the reference data it needs for itself. Run together by
+pipeline.py, the steps share one process, so each table is read once and the result is kept here
+until a step rebuilds the table, at which point the pipeline invalidates it.
+
+The cached values are shared: callers must not modify them.
+"""
+
+from collections import defaultdict
+
+from psycopg.rows import namedtuple_row
+
+# Cached values, keyed by (table_name, accessor_name)
+_cache = {}
+
+
+def _read_through(conn, table_name: str, accessor_name: str, query: str, make):
+  """Return the cached value, or run the query and cache make(rows)."""
+  key = (table_name, accessor_name)
+  if key not in _cache:
+    with conn.cursor(row_factory=namedtuple_row) as cursor:
+      cursor.execute(query)
+      _cache[key] = make(cursor.fetchall())
+  return _cache[key]
+
+
+def invalidate(*table_names):
+  """Forget what was read from the named tables, or from all tables if none are named."""
+  for key in list(_cache.keys()):
+    if not table_names or key[0] in table_names:
+      del _cache[key]
+
+
+def institutions(conn) -> list:
+  """Codes of the institutions in cuny_institutions, in order."""
+  return _read_through(conn, 'cuny_institutions', 'institutions',
+                       'select code from cuny_institutions order by code',
+                       lambda rows: [row.code for row in rows])
+
+
+def divisions(conn) -> set:
+  """(institution, division) pairs from cuny_divisions."""
+  return _read_through(conn, 'cuny_divisions', 'divisions',
+                       'select institution, division from cuny_divisions',
+                       lambda rows: {(row.institution, row.division) for row in rows})
+
+
+def departments(conn) -> set:
+  """Departments (academic organizations) from cuny_departments."""
+  return _read_through(conn, 'cuny_departments', 'departments',
+                       'select department from cuny_departments',
+                       lambda rows: {row.department for row in rows})
+
+
+def max_terms(conn) -> dict:
+  """The latest term each course was offered, keyed by (course_id, offer_nbr), from class_max_term.
+  Empty if there is no class_max_term table.
+  """
+  if conn.execute("select to_regclass('class_max_term')").fetchone()[0] is None:
+    return dict()
+  return _read_through(conn, 'class_max_term', 'max_terms',
+                       'select course_id, offer_nbr, max_term from class_max_term',
+                       lambda rows: {(row.course_id, row.offer_nbr): row.max_term for row in rows})
+
+
+def disciplines(conn) -> set:
+  """(institution, discipline) pairs from cuny_disciplines."""
+  return _read_through(conn, 'cuny_disciplines', 'disciplines',
+                       'select institution, discipline from cuny_disciplines',
+                       lambda rows: {(row.institution, row.discipline) for row in rows})
+
+
+def course_cache(conn) -> defaultdict:
+  """The information about courses that transfer rules use, indexed by course_id.
+
+  Each value is a list of the rows for the course’s offer_nbrs. Unknown course_ids map to an empty
+  list.
+  """
+  def make(rows):
+    courses = defaultdict(list)
+    for course in rows:
+      courses[course.course_id].append(course)
+    return courses
+
+  return _read_through(conn, 'cuny_courses', 'course_cache',
+                       """
+                       select course_id,
+                              offer_nbr,
+                              institution,
+                              discipline,
+                              catalog_number,
+                              numeric_part(catalog_number) as cat_num,
+                              cuny_subject,
+                              min_credits,
+                              max_credits,
+                              course_status,
+                              designation in ('MLA', 'MNL') as is_mesg,
+                              attributes ~* 'BKCR' as is_bkcr
+                              from cuny_courses""", make)
@@ -0,0 +1,131 @@
+#! /usr/local/bin/python3
+"""Load a week’s archived transfer rules into a dated schema for comparison with the current rules.
+
+archive_rules.sh saves three bzip2-compressed CSV files in rules_archive/ each time the rules are
+rebuilt:
+    <date>_source_courses.csv.bz2
+    <date>_destination_courses.csv.bz2
+    <date>_effective_dates.csv.bz2
+
+This loads them into the schema rules_<date> (for example, rules_2024_09_03), as the tables
+source_courses, destination_courses, and effective_dates. Each file is decompressed as it streams
+into COPY, the three files load in parallel on separate connections, and the rule_key indexes are
+built only after all the rows are in.
+
+Example: rules added since 2024-09-03
+  select rule_key from transfer_rules
+  except
+  select rule_key from rules_2024_09_03.effective_dates;
+"""
+
+import argparse
+import bz2
+import sys
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from pathlib import Path
+from time import perf_counter
+
+import psycopg
+
+rules_archive_dir = Path('./rules_archive')
+
+# Column definitions, matching the copy commands in archive_rules.sh
+archive_tables = {'source_courses': """rule_key text,
+                                       course_id integer,
+                                       offer_nbr integer,
+                                       min_credits real,
+                                       max_credits real,
+                                       credit_source text,
+                                       min_gpa real,
+                                       max_gpa real""",
+                  'destination_courses': """rule_key text,
+                                            course_id integer,
+                                            offer_nbr integer,
+                                            transfer_credits real""",
+                  'effective_dates': """rule_key text,
+                                        effective_date date"""}
+
+
+def archive_dates() -> list:
+  """Dates for which all three archive files are available."""
+  dates = None
+  for table_name in archive_tables.keys():
+    table_dates = set(path.name[0:10]
+                      for path in rules_archive_dir.glob(f'????-??-??_{table_name}.csv.bz2'))
+    dates = table_dates if dates is None else dates & table_dates
+  return sorted(dates)
+
+
+def schema_name(archive_date: str) -> str:
+  """Name of the schema for an archive date."""
+  return f'rules_{date.fromisoformat(archive_date).isoformat().replace("-", "_")}'
+
+
+def copy_archive(archive_date: str, table_name: str) -> int:
+  """Stream one archive file through decompression into COPY on a connection of its own."""
+  archive_file = rules_archive_dir / f'{archive_date}_{table_name}.csv.bz2'
+  with psycopg.connect('dbname=cuny_curriculum') as conn:
+    with conn.cursor() as cursor:
+      with cursor.copy(f'copy {schema_name(archive_date)}.{table_name} from stdin csv') as copy:
+        with bz2.open(archive_file, 'rb') as csv_file:
+          while block := csv_file.read(0x100000):
+            copy.write(block)
+      return cursor.rowcount
+
+
+def index_table(archive_date: str, table_name: str):
+  """Index and analyze one of the replayed tables."""
+  with psycopg.connect('dbname=cuny_curriculum') as conn:
+    conn.execute(f'create index on {schema_name(archive_date)}.{table_name} (rule_key)')
+  with psycopg.connect('dbname=cuny_curriculum', autocommit=True) as conn:
+    conn.execute(f'analyze {schema_name(archive_date)}.{table_name}')
+
+
+def replay(archive_date: str, replace: bool = False, progress: bool = False):
+  """Create the schema for archive_date and load the archived rules into it."""
+  start_time = perf_counter()
+  schema = schema_name(archive_date)
+  with psycopg.connect('dbname=cuny_curriculum') as conn:
+    if replace:
+      conn.execute(f'drop schema if exists {schema} cascade')
+    conn.execute(f'create schema {schema}')
+    for table_name, columns in archive_tables.items():
+      conn.execute(f'create table {schema}.{table_name} ({columns})')
+
+  with ThreadPoolExecutor(max_workers=len(archive_tables)) as executor:
+    num_rows = dict(zip(archive_tables.keys(),
+                        executor.map(copy_archive, [archive_date] * len(archive_tables),
+                                     archive_tables.keys())))
+    if progress:
+      for table_name, count in num_rows.items():
+        print(f'  {schema}.{table_name}: {count:,} rows', file=sys.stderr)
+    list(executor.map(index_table, [archive_date] * len(archive_tables), archive_tables.keys()))
+
+  if progress:
+    print(f'  Replayed {archive_date} in {perf_counter() - start_time:.1f} sec.', file=sys.stderr)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Load archived transfer rules into a dated schema')
+  parser.add_argument('archive_date', nargs='?', help='YYYY-MM-DD (default: the latest archive)')
+  parser.add_argument('-l', '--list', action='store_true', help='list the available dates')
+  parser.add_argument('-r', '--replace', action='store_true',
+                      help='replace the schema if it already exists')
+  parser.add_argument('-p', '--progress', action='store_true')
+  args = parser.parse_args()
+
+  available_dates = archive_dates()
+  if args.list:
+    for available_date in available_dates:
+      print(available_date)
+    sys.exit(0)
+
+  if not available_dates:
+    sys.exit(f'No rule archives in {rules_archive_dir}')
+  archive_date = args.archive_date or available_dates[-1]
+  if archive_date not in available_dates:
+    sys.exit(f'No complete set of rule archives for {archive_date}')
+
+  replay(archive_date, replace=args.replace, progress=args.progress)
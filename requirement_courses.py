@@ -0,0 +1,86 @@
+#! /usr/local/bin/python3
+"""Create the requirement_courses table: which degree requirements each course can satisfy.
+
+The courses that can satisfy a requirement are in the active_courses array of its JSON description
+in dgw.requirements (maintained by the degree works project), so asking which requirements a course
+satisfies would mean scanning all that JSON. Here the arrays are exploded into one row per course
+and requirement, with indexes for lookups in both directions. For example, the requirements that a
+rule’s receiving courses satisfy:
+
+  select distinct r.requirement_key, r.institution
+    from destination_courses d
+         join requirement_courses r using (course_id, offer_nbr)
+   where d.destination_institution = 'QNS01' and d.rule_id = 12345;
+
+Each element of active_courses is an array that starts with the course’s course_id and offer_nbr.
+"""
+
+import argparse
+
+import psycopg
+
+from bulk_load import copy_rows
+import profiling
+
+_columns = ['course_id', 'offer_nbr', 'requirement_key', 'institution']
+
+
+def requirement_course_rows(read_conn):
+  """Generate (course_id, offer_nbr, requirement_key, institution) rows from dgw.requirements."""
+  with read_conn.cursor(name='requirement_courses') as cursor:
+    cursor.execute("""
+                   select requirement_key, institution,
+                          requirement_description->'courses'->'active_courses' as active_courses
+                     from dgw.requirements
+                   """)
+    for requirement_key, institution, active_courses in cursor:
+      courses = set()
+      for course in active_courses or []:
+        try:
+          courses.add((int(course[0]), int(course[1])))
+        except (IndexError, TypeError, ValueError):
+          continue
+      for course_id, offer_nbr in courses:
+        yield course_id, offer_nbr, requirement_key, institution
+
+
+def create_requirement_courses(conn) -> int:
+  """Create and populate the requirement_courses table; return the number of rows."""
+  cursor = conn.cursor()
+  cursor.execute("""
+                 drop table if exists requirement_courses;
+                 create table requirement_courses (
+                   course_id integer not null,
+                   offer_nbr integer not null,
+                   requirement_key integer not null,
+                   institution text not null)
+                 """)
+  cursor.execute("select to_regclass('dgw.requirements')")
+  if cursor.fetchone()[0] is None:
+    return 0
+
+  # The requirements are streamed from a server-side cursor, so they are read on a connection that
+  # isn’t busy with the COPY.
+  profiling.phase('copy requirement courses')
+  with psycopg.connect('dbname=cuny_curriculum') as read_conn:
+    num_rows = copy_rows(cursor, 'requirement_courses', _columns,
+                         requirement_course_rows(read_conn))
+
+  profiling.phase('index requirement courses')
+  cursor.execute("""
+                 alter table requirement_courses
+                   add primary key (course_id, offer_nbr, requirement_key);
+                 create index on requirement_courses (requirement_key);
+                 """)
+  return num_rows
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  profiling.add_arguments(parser)
+  args = parser.parse_args()
+
+  with psycopg.connect('dbname=cuny_curriculum') as conn:
+    with profiling.profiled('requirement_courses', args.profile, args.cprofile):
+      num_rows = create_requirement_courses(conn)
+  print(f'{num_rows:,} requirement courses')
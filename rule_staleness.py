@@ -0,0 +1,70 @@
+#! /usr/local/bin/python3
+"""Set the staleness columns of the transfer_rules table.
+
+For each rule, last_offered_term is the latest term in which any of its source or destination
+courses was offered (from class_max_term), and has_inactive_course tells whether any of them is not
+active in the catalog. Both columns are indexed, so rules can be filtered by staleness for review
+without joining class_max_term against all the rules’ courses.
+
+The columns depend on both the transfer rules and class_max_term. populate_transfer_rules.py sets
+them as it writes the rules (see staleness()), from class_max_term as it is then, so update_db
+builds class_max_term first. When class_max_term is rebuilt, update_rule_staleness() updates the
+rules whose values have changed.
+
+Usage (to bring the columns up to date by hand):
+  rule_staleness.py
+"""
+
+import psycopg
+
+
+def staleness(courses, max_terms: dict, course_cache) -> tuple:
+  """(last_offered_term, has_inactive_course) for the (course_id, offer_nbr) pairs of a rule’s
+  source and destination courses: the values update_rule_staleness() would set. max_terms and
+  course_cache are from reference_data.py.
+  """
+  if not courses:
+    return None, None
+  statuses = {(offer.course_id, offer.offer_nbr): offer.course_status
+              for course_id in {course_id for course_id, _ in courses}
+              for offer in course_cache.get(course_id, [])}
+  return (max((max_terms[course] for course in courses if course in max_terms), default=None),
+          any(statuses.get(course) != 'A' for course in courses))
+
+
+def update_rule_staleness(conn) -> int:
+  """Set last_offered_term and has_inactive_course for all rules; return the number updated."""
+  cursor = conn.cursor()
+  cursor.execute("select to_regclass('class_max_term') is not null")
+  if not cursor.fetchone()[0]:
+    return 0
+  cursor.execute("""
+                 with rule_courses as (
+                   select destination_institution, rule_id, course_id, offer_nbr
+                     from source_courses
+                   union all
+                   select destination_institution, rule_id, course_id, offer_nbr
+                     from destination_courses),
+                 staleness as (
+                   select rc.destination_institution, rc.rule_id,
+                          max(m.max_term) as last_offered_term,
+                          bool_or(coalesce(c.course_status, 'I') <> 'A') as has_inactive_course
+                     from rule_courses rc
+                          left join class_max_term m using (course_id, offer_nbr)
+                          left join cuny_courses c using (course_id, offer_nbr)
+                    group by rc.destination_institution, rc.rule_id)
+                 update transfer_rules r
+                    set last_offered_term = s.last_offered_term,
+                        has_inactive_course = s.has_inactive_course
+                   from staleness s
+                  where r.destination_institution = s.destination_institution
+                    and r.id = s.rule_id
+                    and (r.last_offered_term, r.has_inactive_course)
+                        is distinct from (s.last_offered_term, s.has_inactive_course)
+                 """)
+  return cursor.rowcount
+
+
+if __name__ == '__main__':
+  with psycopg.connect('dbname=cuny_curriculum') as conn:
+    print(f'{update_rule_staleness(conn):,} rules updated')
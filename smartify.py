@@ -1,23 +1,19 @@
 #! /usr/local/bin/python3
 
+import re
 import sys
 
+from itertools import cycle
+
+_straight_quote = re.compile('"')
+
 
 def smartify(dumb: str):
   """ If the dumb string contains straight double quotes, convert them to curly quotes.
       Alternates left & right curlies.
   """
-  left = '“'
-  right = '”'
-  use_left = True
-  smart = []
-  for ch in dumb:
-    if ch == '"':
-      smart.append(left if use_left else right)
-      use_left = not use_left
-    else:
-      smart.append(ch)
-  return ''.join(smart)
+  quotes = cycle('“”')
+  return _straight_quote.sub(lambda match: next(quotes), dumb)
 
 
 if __name__ == '__main__':
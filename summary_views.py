@@ -0,0 +1,47 @@
+#! /usr/local/bin/python3
+"""Create or refresh the materialized summary views defined in summary_views.sql.
+
+update_db (re-)creates the views as its last step: they are dropped along with the transfer rule
+tables whenever those are rebuilt. After rules have been reloaded in place (with the --institution
+option of populate_transfer_rules.py, for example), refresh them instead. The refresh is concurrent,
+so the app can go on reading the views while they are being refreshed.
+
+Usage:
+  summary_views.py [--rebuild]
+"""
+
+import argparse
+
+from pathlib import Path
+
+import psycopg
+
+views = ['transfer_pair_counts', 'transfer_subject_counts', 'blanket_credit_ratios']
+
+
+def create_summary_views(conn):
+  """Drop and re-create the summary views."""
+  conn.execute(Path('summary_views.sql').read_text())
+
+
+def refresh_summary_views(conn):
+  """Refresh the summary views concurrently; create them if any of them doesn’t exist."""
+  if any(conn.execute('select to_regclass(%s)', (view_name, )).fetchone()[0] is None
+         for view_name in views):
+    create_summary_views(conn)
+    return
+  for view_name in views:
+    conn.execute(f'refresh materialized view concurrently {view_name}')
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Create or refresh the summary views')
+  parser.add_argument('-r', '--rebuild', action='store_true',
+                      help='re-create the views (after changing summary_views.sql)')
+  args = parser.parse_args()
+
+  with psycopg.connect('dbname=cuny_curriculum') as conn:
+    if args.rebuild:
+      create_summary_views(conn)
+    else:
+      refresh_summary_views(conn)
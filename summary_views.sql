@@ -0,0 +1,46 @@
+-- Summary views for the Transfer Explorer landing pages, which would otherwise compute these counts
+-- from transfer_rules and destination_courses on every request. They are rebuilt by the last step
+-- of update_db, and can be refreshed in place (summary_views.py) after a partial reload of the
+-- transfer rules. Each view has a unique index, which REFRESH MATERIALIZED VIEW CONCURRENTLY needs.
+
+-- Rule counts per (sending, receiving) institution pair
+drop materialized view if exists transfer_pair_counts;
+create materialized view transfer_pair_counts as
+  select source_institution,
+         destination_institution,
+         count(*) as num_rules
+    from transfer_rules
+   group by source_institution, destination_institution;
+create unique index on transfer_pair_counts (source_institution, destination_institution);
+
+-- Rule counts per institution pair and CUNY subject of the sending courses. A rule with sending
+-- courses in more than one subject counts once for each of them.
+drop materialized view if exists transfer_subject_counts;
+create materialized view transfer_subject_counts as
+  select r.source_institution,
+         r.destination_institution,
+         coalesce(s.cuny_subject, '') as cuny_subject,
+         count(distinct r.id) as num_rules
+    from transfer_rules r
+         join source_courses s
+           on s.destination_institution = r.destination_institution and s.rule_id = r.id
+   group by r.source_institution, r.destination_institution, coalesce(s.cuny_subject, '');
+create unique index on transfer_subject_counts (source_institution, destination_institution,
+                                                cuny_subject);
+
+-- Proportions of receiving courses that are blanket credit (BKCR) or message (MESG) courses, per
+-- institution pair
+drop materialized view if exists blanket_credit_ratios;
+create materialized view blanket_credit_ratios as
+  select r.source_institution,
+         r.destination_institution,
+         count(*) as num_destination_courses,
+         count(*) filter (where d.is_bkcr) as num_bkcr,
+         count(*) filter (where d.is_mesg) as num_mesg,
+         round(count(*) filter (where d.is_bkcr) / count(*)::numeric, 4) as bkcr_ratio,
+         round(count(*) filter (where d.is_mesg) / count(*)::numeric, 4) as mesg_ratio
+    from transfer_rules r
+         join destination_courses d
+           on d.destination_institution = r.destination_institution and d.rule_id = r.id
+   group by r.source_institution, r.destination_institution;
+create unique index on blanket_credit_ratios (source_institution, destination_institution);
@@ -0,0 +1,33 @@
+#! /usr/local/bin/python3
+"""Check the union-find functions in course_clusters.py."""
+
+import pytest
+
+pytest.importorskip('psycopg')
+
+from course_clusters import find, union  # noqa: E402
+
+
+def test_union_find():
+  parent = {course_id: course_id for course_id in range(10)}
+  size = {course_id: 1 for course_id in range(10)}
+  for course_id, other_id in [(0, 1), (2, 3), (1, 3), (5, 6), (6, 5), (7, 7)]:
+    union(parent, size, course_id, other_id)
+
+  assert len({find(parent, course_id) for course_id in (0, 1, 2, 3)}) == 1
+  assert find(parent, 5) == find(parent, 6) != find(parent, 0)
+  for course_id in (4, 7, 8, 9):
+    assert find(parent, course_id) == course_id
+  assert size[find(parent, 0)] == 4
+  assert size[find(parent, 5)] == 2
+
+
+def test_smaller_attaches_to_larger():
+  parent = {course_id: course_id for course_id in range(4)}
+  size = {course_id: 1 for course_id in range(4)}
+  union(parent, size, 1, 2)
+  union(parent, size, 1, 3)
+  root = find(parent, 1)
+  union(parent, size, 0, 1)
+  assert find(parent, 0) == root
+  assert size[root] == 4
@@ -0,0 +1,30 @@
+#! /usr/local/bin/python3
+"""Check external_sort.sorted_rows() against sorted(), with chunks small enough to spill."""
+
+import random
+
+import pytest
+
+from external_sort import sorted_rows
+
+
+def key(row):
+  return row[0]
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 7, 100, 1_000])
+def test_matches_sorted(chunk_size):
+  rng = random.Random(chunk_size)
+  # Few distinct keys, so there are lots of ties; the second column records input order.
+  rows = [[rng.choice('abcde'), str(seq)] for seq in range(500)]
+  assert list(sorted_rows(iter(rows), key, chunk_size)) == sorted(rows, key=key)
+
+
+def test_empty():
+  assert list(sorted_rows(iter([]), key, 2)) == []
+
+
+def test_csv_values():
+  # Values that have to be quoted in the spill files come back unchanged.
+  rows = [['b', 'comma, here'], ['a', 'quote " here'], ['b', 'line\nbreak'], ['a', '']]
+  assert list(sorted_rows(iter(rows), key, 1)) == sorted(rows, key=key)
@@ -0,0 +1,39 @@
+#! /usr/local/bin/python3
+"""Compare normalize() with the chain of replacements populate_cuny_courses.py used to apply to
+course titles.
+"""
+
+import random
+
+import pytest
+
+from normalize import normalize
+
+
+def old_chain(raw: str) -> str:
+  """The title rules as they were, including smartify()’s per-character loop."""
+  title = raw.replace("'", '’').replace('\r', '').replace('\n', ' ').replace('( ', '(')
+  smart = []
+  use_left = True
+  for ch in title:
+    if ch == '"':
+      smart.append('“' if use_left else '”')
+      use_left = not use_left
+    else:
+      smart.append(ch)
+  return ''.join(smart)
+
+
+@pytest.mark.parametrize('raw', ['', 'Calculus I', "Women's Studies", '(\r\n', '(\r\r\n', '(\r',
+                                 '(\n\n', '(  ', '( (  ', '(\r\n(\n', 'Intro ( to Art)',
+                                 '"Don\'t" (\r\n"Stop"\n"', '"a\'"\r"b\n"c( "d"', '""\'""'])
+def test_edge_cases(raw):
+  assert normalize(raw) == old_chain(raw)
+
+
+def test_random_strings():
+  rng = random.Random(50)
+  for _ in range(10_000):
+    raw = ''.join(rng.choice('(  \r\n\'"ab') for _ in range(rng.randrange(12)))
+    assert normalize(raw) == old_chain(raw), repr(raw)
+  normalize.cache_clear()
@@ -0,0 +1,39 @@
+#! /usr/local/bin/python3
+"""Check rule_staleness.staleness() on hand-made reference data."""
+
+from collections import namedtuple
+
+import pytest
+
+pytest.importorskip('psycopg')
+
+from rule_staleness import staleness  # noqa: E402
+
+Offer = namedtuple('Offer', 'course_id offer_nbr course_status')
+
+course_cache = {1: [Offer(1, 1, 'A'), Offer(1, 2, 'A')],
+                2: [Offer(2, 1, 'I')],
+                3: [Offer(3, 1, 'A')]}
+max_terms = {(1, 1): 1232, (1, 2): 1239, (2, 1): 1192}
+
+
+def test_no_courses():
+  assert staleness([], max_terms, course_cache) == (None, None)
+
+
+def test_active_courses():
+  assert staleness([(1, 1), (1, 2)], max_terms, course_cache) == (1239, False)
+
+
+def test_inactive_course():
+  assert staleness([(1, 1), (2, 1)], max_terms, course_cache) == (1232, True)
+
+
+def test_never_offered():
+  # Course 3 has no class_max_term row.
+  assert staleness([(3, 1)], max_terms, course_cache) == (None, False)
+
+
+def test_unknown_course():
+  # A course that isn’t in the catalog counts as inactive.
+  assert staleness([(1, 2), (4, 1)], max_terms, course_cache) == (1239, True)
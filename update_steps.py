@@ -0,0 +1,275 @@
+#! /usr/local/bin/python3
+"""Decide whether an update_db step can be skipped because nothing it depends on has changed.
+
+Many of the CUNYfirst query files are byte-identical from one week to the next, so there is no
+point in dropping and rebuilding the tables made from them.
+
+Each step declares the tables it (re-)builds, the files it reads (its own scripts, the modules they
+import, and the query files), and the upstream tables it depends on. A step’s input hash is the
+SHA-256 of the contents of its files together with the hashes recorded for its upstream tables.
+Because every table’s recorded hash covers the hashes of the tables upstream of it, a change
+anywhere propagates to everything downstream.
+
+After a step completes, pipeline.py records the step’s input hash for each of its tables in the
+input_hash column of the updates table. A step is “unchanged” if all its tables exist and all of
+them have the current input hash recorded.
+
+pipeline.py also records a content hash for each table a step rebuilds, and increments the table’s
+version (both in the updates table) if its contents have changed. Then it sends a notification on
+the cuny_curriculum_updated channel, whose payload is a JSON object mapping the names of the
+changed tables to their new versions. So apps that cache data from the db can LISTEN on the channel
+and invalidate just what has changed, or compare the versions in the updates table with the ones
+their caches were built from.
+
+Usage:
+  update_steps.py --unchanged step  Exit 0 if the step can be skipped; 1 if it has to be run.
+  update_steps.py --record step     Record the current input hash for each of the step’s tables.
+  update_steps.py --list            List the steps in the order update_db runs them.
+"""
+
+import argparse
+import hashlib
+import json
+import sys
+
+from collections import namedtuple
+from pathlib import Path
+
+import psycopg
+from psycopg import sql
+from psycopg.rows import namedtuple_row
+
+from file_hash import file_hash
+
+Step = namedtuple('Step', 'tables files upstream')
+
+CHANNEL = 'cuny_curriculum_updated'
+
+
+def query_file(query_name: str) -> str:
+  """Path to the latest version of a CUNYfirst query file."""
+  return f'latest_queries/{query_name}.csv'
+
+
+# The steps, in the order update_db runs them. Upstream tables include both the tables a step reads
+# and the tables its tables reference as foreign keys: dropping a table with cascade also drops the
+# foreign key constraints that reference it, so anything referencing a rebuilt table has to be
+# rebuilt too. The files include the repo’s modules that a step’s scripts import, except
+# profiling.py and progress.py, which don’t affect what goes into the tables.
+steps = {
+    'load_cuny_base_tables': Step(['cuny_cip_code_tbl', 'cuny_acad_plan_tbl',
+                                   'cuny_acad_plan_enrollments', 'cuny_acad_subplan_tbl',
+                                   'cuny_acad_subplan_enrollments'],
+                                  ['load_cuny_base_tables.py', 'bulk_load.py',
+                                   query_file('CIP_CODE_TBL'),
+                                   query_file('ACAD_PLAN_TBL'),
+                                   query_file('ACAD_PLAN_ENRL'),
+                                   query_file('ACAD_SUBPLAN_TBL'),
+                                   query_file('ACAD_SUBPLAN_ENRL')],
+                                  []),
+    'cuny_institutions': Step(['cuny_institutions'],
+                              ['cuny_institutions.sql'],
+                              []),
+    'cuny_programs': Step(['cuny_programs', 'cuny_subplans'],
+                          ['cuny_programs.py', 'bulk_load.py',
+                           query_file('QCCV_PROG_PLAN_ORG'),
+                           query_file('ACAD_SUBPLAN_TBL')],
+                          ['cuny_institutions']),
+    'cuny_careers': Step(['cuny_careers'],
+                         ['cuny_careers.py', 'bulk_load.py',
+                          query_file('ACAD_CAREER_TBL')],
+                         ['cuny_institutions']),
+    'cuny_divisions': Step(['cuny_divisions'],
+                           ['cuny_divisions.py', 'bulk_load.py', 'cuny_config.py',
+                            query_file('ACADEMIC_GROUPS')],
+                           ['cuny_institutions']),
+    'cuny_departments': Step(['cuny_departments'],
+                             ['cuny_departments.py', 'anomalies.py', 'bulk_load.py',
+                              'catalog_scan.py', 'cuny_config.py', 'reference_data.py',
+                              query_file('QNS_CV_ACADEMIC_ORGANIZATIONS'),
+                              query_file('QNS_QCCV_CU_CATALOG_NP')],
+                             ['cuny_institutions', 'cuny_divisions']),
+    'cuny_subjects': Step(['cuny_subjects', 'cuny_disciplines'],
+                          ['cuny_subjects.py', 'cuny_config.py', 'reference_data.py',
+                           query_file('QNS_CV_CUNY_SUBJECT_TABLE'),
+                           query_file('QNS_CV_CUNY_SUBJECTS')],
+                          ['cuny_institutions', 'cuny_departments']),
+    'designations': Step(['designations'],
+                         ['designations.py', 'bulk_load.py',
+                          query_file('QCCV_RQMNT_DESIG_TBL')],
+                         []),
+    'crse_equiv_tbl': Step(['crse_equiv_tbl'],
+                           ['mk_crse_equiv_tbl.py', 'bulk_load.py',
+                            query_file('QNS_CV_CRSE_EQUIV_TBL')],
+                           []),
+    'cuny_courses': Step(['cuny_courses', 'course_attributes', 'cross_listings'],
+                         ['create_cuny_courses.sql', 'view_courses.sql', 'populate_cuny_courses.py',
+                          'anomalies.py', 'bulk_load.py', 'catalog_scan.py', 'cuny_config.py',
+                          'normalize.py', 'reference_data.py',
+                          query_file('QNS_QCCV_CU_CATALOG_NP'),
+                          query_file('QNS_QCCV_CU_REQUISITES_NP'),
+                          query_file('QNS_QCCV_COURSE_ATTRIBUTES_NP'),
+                          query_file('SR742A___CRSE_ATTRIBUTE_VALUE')],
+                         ['cuny_institutions', 'cuny_careers', 'cuny_departments',
+                          'cuny_subjects', 'cuny_disciplines', 'designations', 'crse_equiv_tbl']),
+    'course_clusters': Step(['course_clusters'],
+                            ['course_clusters.py', 'bulk_load.py'],
+                            ['cuny_courses']),
+    'review_status_bits': Step(['review_status_bits'],
+                               ['review_status_bits.sql'],
+                               []),
+    # Before transfer_rules, which sets the rules’ staleness columns from it (rule_staleness.py). It
+    # isn’t upstream of transfer_rules: when it changes, its step updates the rules in place.
+    'class_max_term': Step(['class_max_term'],
+                           ['class_max_term.py', 'rule_staleness.py', 'bulk_load.py',
+                            query_file('QNS_CV_CLASS_MAX_TERM')],
+                           []),
+    'transfer_rules': Step(['credit_sources', 'transfer_rules', 'source_courses',
+                            'destination_courses'],
+                           ['create_transfer_rules.sql', 'populate_transfer_rules.py',
+                            'rule_staleness.py', 'anomalies.py', 'bulk_load.py', 'cuny_config.py',
+                            'external_sort.py', 'reference_data.py',
+                            query_file('QNS_CV_SR_TRNS_INTERNAL_RULES')],
+                           ['cuny_institutions', 'cuny_courses']),
+    'subject_rule_map': Step(['subject_rule_map'],
+                             ['mk_subject-rule_map.py'],
+                             ['cuny_subjects', 'transfer_rules']),
+    'cuny_sessions': Step(['cuny_sessions'],
+                          ['load_sessions_table.py', 'bulk_load.py',
+                           query_file('QNS_CV_SESSION_TABLE')],
+                          []),
+    # dgw.requirements is maintained elsewhere, so it has no input hash here, and
+    # requirement_courses is rebuilt every time.
+    'requirement_courses': Step(['requirement_courses'],
+                                ['requirement_courses.py', 'bulk_load.py'],
+                                ['dgw.requirements']),
+    'summary_views': Step(['transfer_pair_counts', 'transfer_subject_counts',
+                           'blanket_credit_ratios'],
+                          ['summary_views.sql', 'summary_views.py'],
+                          ['transfer_rules']),
+}
+
+
+def recorded_hashes(cursor) -> dict:
+  """The input hash recorded for each table in the updates table."""
+  cursor.execute("""
+                 alter table updates add column if not exists input_hash text default null,
+                                     add column if not exists content_hash text default null,
+                                     add column if not exists version integer not null default 0
+                 """)
+  cursor.execute('select table_name, input_hash from updates')
+  return {row.table_name: row.input_hash for row in cursor.fetchall()}
+
+
+def input_hash(step_name: str, hashes: dict) -> str:
+  """Combine the hashes of a step’s files and upstream tables into the step’s input hash."""
+  step = steps[step_name]
+  digest = hashlib.sha256(step_name.encode())
+  for file_name in sorted(step.files):
+    path = Path(file_name)
+    digest.update(f'{file_name}:{file_hash(path) if path.exists() else "missing"}\n'.encode())
+  for table_name in sorted(step.upstream):
+    digest.update(f'{table_name}:{hashes.get(table_name)}\n'.encode())
+  return digest.hexdigest()
+
+
+def is_unchanged(cursor, step_name: str) -> bool:
+  """True if all the step’s tables exist and were built from its current inputs."""
+  hashes = recorded_hashes(cursor)
+  if any(hashes.get(table_name) is None for table_name in steps[step_name].upstream):
+    return False
+  current_hash = input_hash(step_name, hashes)
+  for table_name in steps[step_name].tables:
+    cursor.execute('select to_regclass(%s) is not null as does_exist', (table_name, ))
+    if not cursor.fetchone().does_exist or hashes.get(table_name) != current_hash:
+      return False
+  return True
+
+
+def record(cursor, step_name: str) -> str:
+  """Record the step’s current input hash for all its tables, and return it."""
+  current_hash = input_hash(step_name, recorded_hashes(cursor))
+  for table_name in steps[step_name].tables:
+    cursor.execute("""
+                   insert into updates (table_name, input_hash) values (%s, %s)
+                   on conflict (table_name) do update set input_hash = excluded.input_hash
+                   """, (table_name, current_hash))
+  return current_hash
+
+
+def content_hash(cursor, table_name: str) -> str:
+  """Hash of a table’s contents that doesn’t depend on the order of its rows: the row count and the
+  sum of the rows’ 64-bit hashes. Surrogate key (id) columns are left out, because their values
+  depend on the order the rows were loaded in.
+  """
+  cursor.execute("""
+                 select attname from pg_attribute
+                  where attrelid = %s::regclass and attnum > 0 and not attisdropped
+                    and attname <> 'id'
+                  order by attnum
+                 """, (table_name, ))
+  columns = sql.SQL(', ').join(sql.Identifier('t', row.attname) for row in cursor.fetchall())
+  cursor.execute(sql.SQL("""
+                         select count(*) as num_rows,
+                                coalesce(sum(hashtextextended(row({})::text, 0)), 0) as hash_sum
+                           from {} t
+                         """).format(columns, sql.Identifier(table_name)))
+  row = cursor.fetchone()
+  return f'{row.num_rows}:{row.hash_sum}'
+
+
+def record_contents(cursor, step_name: str, also_changes: list = None) -> dict:
+  """Record the content hash of each of the step’s tables, and of any other tables it also changes,
+  and increment the version of each one whose contents have changed. Returns the new versions of the
+  changed tables, by table name.
+  """
+  recorded_hashes(cursor)   # Adds the columns if need be
+  changed = dict()
+  for table_name in steps[step_name].tables + (also_changes or []):
+    cursor.execute("""
+                   insert into updates (table_name, content_hash, version) values (%s, %s, 1)
+                   on conflict (table_name) do update
+                     set content_hash = excluded.content_hash, version = updates.version + 1
+                     where updates.content_hash is distinct from excluded.content_hash
+                   returning version
+                   """, (table_name, content_hash(cursor, table_name)))
+    row = cursor.fetchone()
+    if row is not None:
+      changed[table_name] = row.version
+  return changed
+
+
+def notify(cursor, changed: dict):
+  """Notify listeners of changed tables and their versions; delivered when the transaction commits.
+  """
+  cursor.execute('select pg_notify(%s, %s)', (CHANNEL, json.dumps(changed)))
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Skip update_db steps whose inputs are unchanged')
+  group = parser.add_mutually_exclusive_group(required=True)
+  group.add_argument('-u', '--unchanged', metavar='step', choices=steps.keys())
+  group.add_argument('-r', '--record', metavar='step', choices=steps.keys())
+  group.add_argument('-l', '--list', action='store_true')
+  parser.add_argument('-d', '--debug', action='store_true')
+  args = parser.parse_args()
+
+  if args.list:
+    for step_name, step in steps.items():
+      print(f'{step_name:24} {", ".join(step.tables)}')
+    sys.exit(0)
+
+  with psycopg.connect('dbname=cuny_curriculum') as conn:
+    with conn.cursor(row_factory=namedtuple_row) as cursor:
+      if args.unchanged:
+        unchanged = is_unchanged(cursor, args.unchanged)
+        if args.debug:
+          print(f'{args.unchanged} is {"un" if unchanged else ""}changed', file=sys.stderr)
+        sys.exit(0 if unchanged else 1)
+
+      current_hash = record(cursor, args.record)
+      changed = record_contents(cursor, args.record)
+      if changed:
+        notify(cursor, changed)
+      if args.debug:
+        print(f'{args.record}: {current_hash} {changed}', file=sys.stderr)
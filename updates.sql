@@ -4,6 +4,10 @@
 --   table_name text primary key,
 --   update_date text,
 --   file_name text default 'N/A');
+-- update_steps.py adds the input_hash column (content hash of the files and upstream tables each
+-- table was built from) when it first runs:
+--   alter table updates add column if not exists input_hash text default null;
+-- and the content_hash and version columns, which pipeline.py maintains for each table it rebuilds.
 
 insert into updates values ('course_mapper', default, default) on conflict do nothing;
 insert into updates values ('course_mappings', default, default) on conflict do nothing;
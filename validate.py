@@ -0,0 +1,276 @@
+#! /usr/local/bin/python3
+"""Post-load checks of the cuny_curriculum tables.
+
+Each check is either a set-based SQL query or a Python function that streams over the rows it needs.
+Both produce findings: (institution, course_id, rule_key, message) tuples, any of the first three of
+which may be null. The findings of all checks go into the validation_findings table, along with the
+check’s name and severity (error, warning, or info); a check’s findings from its previous run are
+deleted when it runs again.
+
+The checks run concurrently, each on a connection of its own, so adding checks adds little to the
+time it takes to run them all. Checks whose tables don’t exist are skipped.
+
+Example: which institutions have the most GPA gaps in their transfer rules?
+  select institution, count(*)
+  from validation_findings
+  where check_name = 'gpa_gaps'
+  group by institution order by count desc;
+
+Usage:
+  validate.py [--list] [check ...]
+"""
+
+import argparse
+import re
+import sys
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+import psycopg
+from psycopg import sql
+
+from bulk_load import copy_rows
+
+Check = namedtuple('Check', 'severity tables query description')
+
+_columns = ['check_name', 'severity', 'institution', 'course_id', 'rule_key', 'message']
+
+
+# Streaming checks
+# -------------------------------------------------------------------------------------------------
+def unbalanced_titles(conn):
+  """Generate findings for course titles with unbalanced parentheses or brackets."""
+  pairs = {')': '(', ']': '['}
+  with conn.cursor(name='unbalanced_titles') as cursor:
+    cursor.execute("""
+                   select institution, course_id, discipline, catalog_number, title
+                     from cuny_courses
+                   """)
+    for institution, course_id, discipline, catalog_number, title in cursor:
+      stack = []
+      for char in re.sub(r'[^()[\]]', '', title):
+        if char in pairs:
+          if not stack or stack.pop() != pairs[char]:
+            stack.append(char)
+            break
+        else:
+          stack.append(char)
+      if stack:
+        yield (institution, course_id, None,
+               f'{discipline} {catalog_number}: unbalanced parentheses or brackets in “{title}”')
+
+
+# The checks
+# -------------------------------------------------------------------------------------------------
+_gpa_ranges = """
+  with ranges as (
+    select distinct r.destination_institution as institution, s.course_id, s.min_gpa,
+                    least(s.max_gpa, 4.3) as max_gpa
+      from transfer_rules r
+           join source_courses s
+             on s.destination_institution = r.destination_institution and s.rule_id = r.id),
+  sequenced as (
+    select institution, course_id, min_gpa, max_gpa,
+           count(*) over course as num_ranges,
+           row_number() over ordered as seq,
+           lag(max_gpa) over ordered as previous_max
+      from ranges
+    window course as (partition by institution, course_id),
+           ordered as (partition by institution, course_id order by min_gpa, max_gpa))
+  select institution, course_id, null,
+         'GPA ranges for transferring to ' || institution || ' '
+         || string_agg(min_gpa || '-' || max_gpa, ', ' order by seq) || ' {}'
+    from sequenced
+   where num_ranges > 1
+   group by institution, course_id
+  having bool_or({})
+  """
+
+checks = {
+    'contact_hours': Check('warning', ['cuny_courses'], """
+        select institution, course_id, null,
+               discipline || ' ' || catalog_number || ': contact hours (' || contact_hours
+               || ') are not the sum of the component contact hours (' || component_hours || ')'
+          from cuny_courses,
+               lateral (select coalesce(sum((component->>1)::real), 0) as component_hours
+                          from jsonb_array_elements(components) component) hours
+         where course_status = 'A' and component_hours <> contact_hours
+        """, 'Active courses whose contact hours are not the sum of their components’ hours'),
+
+    'gpa_gaps': Check('info', ['transfer_rules', 'source_courses'],
+                      _gpa_ranges.format('have a gap',
+                                         '(seq = 1 and min_gpa <> 0) '
+                                         'or min_gpa - previous_max > 0.3'),
+                      'Source courses whose GPA ranges for a destination leave a gap'),
+
+    'gpa_overlaps': Check('info', ['transfer_rules', 'source_courses'],
+                          _gpa_ranges.format('overlap', 'previous_max - min_gpa > 0.3'),
+                          'Source courses whose GPA ranges for a destination overlap'),
+
+    'rules_without_courses': Check('error', ['transfer_rules', 'source_courses',
+                                             'destination_courses'], """
+        select source_institution, null::integer, rule_key, 'Rule has no source courses'
+          from transfer_rules r
+         where not exists (select 1 from source_courses s
+                            where s.destination_institution = r.destination_institution
+                              and s.rule_id = r.id)
+        union all
+        select source_institution, null::integer, rule_key, 'Rule has no destination courses'
+          from transfer_rules r
+         where not exists (select 1 from destination_courses d
+                            where d.destination_institution = r.destination_institution
+                              and d.rule_id = r.id)
+        """, 'Transfer rules without source or destination courses'),
+
+    'unknown_rule_courses': Check('error', ['cuny_courses', 'transfer_rules', 'source_courses',
+                                            'destination_courses'], """
+        select null, s.course_id, r.rule_key,
+               'Source course ' || lpad(s.course_id::text, 6, '0') || '.' || s.offer_nbr
+               || ' is not in cuny_courses'
+          from source_courses s
+               join transfer_rules r
+                 on (r.destination_institution, r.id) = (s.destination_institution, s.rule_id)
+         where not exists (select 1 from cuny_courses c
+                            where c.course_id = s.course_id and c.offer_nbr = s.offer_nbr)
+        union all
+        select null, d.course_id, r.rule_key,
+               'Destination course ' || lpad(d.course_id::text, 6, '0') || '.' || d.offer_nbr
+               || ' is not in cuny_courses'
+          from destination_courses d
+               join transfer_rules r
+                 on (r.destination_institution, r.id) = (d.destination_institution, d.rule_id)
+         where not exists (select 1 from cuny_courses c
+                            where c.course_id = d.course_id and c.offer_nbr = d.offer_nbr)
+        """, 'Transfer rule courses that are not in the catalog'),
+
+    # The aliases that source_courses.aliases used to hold, compared with the ones in cross_listings
+    # (create_cuny_courses.sql): offer_count was the number of the course’s offers when its rule was
+    # loaded.
+    'cross_listing_aliases': Check('warning',
+                                   ['transfer_rules', 'source_courses', 'cross_listings'], """
+        select r.source_institution, s.course_id, r.rule_key,
+               'Source course ' || lpad(s.course_id::text, 6, '0') || '.' || s.offer_nbr
+               || ' has ' || (s.offer_count - 1) || ' aliases in the rule, but '
+               || count(x.offer_nbr) filter (where x.offer_nbr <> s.offer_nbr
+                                               and x.institution = r.source_institution)
+               || ' in cross_listings, and '
+               || count(x.offer_nbr) filter (where x.institution <> r.source_institution)
+               || ' offers at other institutions'
+          from source_courses s
+               join transfer_rules r
+                 on (r.destination_institution, r.id) = (s.destination_institution, s.rule_id)
+               left join cross_listings x on x.course_id = s.course_id
+         group by r.source_institution, s.course_id, s.offer_nbr, s.offer_count, r.rule_key
+        having count(x.offer_nbr) filter (where x.offer_nbr <> s.offer_nbr
+                                            and x.institution = r.source_institution)
+               <> s.offer_count - 1
+            or count(x.offer_nbr) filter (where x.institution <> r.source_institution) > 0
+        """, 'Source courses whose aliases in cross_listings differ from the ones in the rule'),
+
+    'unbalanced_titles': Check('info', ['cuny_courses'], unbalanced_titles,
+                               'Course titles with unbalanced parentheses or brackets'),
+}
+
+
+def create_findings_table(conn):
+  """Create the validation_findings table if it doesn’t exist already."""
+  conn.execute("""
+               create table if not exists validation_findings (
+                 check_name text not null,
+                 severity text not null,
+                 institution text,
+                 course_id integer,
+                 rule_key text,
+                 message text not null,
+                 found_at timestamptz default now());
+               create index if not exists validation_findings_check_name
+                 on validation_findings (check_name)
+               """)
+
+
+def run_check(check_name: str) -> tuple:
+  """Run a check on a connection of its own. Returns the number of findings (None if the check
+  failed), the seconds taken, and the error if it failed.
+  """
+  start_time = perf_counter()
+  try:
+    num_findings = _run_check(check_name)
+    error = None
+  except Exception as err:
+    num_findings, error = None, err
+  return num_findings, perf_counter() - start_time, error
+
+
+def _run_check(check_name: str) -> int:
+  """Run a check and record its findings; return the number of findings."""
+  check = checks[check_name]
+  with psycopg.connect('dbname=cuny_curriculum') as conn:
+    conn.execute('delete from validation_findings where check_name = %s', (check_name, ))
+    if callable(check.query):
+      # The check streams from a server-side cursor, so the findings are copied on a connection
+      # that isn’t busy with that.
+      with psycopg.connect('dbname=cuny_curriculum') as read_conn:
+        with conn.cursor() as cursor:
+          num_findings = copy_rows(cursor, 'validation_findings', _columns,
+                                   ((check_name, check.severity, *finding)
+                                    for finding in check.query(read_conn)))
+    else:
+      # The check’s name and severity go in as literals: the query is executed without parameters,
+      # so psycopg leaves any % characters in it alone.
+      insert = sql.SQL('insert into validation_findings ({}) select {}, {}, * from ({}) findings')
+      cursor = conn.execute(insert.format(sql.SQL(', ').join(map(sql.Identifier, _columns)),
+                                          sql.Literal(check_name), sql.Literal(check.severity),
+                                          sql.SQL(check.query)))
+      num_findings = cursor.rowcount
+  return num_findings
+
+
+def run_checks(check_names=None, file=sys.stdout) -> dict:
+  """Run the named checks (default: all of them) concurrently, and report the number of findings of
+  each one. Returns a dict of finding counts, keyed by check name; the count is None for a check
+  that failed. A check that fails doesn’t stop the others.
+  """
+  check_names = list(checks.keys()) if check_names is None else check_names
+  with psycopg.connect('dbname=cuny_curriculum') as conn:
+    create_findings_table(conn)
+    runnable = []
+    for check_name in check_names:
+      missing = [table_name for table_name in checks[check_name].tables
+                 if conn.execute('select to_regclass(%s)', (table_name, )).fetchone()[0] is None]
+      if missing:
+        print(f'  {check_name:24} skipped: no {", ".join(missing)}', file=file)
+      else:
+        runnable.append(check_name)
+
+  counts = dict()
+  with ThreadPoolExecutor(max_workers=max(1, len(runnable))) as executor:
+    for check_name, (num_findings, seconds, error) in zip(runnable,
+                                                          executor.map(run_check, runnable)):
+      counts[check_name] = num_findings
+      if error is None:
+        print(f'  {check_name:24} {checks[check_name].severity:8} {num_findings:>9,} findings '
+              f'({seconds:.1f} sec)', file=file)
+      else:
+        print(f'  {check_name:24} FAILED: {error}', file=file)
+  return counts
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Check the cuny_curriculum tables')
+  parser.add_argument('-l', '--list', action='store_true')
+  parser.add_argument('check_names', metavar='check', nargs='*')
+  args = parser.parse_args()
+  for check_name in args.check_names:
+    if check_name not in checks:
+      parser.error(f'unknown check: {check_name} (choose from {", ".join(checks.keys())})')
+
+  if args.list:
+    for check_name, check in checks.items():
+      print(f'{check_name:24} {check.severity:8} {check.description}')
+    sys.exit(0)
+
+  counts = run_checks(args.check_names or None)
+  if None in counts.values():
+    sys.exit(1)